@@ -1,13 +1,36 @@
 from enum import Enum
 import os
+import sys
+import glob
+import json
 import argparse
 import time
+import itertools
+from typing import Dict, List, Tuple
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from backtesting import Strategy, Backtest
 
+from price_store import PriceStore, is_price_store
+from pos_manager_engine import (POS_MANAGER_LONG_SIZE, POS_MANAGER_SHORT_SIZE, POS_MANAGER_PYRAMID_SIZE, POS_MANAGER_TAKE_PROFIT_PCT, POS_MANAGER_STOP_LOSS_PCT,
+                                POS_MANAGER_PYRAMID_TRADE_PCT, POS_MANAGER_MAX_TRADES, SWEEP_PARAMETERS, PosManagerParams, PosManagerSession, RunningStats, run_pos_manager, stats_differences, sweep_pos_manager)
+
 DEFAULT_CHUNK_SIZE    = 5000000         # The price file will be very large - so we will process it in chunks
 NO_CHUNK_SIZE_VALUE   = -1              # Use this value to process the entire file in one chunk
 NO_CHUNK_INDEX_VALUE  = "NoChunk"
+CONTINUOUS_INDEX      = "Continuous"    # Output name of a --continuous run, one set of files for all chunks
+STITCHED_INDEX        = "Stitched"      # Output name of a --workers run
+SWEEP_INDEX           = "Sweep"         # Output name of a --sweep run, its stat file ranks the parameter sets
+DEFAULT_SWEEP_SORT_BY = "Return [%]"
+
+OUTPUT_FORMAT_CSV     = "csv"
+OUTPUT_FORMAT_PARQUET = "parquet"       # Trades and equity as zstd compressed Parquet, a fraction of the CSV size and write time
+OUTPUT_FORMATS        = [OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_PARQUET]
+DEFAULT_OUTPUT_FORMAT = OUTPUT_FORMAT_CSV
+PARQUET_COMPRESSION   = "zstd"
 DATA_DIR              = "data"  
 RESULTS_DIR           = "results"     
 
@@ -16,6 +39,22 @@ DEFAULT_TRADE_FILE    = "signal - yosemite btc - slow.csv"
 
 NUM_PRICES_PER_HOUR   = 60 * 60         # When using minute data, it should be 60.  Seconds data should be 60 x 60
 
+ENGINE_NUMBA          = "numba"         # pos_manager_engine.py, same trades as backtesting.py without the per bar Python calls, check with --validate
+ENGINE_BACKTESTING    = "backtesting"
+ENGINES               = [ENGINE_NUMBA, ENGINE_BACKTESTING]
+DEFAULT_ENGINE        = ENGINE_BACKTESTING
+DEFAULT_VALIDATE_CHUNKS = 1             # Chunks --validate runs through both engines
+
+DEFAULT_WORKERS       = 0               # 0 runs the chunks one after another, each with its own result files
+DEFAULT_WARMUP_BARS   = 24 * NUM_PRICES_PER_HOUR  # Bars run before and after each parallel chunk so its trades match the neighbouring chunks
+
+STAGE_READ            = "read"          # CSV parse, or the slice of a price store
+STAGE_CONVERT         = "convert"       # 'Open time' to the DatetimeIndex
+STAGE_MERGE           = "merge"         # Signals placed on the price rows
+STAGE_ENGINE          = "engine"
+STAGE_WRITE           = "write"         # Equity, trades and stat files
+STAGES                = [STAGE_READ, STAGE_CONVERT, STAGE_MERGE, STAGE_ENGINE, STAGE_WRITE]
+
 
 def _extract_file_name_no_ext(absolute_path: str) -> str:
   return os.path.splitext(os.path.basename(absolute_path))[0]
@@ -47,44 +86,74 @@ class pos_manager(Strategy):
 
         if not self.position:
             if self.signal[-1] == 1:
-                self.buy(size=0.4)
+                self.buy(size=POS_MANAGER_LONG_SIZE)
 
             if self.signal[-1] == 2:
-                self.sell(size=0.3)
+                self.sell(size=POS_MANAGER_SHORT_SIZE)
 
         elif self.position.size > 0:
-            if self.position.pl_pct > 0.003:
+            if self.position.pl_pct > POS_MANAGER_TAKE_PROFIT_PCT:
                 self.position.close()
            
             elif self.position.pl_pct < -0.00 and self.signal[-1] == 2:
                 self.position.close()
 
-            elif self.position.pl_pct < -0.05:
+            elif self.position.pl_pct < POS_MANAGER_STOP_LOSS_PCT:
                 self.position.close()
                    
-            elif trades_len and self.trades[-1].pl_pct < -0.0040 and bars_since_prev_trade > NUM_PRICES_PER_HOUR and trades_len < 5:
-                self.buy(size=0.2)
+            elif trades_len and self.trades[-1].pl_pct < POS_MANAGER_PYRAMID_TRADE_PCT and bars_since_prev_trade > NUM_PRICES_PER_HOUR and trades_len < POS_MANAGER_MAX_TRADES:
+                self.buy(size=POS_MANAGER_PYRAMID_SIZE)
 
         elif self.position.size < 0:
-            if self.position.pl_pct > 0.003:
+            if self.position.pl_pct > POS_MANAGER_TAKE_PROFIT_PCT:
                 self.position.close()
            
             elif self.position.pl_pct < -0.00 and (self.signal[-1] == 1 or self.signal[-1] ==2):
                 self.position.close()
 
-            elif trades_len and self.trades[-1].pl_pct < -0.0040 and bars_since_prev_trade > NUM_PRICES_PER_HOUR and trades_len < 5:
-                self.sell(size=0.2)
+            elif trades_len and self.trades[-1].pl_pct < POS_MANAGER_PYRAMID_TRADE_PCT and bars_since_prev_trade > NUM_PRICES_PER_HOUR and trades_len < POS_MANAGER_MAX_TRADES:
+                self.sell(size=POS_MANAGER_PYRAMID_SIZE)
+
+
+
+
+def _to_utc_ns(times) -> np.ndarray:
+  times = pd.DatetimeIndex(times)
+  times = times.tz_convert('UTC') if times.tz is not None else times.tz_localize('UTC')
+
+  return times.as_unit('ns').asi8
+
+
+
+def _read_trade_file(file_path: str) -> Tuple[np.ndarray, np.ndarray]:
+  # The signals stay sparse: int64 UTC timestamps in time order (rows with the same time keep their file order) and
+  # their signal values. The wall time in the file is taken as UTC.
+  df_trades     = pd.read_csv(file_path, usecols=['Date/Time', 'signal'])
+  signal_times  = pd.DatetimeIndex(pd.to_datetime(df_trades['Date/Time']))
+  signal_times  = _to_utc_ns(signal_times.tz_localize(None) if signal_times.tz is not None else signal_times)
+  order         = np.argsort(signal_times, kind='stable')
+
+  return signal_times[order], np.nan_to_num(df_trades['signal'].to_numpy(dtype=np.float64)[order], nan=0.0)
+
+
 
+def _read_price_file(price_file: str) -> pd.DataFrame:
+  if is_price_store(price_file):
+    return PriceStore(price_file).to_frame().reset_index()
 
+  return pd.read_csv(price_file)
 
 
-def _read_trade_file(file_path: str) -> pd.DataFrame:          
-  df_trades               = pd.read_csv(file_path)
-  df_trades['Date/Time']  = pd.to_datetime(df_trades['Date/Time']).dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-  df_trades               = df_trades.set_index('Date/Time')
-  df_trades.index         = pd.to_datetime(df_trades.index)
 
-  return df_trades
+def _read_price_chunks(price_file: str, chunk_size: int):
+  # A price store (price_store.py) is sliced from its memory maps instead of parsing the CSV again, the chunks are the same rows
+  if chunk_size == NO_CHUNK_SIZE_VALUE:
+    yield _read_price_file(price_file)
+  elif is_price_store(price_file):
+    for chunk_df in PriceStore(price_file).iter_chunks(chunk_size):
+      yield chunk_df.reset_index()
+  else:
+    yield from pd.read_csv(price_file, chunksize=chunk_size)
 
 
 
@@ -97,17 +166,42 @@ def _convert_chunk_df_to_correct_format(chunk_df: pd.DataFrame) -> pd.DataFrame:
 
 
 
-def _merge_price_and_trade(df_prices: pd.DataFrame, df_trades: pd.DataFrame) -> pd.DataFrame:
-  df = pd.merge(df_prices, df_trades, left_on='Open time', right_on='Date/Time', how='left')
-  df['signal']=df['signal'].fillna(0)
-  df = df.set_index('datetime')
+def _merge_price_and_trade(df_prices: pd.DataFrame, signals: Tuple[np.ndarray, np.ndarray]) -> pd.DataFrame:
+  # Signals are placed on the price rows with the same time by binary search on the (sorted) price times
+  signal_times, signal_values = signals
+  price_times = _to_utc_ns(df_prices.index)
+  rows        = np.searchsorted(price_times, signal_times)
+  matched     = rows < len(price_times)
+  matched[matched] = price_times[rows[matched]] == signal_times[matched]
+  rows        = rows[matched]
+  values      = signal_values[matched]
+
+  df = df_prices.set_index('datetime')
+  counts = np.bincount(rows, minlength=len(df))
+  if counts.max(initial=0) > 1:
+    # A price row with several signals is repeated once per signal, in file order, as the left join on the time did
+    repeats = np.maximum(counts, 1)
+    df      = df.iloc[np.repeat(np.arange(len(df)), repeats)]
+    rows    = (np.cumsum(repeats) - repeats)[rows] + np.arange(len(rows)) - np.searchsorted(rows, rows)
+
+  signal        = np.zeros(len(df))
+  signal[rows]  = values
+  df['signal']  = signal
 
   return df
 
 
 
-def _process_backtest_chunk(df_prices: pd.DataFrame, df_trades: pd.DataFrame):
-  merged_df = _merge_price_and_trade(df_prices, df_trades)
+def _pos_manager_params() -> PosManagerParams:
+  # The Backtest() arguments below, and pos_manager pyramids after NUM_PRICES_PER_HOUR bars
+  return PosManagerParams(cash=100_000_000, commission=.0014, margin=0.25, pyramid_bars=NUM_PRICES_PER_HOUR)
+
+
+
+def _run_backtest(merged_df: pd.DataFrame, engine: str):
+  if engine == ENGINE_NUMBA:
+    return run_pos_manager(merged_df, _pos_manager_params())
+
   bt = Backtest(  merged_df
                 , pos_manager
                 , cash              = 100_000_000
@@ -122,8 +216,6 @@ def _process_backtest_chunk(df_prices: pd.DataFrame, df_trades: pd.DataFrame):
 
 
 
-
-
 def _generate_output_file_prefix(price_file: str, trade_file: str, chunk_index: int) -> str:
   price_name = _extract_file_name_no_ext(price_file)
   trade_name = _extract_file_name_no_ext(trade_file)
@@ -132,65 +224,530 @@ def _generate_output_file_prefix(price_file: str, trade_file: str, chunk_index:
 
 
 
-def _generate_output_file_name(file_prefix: str, name: str) -> str:
-  return RESULTS_DIR + f"/{file_prefix + '_' + name }" + ".csv"
+def _generate_output_file_name(file_prefix: str, name: str, output_format: str = OUTPUT_FORMAT_CSV) -> str:
+  return RESULTS_DIR + f"/{file_prefix + '_' + name }" + "." + output_format
+
+
+
+def _generate_result_index_file_name(price_file: str, trade_file: str, output_format: str) -> str:
+  return RESULTS_DIR + f"/{_extract_file_name_no_ext(price_file)}_{_extract_file_name_no_ext(trade_file)}_index.{output_format}"
+
+
+
+class _ResultWriter:
+  """
+  Writes the equity curve and the trades of one result, given chunk by chunk, as CSV or Parquet files.
+
+  With equity_resample (a pandas offset such as '1min' or '1D') only the last row of each period of the equity
+  curve is written. The last period of a chunk is held back, the next chunk may continue it.
+  """
+  def __init__(self, file_prefix: str, output_format: str = DEFAULT_OUTPUT_FORMAT, equity_resample: str = None):
+    self.file_prefix      = file_prefix
+    self.output_format    = output_format
+    self.equity_resample  = equity_resample
+    self.equity_file      = _generate_output_file_name(file_prefix, 'equity', output_format)
+    self.trades_file      = _generate_output_file_name(file_prefix, 'trades', output_format)
+    self.stat_file        = _generate_output_file_name(file_prefix, 'stat')
+    self.equity_writer    = None
+    self.equity_rows      = 0
+    self.pending_equity   = None
+    self.trades           = []
+
+  def _write_equity_rows(self, equity_df: pd.DataFrame):
+    if self.output_format == OUTPUT_FORMAT_PARQUET:
+      import pyarrow as pa
+      import pyarrow.parquet as pq
+
+      table = pa.Table.from_pandas(equity_df, schema=self.equity_writer.schema if self.equity_writer else None, preserve_index=True)
+      if self.equity_writer is None:
+        self.equity_writer = pq.ParquetWriter(self.equity_file, table.schema, compression=PARQUET_COMPRESSION)
+      self.equity_writer.write_table(table)
+    else:
+      equity_df.to_csv(self.equity_file, mode='a' if self.equity_rows else 'w', header=not self.equity_rows)
+    self.equity_rows += len(equity_df)
+
+  def write(self, equity_df: pd.DataFrame, trades_df: pd.DataFrame):
+    self.trades.append(trades_df)
+    if self.equity_resample:
+      equity_df = equity_df.resample(self.equity_resample).last().dropna(subset=['Equity'])
+      if self.pending_equity is not None:
+        if len(equity_df) and equity_df.index[0] == self.pending_equity.index[0]:
+          equity_df = pd.concat([equity_df.iloc[:1].combine_first(self.pending_equity), equity_df.iloc[1:]])
+        else:
+          equity_df = pd.concat([self.pending_equity, equity_df])
+      self.pending_equity, equity_df = equity_df.iloc[-1:], equity_df.iloc[:-1]
+    self._write_equity_rows(equity_df)
+
+  def close(self, stat: pd.Series) -> dict:
+    """
+    Write the held back equity, the trades and the stat file. Returns the result's row of the result index.
+    """
+    if self.pending_equity is not None:
+      self._write_equity_rows(self.pending_equity)
+    if self.equity_writer is None and self.equity_rows == 0:
+      # No equity at all, the result still gets an (empty) equity file
+      self._write_equity_rows(pd.DataFrame(columns=['Equity', 'DrawdownPct', 'DrawdownDuration']))
+    if self.equity_writer is not None:
+      self.equity_writer.close()
+
+    trades_df       = pd.concat(self.trades) if self.trades else pd.DataFrame()
+    trades_df.index = range(len(trades_df))
+    if self.output_format == OUTPUT_FORMAT_PARQUET:
+      trades_df.to_parquet(self.trades_file, compression=PARQUET_COMPRESSION)
+    else:
+      trades_df.to_csv(self.trades_file)
+    stat.to_csv(self.stat_file)
+
+    index_row = {'result': self.file_prefix, 'equity_file': self.equity_file, 'equity_rows': self.equity_rows,
+                 'trades_file': self.trades_file, 'stat_file': self.stat_file}
+    index_row.update({key: value for key, value in stat.items() if not key.startswith('_')})
+    return index_row
+
+
+
+def _write_result_index(index_rows: List[dict], index_file: str):
+  # One row per result of the run: its files and the scalar stats, enough to pick the results to load
+  index_df = pd.DataFrame(index_rows)
+  for column in index_df.columns[index_df.dtypes == object]:
+    if index_df[column].map(lambda value: isinstance(value, pd.Timedelta) or pd.isna(value)).all():
+      index_df[column] = pd.to_timedelta(index_df[column])
+
+  if index_file.endswith(OUTPUT_FORMAT_PARQUET):
+    index_df.to_parquet(index_file, compression=PARQUET_COMPRESSION)
+  else:
+    index_df.to_csv(index_file, index=False)
+
+
+
+def _output_to_files(stat: pd.DataFrame, file_prefix: str, output_format: str = DEFAULT_OUTPUT_FORMAT, equity_resample: str = None) -> dict:
+  writer = _ResultWriter(file_prefix, output_format, equity_resample)
+  writer.write(stat['_equity_curve'], stat['_trades'])
+
+  return writer.close(stat)
+
+
+
+def _generate_metrics_file_name(price_file: str) -> str:
+  return RESULTS_DIR + f"/{_extract_file_name_no_ext(price_file)}_metrics.jsonl"
 
 
 
-def _output_to_files(stat: pd.DataFrame, file_prefix: str):
-  trades_stat = stat['_trades']
-  trades_csv_file_name = _generate_output_file_name(file_prefix, 'trades')
-  trades_stat.to_csv(trades_csv_file_name)
-  
-  stat_csv_file_name = _generate_output_file_name(file_prefix, 'stat')
-  stat.to_csv(stat_csv_file_name)
+def _peak_rss_mb() -> float:
+  # Peak resident memory of this process so far. ru_maxrss is in KB on Linux and in bytes on macOS, Windows has no resource module
+  # and reads it with psutil when that is installed (NaN otherwise, the metrics then have no peak RSS).
+  try:
+    import resource
+  except ImportError:
+    try:
+      import psutil
+    except ImportError:
+      return np.nan
+    return psutil.Process().memory_info().peak_wset / 2**20
+
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak_rss / 2**20 if sys.platform == 'darwin' else peak_rss / 2**10
+
 
-  equity_curve_stat = stat['_equity_curve']
-  
-  equity = equity_curve_stat # equity_curve_stat.resample('1D').last()  
-  equity_csv_file_name = _generate_output_file_name(file_prefix, 'equity')
-  equity.to_csv(equity_csv_file_name)
 
+def _round_mb(megabytes: float):
+  # NaN is not valid JSON, an unknown peak RSS is written as null
+  return None if np.isnan(megabytes) else round(megabytes, 1)
 
 
 
-def _process_one_chunk(chunk_df: pd.DataFrame, price_file: str, trade_file: str, chunk_index_as_str: str, df_trades: pd.DataFrame):
+class _StageMetrics:
+  """
+  Times the stages of the chunked pipeline (read, convert, merge, engine, write). One JSON line per stage and chunk is
+  appended to the metrics file, with its rows per second and the peak RSS of the process that ran it. summary() adds
+  one line per stage with the totals of the run, so runs of several engines or versions can be compared in one file.
+  """
+  def __init__(self, metrics_file: str, run_info: dict):
+    self.metrics_file = metrics_file
+    self.run_info     = {'run': pd.Timestamp.now(tz='UTC').isoformat(), **run_info}
+    self.totals       = {stage: {'chunks': 0, 'rows': 0, 'seconds': 0.0, 'peak_rss_mb': np.nan} for stage in STAGES}
+    self.start_time   = time.perf_counter()
+
+  def _write(self, line: dict):
+    with open(self.metrics_file, 'a') as f:
+      f.write(json.dumps({**self.run_info, **line}) + '\n')
+
+  def record(self, stage: str, chunk_index, rows: int, seconds: float, trade_file: str = None, peak_rss_mb: float = None):
+    peak_rss_mb             = _peak_rss_mb() if peak_rss_mb is None else peak_rss_mb
+    totals                  = self.totals[stage]
+    totals['chunks']       += 1
+    totals['rows']         += rows
+    totals['seconds']      += seconds
+    totals['peak_rss_mb']   = float(np.fmax(totals['peak_rss_mb'], peak_rss_mb))
+    self._write({'stage': stage, 'chunk': str(chunk_index), 'trade_file': trade_file and _extract_file_name_no_ext(trade_file), 'rows': rows,
+                 'seconds': round(seconds, 6), 'rows_per_sec': round(rows / seconds) if seconds > 0 else None, 'peak_rss_mb': _round_mb(peak_rss_mb)})
+
+  @contextmanager
+  def stage(self, stage: str, chunk_index, trade_file: str = None, rows: int = 0):
+    start_time = time.perf_counter()
+    yield
+    self.record(stage, chunk_index, rows, time.perf_counter() - start_time, trade_file)
+
+  def read_chunks(self, chunks):
+    # The CSV is parsed inside next(), so each step of the reader is timed
+    chunks = iter(chunks)
+    for chunk_index in itertools.count():
+      start_time  = time.perf_counter()
+      chunk_df    = next(chunks, None)
+      if chunk_df is None:
+        return
+      self.record(STAGE_READ, chunk_index, len(chunk_df), time.perf_counter() - start_time)
+      yield chunk_df
+
+  def consumer_time(self, chunks, stage: str, trade_file: str = None):
+    # For the engines that take a chunk iterator: the time between handing out a chunk and the request for the next one
+    for chunk_index, chunk_df in enumerate(chunks):
+      start_time = time.perf_counter()
+      yield chunk_df
+      self.record(stage, chunk_index, len(chunk_df), time.perf_counter() - start_time, trade_file)
+
+  def summary(self):
+    # With --workers the engine runs next to the other stages, so the shares can add up to more than 100%
+    wall_seconds = time.perf_counter() - self.start_time
+    print(f'      {"Stage":<8}{"Rows":>16}{"Seconds":>12}{"Rows/sec":>14}{"Share":>8}{"Peak RSS MB":>13}')
+    for stage, totals in self.totals.items():
+      if totals['chunks'] == 0:
+        continue
+      rows_per_sec = totals['rows'] / totals['seconds'] if totals['seconds'] > 0 else 0.0
+      share        = totals['seconds'] / wall_seconds if wall_seconds > 0 else 0.0
+      self._write({'stage': stage, 'chunk': 'summary', 'chunks': totals['chunks'], 'rows': totals['rows'], 'seconds': round(totals['seconds'], 6),
+                   'rows_per_sec': round(rows_per_sec), 'share': round(share, 4), 'peak_rss_mb': _round_mb(totals['peak_rss_mb']), 'wall_seconds': round(wall_seconds, 3)})
+      print(f'      {stage:<8}{totals["rows"]:>16,}{totals["seconds"]:>12.2f}{rows_per_sec:>14,.0f}{share:>8.1%}{totals["peak_rss_mb"]:>13.1f}')
+    print(f'      Metrics appended to "{self.metrics_file}"')
+
+
+
+def _converted_chunks(chunks, metrics: _StageMetrics):
+  for chunk_index, chunk_df in enumerate(metrics.read_chunks(chunks)):
+    with metrics.stage(STAGE_CONVERT, chunk_index, rows=len(chunk_df)):
+      chunk_df = _convert_chunk_df_to_correct_format(chunk_df)
+    yield chunk_df
+
+
+
+def _merged_chunks(chunks, trade_file: str, signals: Tuple[np.ndarray, np.ndarray], metrics: _StageMetrics):
+  for chunk_index, chunk_df in enumerate(chunks):
+    with metrics.stage(STAGE_MERGE, chunk_index, trade_file, len(chunk_df)):
+      merged_df = _merge_price_and_trade(chunk_df, signals)
+    yield merged_df
+
+
+
+
+def _process_one_chunk(chunk_df: pd.DataFrame, price_file: str, trade_file: str, chunk_index_as_str: str, signals: Tuple[np.ndarray, np.ndarray], engine: str,
+                       metrics: _StageMetrics, output_format: str = DEFAULT_OUTPUT_FORMAT, equity_resample: str = None) -> dict:
+  # chunk_df is already converted, it is shared by every trade file of the run
   start_time  = time.time()
-  chunk_df    = _convert_chunk_df_to_correct_format(chunk_df)
-  stat        = _process_backtest_chunk(chunk_df, df_trades.copy())
+  with metrics.stage(STAGE_MERGE, chunk_index_as_str, trade_file, len(chunk_df)):
+    merged_df = _merge_price_and_trade(chunk_df, signals)
+  with metrics.stage(STAGE_ENGINE, chunk_index_as_str, trade_file, len(merged_df)):
+    stat      = _run_backtest(merged_df, engine)
   file_prefix = _generate_output_file_prefix(price_file, trade_file, chunk_index_as_str)
-  _output_to_files(stat, file_prefix)
+  with metrics.stage(STAGE_WRITE, chunk_index_as_str, trade_file, len(merged_df)):
+    index_row = _output_to_files(stat, file_prefix, output_format, equity_resample)
   end_time    = time.time()
-  print(f'      Processed chunk {chunk_index_as_str} in {end_time - start_time} seconds.')
+  print(f'      Processed chunk {chunk_index_as_str} of "{_extract_file_name_no_ext(trade_file)}" in {end_time - start_time} seconds.')
+
+  return index_row
 
   
 
 
 
-def _process_backtest(price_file: str, trade_file: str, chunk_size: int):  
-  print(f'Processing backtest using price file "{price_file}" and trade file "{trade_file}"...')
-  df_trades = _read_trade_file(trade_file)
+def _process_continuous_backtest(price_file: str, signal_sets: Dict[str, Tuple[np.ndarray, np.ndarray]], chunk_size: int, metrics: _StageMetrics,
+                                 output_format: str = DEFAULT_OUTPUT_FORMAT, equity_resample: str = None) -> Dict[str, dict]:
+  # One backtest per trade file over all the chunks: positions, cash and the pending order carry over from one chunk to
+  # the next, the equity files are appended chunk by chunk and the stats are computed at the end
+  sessions      = {trade_file: PosManagerSession(_pos_manager_params()) for trade_file in signal_sets}
+  writers       = {trade_file: _ResultWriter(_generate_output_file_prefix(price_file, trade_file, CONTINUOUS_INDEX), output_format, equity_resample)
+                   for trade_file in signal_sets}
 
-  if chunk_size == NO_CHUNK_SIZE_VALUE:
-    chunk_df = pd.read_csv(price_file)
-    _process_one_chunk(chunk_df, price_file, trade_file, NO_CHUNK_INDEX_VALUE, df_trades) 
+  start_time = time.time()
+  for chunk_index, chunk_df in enumerate(_converted_chunks(_read_price_chunks(price_file, chunk_size), metrics)):
+    for trade_file, signals in signal_sets.items():
+      with metrics.stage(STAGE_MERGE, chunk_index, trade_file, len(chunk_df)):
+        merged_df = _merge_price_and_trade(chunk_df, signals)
+      with metrics.stage(STAGE_ENGINE, chunk_index, trade_file, len(merged_df)):
+        equity_df, trades_df = sessions[trade_file].run_chunk(merged_df)
+      with metrics.stage(STAGE_WRITE, chunk_index, trade_file, len(merged_df)):
+        writers[trade_file].write(equity_df, trades_df)
+    end_time    = time.time()
+    print(f'      Processed chunk {chunk_index} in {end_time - start_time} seconds.')
+    start_time  = end_time
+
+  index_rows = {}
+  for trade_file in signal_sets:
+    with metrics.stage(STAGE_WRITE, 'finish', trade_file):
+      index_rows[trade_file] = writers[trade_file].close(sessions[trade_file].finish())
+
+  return index_rows
+
+
+
+def _overlapping_windows(merged_chunks, warmup_bars: int):
+  # Each chunk with up to warmup_bars rows of the previous chunk before it and of the next chunk after it.
+  # Yields (window_df, chunk_start, chunk_end, first_bar): the chunk is window_df[chunk_start:chunk_end]
+  # and window_df starts on bar first_bar of the whole price file.
+  prev_tail, current, current_bar = None, None, 0
+  for chunk_df in merged_chunks:
+    if current is not None:
+      yield _build_window(prev_tail, current, chunk_df.iloc[:warmup_bars], current_bar)
+      prev_tail    = current.iloc[len(current) - min(warmup_bars, len(current)):]
+      current_bar += len(current)
+    current = chunk_df
+
+  if current is not None:
+    yield _build_window(prev_tail, current, None, current_bar)
+
+
+
+def _build_window(prev_tail: pd.DataFrame, chunk_df: pd.DataFrame, next_head: pd.DataFrame, chunk_bar: int):
+  parts       = [df for df in (prev_tail, chunk_df, next_head) if df is not None]
+  chunk_start = 0 if prev_tail is None else len(prev_tail)
+
+  return pd.concat(parts), chunk_start, chunk_start + len(chunk_df), chunk_bar - chunk_start
+
+
+
+def _run_window(window_df: pd.DataFrame, engine: str, chunk_start: int, chunk_end: int, first_bar: int):
+  # Runs in a worker process. Returns the chunk's equity relative to the bar before it, that equity, and the trades
+  # entered in the chunk (closed in the chunk or in the rows after it) with bar numbers of the whole price file, plus the
+  # run time and the peak RSS of the worker.
+  start_time  = time.time()
+  stat        = _run_backtest(window_df, engine)
+  equity      = stat['_equity_curve']['Equity'].to_numpy()
+  base        = equity[chunk_start - 1] if chunk_start > 0 else equity[0]
+
+  trades_df   = stat['_trades']
+  trades_df   = trades_df[(trades_df['EntryBar'] >= chunk_start) & (trades_df['EntryBar'] < chunk_end)].copy()
+  trades_df['EntryBar'] += first_bar
+  trades_df['ExitBar']  += first_bar
+
+  return equity[chunk_start:chunk_end] / base, base, trades_df, time.time() - start_time, _peak_rss_mb()
+
+
+
+class _ResultStitcher:
+  """
+  Joins the per chunk results of a --workers run, in chunk order, into one equity curve and trade list.
+
+  Every chunk runs with the starting cash, and pos_manager sizes its trades from the equity, so a chunk is scaled
+  by the equity the previous chunk ended with over the equity the chunk started from: its equity curve, trade
+  sizes, PnL and commissions. Trade returns do not change.
+  """
+  def __init__(self, writer: _ResultWriter, cash: float):
+    self.writer       = writer
+    self.last_equity  = cash
+    self.stats        = RunningStats()
+    self.trades       = []
+
+  def add(self, index: pd.Index, close: np.ndarray, equity_ratio: np.ndarray, start_equity: float, trades_df: pd.DataFrame):
+    scale     = self.last_equity / start_equity
+    equity    = self.last_equity * equity_ratio
+    equity_df = self.stats.update(pd.DatetimeIndex(index), equity, close)
+    if len(equity):
+      self.last_equity = equity[-1]
+
+    trades_df['Size']       = np.round(trades_df['Size'] * scale).astype(np.int64)
+    trades_df['PnL']        = trades_df['PnL'] * scale
+    trades_df['Commission'] = trades_df['Commission'] * scale
+
+    self.writer.write(equity_df, trades_df)
+    self.trades.append(trades_df)
+
+  def finish(self) -> dict:
+    return self.writer.close(self.stats.stats(pd.concat(self.trades, ignore_index=True)))
+
+
+
+def _process_parallel_backtest(price_file: str, signal_sets: Dict[str, Tuple[np.ndarray, np.ndarray]], chunk_size: int, engine: str, workers: int, warmup_bars: int,
+                               metrics: _StageMetrics, output_format: str = DEFAULT_OUTPUT_FORMAT, equity_resample: str = None) -> Dict[str, dict]:
+  # Chunks are read once and merged here with each trade file, every (chunk, trade file) window runs in the pool and at
+  # most 2 x workers windows are in memory at a time. The results are stitched per trade file in chunk order, so they
+  # do not depend on which worker finishes first.
+  stitchers       = {trade_file: _ResultStitcher(_ResultWriter(_generate_output_file_prefix(price_file, trade_file, STITCHED_INDEX), output_format, equity_resample),
+                                                 _pos_manager_params().cash)
+                     for trade_file in signal_sets}
+  chunks          = _converted_chunks(_read_price_chunks(price_file, chunk_size), metrics)
+  # The window generators are advanced together, so tee only ever holds the chunks of one step
+  chunk_copies    = itertools.tee(chunks, len(signal_sets))
+  window_sets     = [_overlapping_windows(_merged_chunks(chunk_copy, trade_file, signals, metrics), warmup_bars)
+                     for chunk_copy, (trade_file, signals) in zip(chunk_copies, signal_sets.items())]
+  pending         = deque()
+
+  def stitch_next():
+    trade_file, chunk_index, window_rows, index, close, future = pending.popleft()
+    equity_ratio, start_equity, trades_df, seconds, worker_peak_rss_mb = future.result()
+    # The engine time is the worker's, the warm-up rows are part of its work
+    metrics.record(STAGE_ENGINE, chunk_index, window_rows, seconds, trade_file, worker_peak_rss_mb)
+    with metrics.stage(STAGE_WRITE, chunk_index, trade_file, len(index)):
+      stitchers[trade_file].add(index, close, equity_ratio, start_equity, trades_df)
+    print(f'      Processed chunk {chunk_index} of "{_extract_file_name_no_ext(trade_file)}" in {seconds} seconds.')
+
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    for chunk_index, windows in enumerate(zip(*window_sets)):
+      for trade_file, (window_df, chunk_start, chunk_end, first_bar) in zip(signal_sets, windows):
+        future = executor.submit(_run_window, window_df, engine, chunk_start, chunk_end, first_bar)
+        pending.append((trade_file, chunk_index, len(window_df), window_df.index[chunk_start:chunk_end], window_df['Close'].to_numpy()[chunk_start:chunk_end], future))
+        if len(pending) >= 2 * workers:
+          stitch_next()
+    while pending:
+      stitch_next()
+
+  index_rows = {}
+  for trade_file, stitcher in stitchers.items():
+    with metrics.stage(STAGE_WRITE, 'finish', trade_file):
+      index_rows[trade_file] = stitcher.finish()
+
+  return index_rows
+
+
+
+def _build_param_grid(grid_values: dict) -> List[PosManagerParams]:
+  # Every combination of the values given per pos_manager parameter, on top of the Backtest() arguments
+  base_params = _pos_manager_params()
+  names       = list(grid_values)
+
+  return [PosManagerParams(**{**base_params.__dict__, **dict(zip(names, values))}) for values in itertools.product(*grid_values.values())]
+
+
+
+def _process_sweep(price_file: str, trade_file: str, chunk_size: int, signals: Tuple[np.ndarray, np.ndarray], param_grid: List[PosManagerParams], sort_by: str,
+                   metrics: _StageMetrics):
+  # All the parameter sets are run on each chunk before the next one is read, so the price file is read once
+  print(f'      Sweeping {len(param_grid)} parameter sets...')
+  start_time    = time.time()
+  merged_chunks = _merged_chunks(_converted_chunks(_read_price_chunks(price_file, chunk_size), metrics), trade_file, signals, metrics)
+  ranking_df    = sweep_pos_manager(metrics.consumer_time(merged_chunks, STAGE_ENGINE, trade_file), param_grid, sort_by)
+
+  file_prefix   = _generate_output_file_prefix(price_file, trade_file, SWEEP_INDEX)
+  with metrics.stage(STAGE_WRITE, SWEEP_INDEX, trade_file, len(ranking_df)):
+    ranking_df.to_csv(_generate_output_file_name(file_prefix, 'stat'))
+  end_time      = time.time()
+  print(f'      Swept {len(param_grid)} parameter sets in {end_time - start_time} seconds.')
+
+
+
+def _expand_trade_files(trade_files: List[str]) -> List[str]:
+  # Each --trade_file value is a file in the data dir or a glob pattern, e.g. "signal - yosemite btc - *.csv"
+  expanded = []
+  for trade_file in trade_files:
+    trade_file_path = os.path.join(os.getcwd(), DATA_DIR, trade_file)
+    expanded       += sorted(glob.glob(trade_file_path)) if glob.has_magic(trade_file) else [trade_file_path]
+
+  return list(dict.fromkeys(expanded))
+
+
+
+def _validate_engines(price_file: str, trade_files: List[str], chunk_size: int, max_chunks: int = DEFAULT_VALIDATE_CHUNKS) -> int:
+  # Runs the first max_chunks chunks of every trade file through both engines and compares the trades, the equity curve
+  # and the stats. Returns the number of chunks that differ, nothing is written to results/
+  print(f'Validating the {ENGINE_NUMBA} engine against {ENGINE_BACKTESTING} on "{price_file}"...')
+  signal_sets = {trade_file: _read_trade_file(trade_file) for trade_file in trade_files}
+  mismatches  = 0
+  for chunk_index, chunk_df in enumerate(_read_price_chunks(price_file, chunk_size)):
+    if chunk_index >= max_chunks:
+      break
+    chunk_df = _convert_chunk_df_to_correct_format(chunk_df)
+    for trade_file, signals in signal_sets.items():
+      merged_df = _merge_price_and_trade(chunk_df, signals)
+      engine_seconds, engine_stats = {}, {}
+      for engine in [ENGINE_BACKTESTING, ENGINE_NUMBA]:
+        start_time              = time.time()
+        engine_stats[engine]    = _run_backtest(merged_df, engine)
+        engine_seconds[engine]  = time.time() - start_time
+
+      differences = stats_differences(engine_stats[ENGINE_BACKTESTING], engine_stats[ENGINE_NUMBA])
+      mismatches += bool(differences)
+      print(f'      Chunk {chunk_index} of "{_extract_file_name_no_ext(trade_file)}": {len(merged_df):,} rows, {len(engine_stats[ENGINE_NUMBA]["_trades"]):,} trades, '
+            f'{ENGINE_BACKTESTING} {engine_seconds[ENGINE_BACKTESTING]:.2f}s, {ENGINE_NUMBA} {engine_seconds[ENGINE_NUMBA]:.2f}s, '
+            + ('match' if not differences else f'{len(differences)} differences'))
+      for difference in differences:
+        print(f'        {difference}')
+
+  print("Engines match." if not mismatches else f"Engines differ on {mismatches} chunk(s).")
+  return mismatches
+
+
+
+def _process_backtest(price_file: str, trade_files: List[str], chunk_size: int, engine: str = DEFAULT_ENGINE, continuous: bool = False,
+                      workers: int = DEFAULT_WORKERS, warmup_bars: int = DEFAULT_WARMUP_BARS, param_grid: List[PosManagerParams] = None,
+                      sweep_sort_by: str = DEFAULT_SWEEP_SORT_BY, output_format: str = DEFAULT_OUTPUT_FORMAT, equity_resample: str = None):  
+  # Every trade file is run against each price chunk while it is in memory, the price file is read and converted once
+  trade_file_names = ', '.join(f'"{trade_file}"' for trade_file in trade_files)
+  print(f'Processing backtest using price file "{price_file}" and trade file(s) {trade_file_names}...')
+  signal_sets = {trade_file: _read_trade_file(trade_file) for trade_file in trade_files}
+  if chunk_size == NO_CHUNK_SIZE_VALUE and (continuous or workers > 0 or param_grid):
+    chunk_size = DEFAULT_CHUNK_SIZE
+
+  mode    = 'sweep' if param_grid else 'parallel' if workers > 0 else 'continuous' if continuous else 'chunked'
+  metrics = _StageMetrics(_generate_metrics_file_name(price_file), {'price_file': _extract_file_name_no_ext(price_file), 'engine': engine, 'mode': mode,
+                                                                    'chunk_size': chunk_size, 'workers': workers, 'trade_files': len(trade_files)})
+
+  if param_grid:
+    # The sweep kernel runs one signal set at a time, so a sweep reads the price file once per trade file
+    for trade_file, signals in signal_sets.items():
+      _process_sweep(price_file, trade_file, chunk_size, signals, param_grid, sweep_sort_by, metrics)
+  elif workers > 0 or continuous:
+    if workers > 0:
+      index_rows = _process_parallel_backtest(price_file, signal_sets, chunk_size, engine, workers, warmup_bars, metrics, output_format, equity_resample)
+    else:
+      index_rows = _process_continuous_backtest(price_file, signal_sets, chunk_size, metrics, output_format, equity_resample)
+    for trade_file, index_row in index_rows.items():
+      _write_result_index([index_row], _generate_result_index_file_name(price_file, trade_file, output_format))
   else:
-    for chunk_index, chunk_df in enumerate(pd.read_csv(price_file, chunksize=chunk_size)):
-      _process_one_chunk(chunk_df, price_file, trade_file, str(chunk_index), df_trades)    
-  
+    index_rows  = {trade_file: [] for trade_file in trade_files}
+    for chunk_index, chunk_df in enumerate(_converted_chunks(_read_price_chunks(price_file, chunk_size), metrics)):
+      chunk_index_as_str  = NO_CHUNK_INDEX_VALUE if chunk_size == NO_CHUNK_SIZE_VALUE else str(chunk_index)
+      for trade_file, signals in signal_sets.items():
+        index_rows[trade_file].append(_process_one_chunk(chunk_df, price_file, trade_file, chunk_index_as_str, signals, engine, metrics, output_format, equity_resample))
+        # The index is rewritten after every chunk, it stays usable if the run is stopped
+        _write_result_index(index_rows[trade_file], _generate_result_index_file_name(price_file, trade_file, output_format))
+
+  metrics.summary()
   print("Done processing backtest.")
 
 
 
 if __name__ == '__main__':  
   parser = argparse.ArgumentParser(description="Process price and trade files.")
-  parser.add_argument("--price_file"      , default=DEFAULT_PRICE_FILE, help=f"Path to price file (default: {DEFAULT_PRICE_FILE})")
-  parser.add_argument("--trade_file"      , default=DEFAULT_TRADE_FILE, help=f"Path to trade file (default: {DEFAULT_TRADE_FILE})")
+  parser.add_argument("--price_file"      , default=DEFAULT_PRICE_FILE, help=f"Path to price file or price store directory (default: {DEFAULT_PRICE_FILE})")
+  parser.add_argument("--trade_file"      , default=[DEFAULT_TRADE_FILE], nargs="+", help=f"Path to trade file, several paths or glob patterns run them all against one read of the price file (default: {DEFAULT_TRADE_FILE})")
   parser.add_argument("--chunk_size"      , default=DEFAULT_CHUNK_SIZE, help=f"Chunk size (default: {DEFAULT_CHUNK_SIZE}, use -1 to process entire file)")
+  parser.add_argument("--engine"          , default=None, choices=ENGINES, help=f"numba runs the compiled pos_manager engine, backtesting runs backtesting.py's Backtest (default: {DEFAULT_ENGINE}, {ENGINE_NUMBA} with --continuous or --sweep)")
+  parser.add_argument("--validate"        , nargs="?", const=DEFAULT_VALIDATE_CHUNKS, default=0, type=int, metavar="CHUNKS", help=f"Run the first CHUNKS chunks through both engines, report where the trades, equity curve or stats differ and write nothing (default CHUNKS: {DEFAULT_VALIDATE_CHUNKS})")
+  parser.add_argument("--continuous"      , action="store_true", help="Carry open positions and cash from one chunk to the next and write a single equity curve, trade list and stat file (numba engine only)")
+  parser.add_argument("--workers"         , default=DEFAULT_WORKERS, type=int, help=f"Run the chunks in this many processes and stitch them into a single equity curve, trade list and stat file (default: {DEFAULT_WORKERS}, one after another with a result file set per chunk)")
+  parser.add_argument("--warmup_bars"     , default=DEFAULT_WARMUP_BARS, type=int, help=f"With --workers, bars of the neighbouring chunks run before and after each chunk, at most one chunk (default: {DEFAULT_WARMUP_BARS})")
+  parser.add_argument("--sweep"           , action="store_true", help="Run every combination of the pos_manager parameter values below over the price file in one pass and write a ranked stat file (numba engine only)")
+  parser.add_argument("--sort_by"         , default=DEFAULT_SWEEP_SORT_BY, help=f"With --sweep, the stat the parameter sets are ranked by, highest first (default: {DEFAULT_SWEEP_SORT_BY.replace('%', '%%')})")
+  parser.add_argument("--output_format"   , default=DEFAULT_OUTPUT_FORMAT, choices=OUTPUT_FORMATS, help=f"Format of the trades and equity files, parquet is zstd compressed (default: {DEFAULT_OUTPUT_FORMAT})")
+  parser.add_argument("--equity_resample" , default=None, help="Keep the last equity row of each period of this length, e.g. 1min or 1D (default: every bar)")
+  for name in SWEEP_PARAMETERS:
+    default_value = getattr(_pos_manager_params(), name)
+    parser.add_argument(f"--{name}", nargs="+", type=type(default_value), default=[default_value], help=f"With --sweep, the values of {name} to try (default: {default_value})")
   
   args = parser.parse_args()  
-
-  price_file_path = os.path.join(os.getcwd(), DATA_DIR, args.price_file)
-  trade_file_path = os.path.join(os.getcwd(), DATA_DIR, args.trade_file)
-
-  _process_backtest(price_file_path, trade_file_path, int(args.chunk_size))
\ No newline at end of file
+  if args.engine is None:
+    args.engine = ENGINE_NUMBA if args.continuous or args.sweep else DEFAULT_ENGINE
+  if args.continuous and args.engine != ENGINE_NUMBA:
+    parser.error("--continuous needs --engine numba")
+  if args.continuous and args.workers > 0:
+    parser.error("--continuous runs the chunks in order, it cannot be combined with --workers")
+  if args.sweep and (args.engine != ENGINE_NUMBA or args.continuous or args.workers > 0):
+    parser.error("--sweep needs --engine numba and cannot be combined with --continuous or --workers")
+  param_grid = _build_param_grid({name: getattr(args, name) for name in SWEEP_PARAMETERS}) if args.sweep else None
+
+  price_file_path   = os.path.join(os.getcwd(), DATA_DIR, args.price_file)
+  trade_file_paths  = _expand_trade_files(args.trade_file)
+  if not trade_file_paths:
+    parser.error(f"No trade file matches {args.trade_file}")
+  if args.validate:
+    sys.exit(1 if _validate_engines(price_file_path, trade_file_paths, int(args.chunk_size), args.validate) else 0)
+
+  _process_backtest(price_file_path, trade_file_paths, int(args.chunk_size), args.engine, args.continuous, args.workers, args.warmup_bars,
+                    param_grid, args.sort_by, args.output_format, args.equity_resample)
\ No newline at end of file
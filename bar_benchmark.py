@@ -0,0 +1,55 @@
+import os
+import argparse
+import time
+import pandas as pd
+
+from bar_funcs import BarType, bar_func
+
+DATA_DIR                  = "data"
+
+DEFAULT_PRICE_FILES       = ["BTCUSDT_1m_futures.pkl", "BTCUSDT-1s-2019-202304.csv"]
+DEFAULT_BAR_TYPE          = BarType.DOLLAR.value
+DEFAULT_BAR_SIZE          = 90_000_000
+DEFAULT_REPEATS           = 3
+WARM_UP_ROWS              = 1000        # Small slice used to trigger the numba compilation before timing
+
+
+
+def _read_price_file(file_path: str) -> pd.DataFrame:
+  if file_path.endswith(".pkl"):
+    import vectorbtpro as vbt
+    return vbt.BinanceData.load(file_path).get()
+
+  df = pd.read_csv(file_path)
+  df.index = pd.to_datetime(df['Open time'])
+  return df.drop(columns=['Open time'])
+
+
+
+def _benchmark_one_file(file_path: str, bar_type: BarType, bar_size: float, repeats: int):
+  print(f'Loading "{file_path}"...')
+  df = _read_price_file(file_path)
+  bar_func(df.iloc[:WARM_UP_ROWS], bar_type, bar_size)
+
+  best_seconds = None
+  for _ in range(repeats):
+    start_time    = time.perf_counter()
+    bars          = bar_func(df, bar_type, bar_size)
+    elapsed       = time.perf_counter() - start_time
+    best_seconds  = elapsed if best_seconds is None else min(best_seconds, elapsed)
+
+  print(f'      {len(df):,} rows -> {len(bars):,} {bar_type.value} bars in {best_seconds:.3f} seconds ({len(df) / best_seconds:,.0f} rows/sec)')
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Benchmark the bar builder.")
+  parser.add_argument("--price_file"      , nargs="+", default=DEFAULT_PRICE_FILES, help=f"Price files in the data dir (default: {DEFAULT_PRICE_FILES})")
+  parser.add_argument("--bar_type"        , default=DEFAULT_BAR_TYPE, choices=[t.value for t in BarType], help=f"Bar type (default: {DEFAULT_BAR_TYPE})")
+  parser.add_argument("--bar_size"        , default=DEFAULT_BAR_SIZE, help=f"Bar size (default: {DEFAULT_BAR_SIZE})")
+  parser.add_argument("--repeats"         , default=DEFAULT_REPEATS, help=f"Timed runs per file, the best one is reported (default: {DEFAULT_REPEATS})")
+
+  args = parser.parse_args()
+
+  for price_file in args.price_file:
+    _benchmark_one_file(os.path.join(os.getcwd(), DATA_DIR, price_file), BarType(args.bar_type), float(args.bar_size), int(args.repeats))
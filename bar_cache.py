@@ -0,0 +1,165 @@
+import os
+import glob
+import hashlib
+import pandas as pd
+
+from bar_funcs import BarType, multi_bar_func, multi_bar_func_from_chunks, read_price_chunks, simplify_number
+
+
+BAR_CACHE_DIR = os.path.join("data", "bar_cache")
+DEFAULT_SOURCE_FILE = os.path.join("data", "BTCUSDT_1m_futures.pkl")
+
+FINGERPRINT_SAMPLE_BYTES = 1 << 20     # Bytes hashed from the start and the end of the source file
+ROW_GROUP_SIZE = 50_000                # Parquet row group size, the unit the date filters can skip
+
+
+def source_fingerprint(source_path):
+    """
+    Cheap content fingerprint of a source price file: its size plus a hash of its first and last MiB.
+    Appending, rewriting or replacing the file changes the fingerprint without hashing several GB.
+    A month-partitioned directory or a price store is fingerprinted from the names and fingerprints of its files.
+    """
+    if os.path.isdir(source_path):
+        sha = hashlib.sha1()
+        for partition_file in sorted(glob.glob(os.path.join(source_path, '*.parquet')) + glob.glob(os.path.join(source_path, '*.bin'))):
+            sha.update(f'{os.path.basename(partition_file)}|{source_fingerprint(partition_file)}'.encode())
+        return sha.hexdigest()
+
+    file_size = os.path.getsize(source_path)
+    sha = hashlib.sha1(str(file_size).encode())
+    with open(source_path, 'rb') as f:
+        sha.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+        if file_size > FINGERPRINT_SAMPLE_BYTES:
+            f.seek(max(file_size - FINGERPRINT_SAMPLE_BYTES, FINGERPRINT_SAMPLE_BYTES))
+            sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def _bar_variant(next_row_close):
+    # Only the bars that differ from the default build add to the cache keys, so the existing cache files keep their names
+    return '|next_row_close' if next_row_close else ''
+
+
+def _cache_file_prefix(source_path, bar_type, bar_size, source_start, source_end, next_row_close=False):
+    # Everything that identifies the dataset except the source content, so a rebuilt source maps to
+    # the same prefix and the old file can be removed. The name and simplified size are only for reading,
+    # the full source path and the exact size are hashed, so 1M and 1.5M or two data/ directories never share a prefix.
+    source_name = os.path.splitext(os.path.basename(os.path.normpath(source_path)))[0]
+    dataset = f'{os.path.abspath(source_path)}|{float(bar_size)!r}|{source_start}|{source_end}{_bar_variant(next_row_close)}'
+    dataset_key = hashlib.sha1(dataset.encode()).hexdigest()[:12]
+
+    return f'{source_name}_{BarType(bar_type).value}_{simplify_number(bar_size)}_{dataset_key}_'
+
+
+def _cache_file(source_path, bar_type, bar_size, source_start, source_end, cache_dir, next_row_close=False):
+    # The file name is the content address: source fingerprint + bar type + size + source time range
+    prefix = _cache_file_prefix(source_path, bar_type, bar_size, source_start, source_end, next_row_close)
+    key = f'{source_fingerprint(source_path)}|{BarType(bar_type).value}|{float(bar_size)!r}|{source_start}|{source_end}{_bar_variant(next_row_close)}'
+
+    return os.path.join(cache_dir, prefix + hashlib.sha1(key.encode()).hexdigest()[:16] + '.parquet')
+
+
+def _read_source_bars(source_path, bar_type, bar_sizes, source_start, source_end, next_row_close=False):
+    # CSV/Parquet price files are streamed chunk by chunk, vbt pickles have to be loaded whole
+    if source_path.endswith('.pkl'):
+        import vectorbtpro as vbt
+        ohlc_df = vbt.BinanceData.load(source_path).get().loc[source_start:source_end]
+        return multi_bar_func(ohlc_df, bar_type, bar_sizes, next_row_close)
+
+    chunks = (chunk_df.loc[source_start:source_end] for chunk_df in read_price_chunks(source_path))
+    return multi_bar_func_from_chunks(chunks, bar_type, bar_sizes, next_row_close)
+
+
+def _write_cache_file(bars_df, cache_file):
+    # Remove the files built for the same source/type/size/range from an older version of the source
+    for stale_file in glob.glob(cache_file.rsplit('_', 1)[0] + '_*.parquet'):
+        if stale_file != cache_file:
+            os.remove(stale_file)
+
+    tmp_file = cache_file + '.tmp'
+    bars_df.to_parquet(tmp_file, index=False, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_file, cache_file)
+
+
+def warm_bar_cache(source_path=DEFAULT_SOURCE_FILE, bar_type=BarType.DOLLAR, bar_sizes=(90_000_000,),
+                   source_start=None, source_end=None, cache_dir=BAR_CACHE_DIR, next_row_close=False):
+    """
+    Build every bar size that is not cached yet, all of them in a single pass over the source file.
+
+    Returns:
+    cache_files (dict): Bar size -> cache file path.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_files = {bar_size: _cache_file(source_path, bar_type, bar_size, source_start, source_end, cache_dir, next_row_close)
+                   for bar_size in bar_sizes}
+    missing_sizes = [bar_size for bar_size, cache_file in cache_files.items() if not os.path.exists(cache_file)]
+
+    if missing_sizes:
+        print(f'Building {BarType(bar_type).value} bars {[simplify_number(s) for s in missing_sizes]} from "{source_path}"...')
+        for bar_size, bars_df in _read_source_bars(source_path, bar_type, missing_sizes, source_start, source_end, next_row_close).items():
+            _write_cache_file(bars_df, cache_files[bar_size])
+
+    return cache_files
+
+
+def _end_filter(end):
+    # What data[:end] keeps: a string end such as '2023' or '2023-01' includes the whole period it names,
+    # a Timestamp only itself
+    if isinstance(end, str):
+        return '<', (pd.Period(end) + 1).start_time
+    return '<=', pd.Timestamp(end)
+
+
+def _time_filters(cache_file, start, end):
+    # Parquet filters on 'Open Time' so only the row groups in range are read, the exact pandas label
+    # slicing is applied after reading.
+    import pyarrow.parquet as pq
+
+    tz = pq.read_schema(cache_file).field('Open Time').type.tz
+    filters = []
+    if start is not None:
+        start_ts = pd.Timestamp(start)
+        start_ts = start_ts.tz_localize(tz) if tz and start_ts.tz is None else start_ts
+        filters.append(('Open Time', '>=', start_ts))
+    if end is not None:
+        end_op, end_ts = _end_filter(end)
+        end_ts = end_ts.tz_localize(tz) if tz and end_ts.tz is None else end_ts
+        filters.append(('Open Time', end_op, end_ts))
+
+    return filters or None
+
+
+def load_bars(source_path=DEFAULT_SOURCE_FILE, bar_type=BarType.DOLLAR, bar_size=90_000_000, start=None, end=None,
+              source_start=None, source_end=None, cache_dir=BAR_CACHE_DIR, next_row_close=False):
+    """
+    Load bars from the on-disk cache, building them on a miss.
+
+    Parameters:
+    source_path (str): Price file the bars are built from (CSV/Parquet from price_file_converter.py or a vbt pickle).
+    bar_type (BarType): DOLLAR, VOLUME, TICK or IMBALANCE.
+    bar_size (float): Running value that closes a bar.
+    start, end (str or Timestamp): Range of bars to return, sliced like data[start:end].
+    source_start, source_end (str or Timestamp): Range of source rows the bars are built from (default: all).
+    cache_dir (str): Directory of the cached Parquet files.
+    next_row_close (bool): Close and Close Time from the row that opens the next bar (bar_funcs.MultiBarAggregator).
+
+    Returns:
+    bars_df (DataFrame): Bars indexed by Open Time, only the requested range is read from disk.
+    """
+    cache_file = warm_bar_cache(source_path, bar_type, [bar_size], source_start, source_end, cache_dir, next_row_close)[bar_size]
+
+    bars_df = pd.read_parquet(cache_file, filters=_time_filters(cache_file, start, end), memory_map=True)
+    bars_df.index = pd.to_datetime(bars_df['Open Time'])
+
+    return bars_df.loc[start:end]
+
+
+def load_bar_data(source_path=DEFAULT_SOURCE_FILE, bar_type=BarType.DOLLAR, bar_size=90_000_000, start=None, end=None,
+                  source_start=None, source_end=None, cache_dir=BAR_CACHE_DIR, next_row_close=False):
+    """
+    load_bars wrapped as a vbt.BinanceData object, a drop-in for vbt.BinanceData.load('data/btc_90M_db_vbt.pkl')[start:end].
+    """
+    import vectorbtpro as vbt
+
+    return vbt.BinanceData.from_data(load_bars(source_path, bar_type, bar_size, start, end, source_start, source_end, cache_dir, next_row_close))
@@ -0,0 +1,586 @@
+from enum import Enum
+import os
+import glob
+import numpy as np
+import pandas as pd
+from numba import njit
+
+from price_store import PriceStore, is_price_store
+
+
+# Columns that are summed over every row of a bar, in the order they appear in the output
+BAR_SUM_COLUMNS = ['Volume', 'Quote volume', 'Trade count', 'Taker base volume', 'Taker quote volume']
+
+DEFAULT_CHUNK_SIZE = 5000000    # Rows per chunk when streaming a price file, same as backtest_script.py
+
+
+class BarType(Enum):
+    DOLLAR = "dollar"           # Close * Volume traded
+    VOLUME = "volume"           # Base volume traded
+    TICK = "tick"               # Number of trades ('Trade count')
+    IMBALANCE = "imbalance"     # Taker buy minus taker sell base volume, closes on the absolute running value
+
+
+def _bar_metric(ohlc_df, bar_type):
+    # Per-row value whose running sum decides when a bar closes
+    if bar_type == BarType.DOLLAR:
+        return ohlc_df['Close'].to_numpy(dtype=np.float64) * ohlc_df['Volume'].to_numpy(dtype=np.float64)
+    elif bar_type == BarType.VOLUME:
+        return ohlc_df['Volume'].to_numpy(dtype=np.float64)
+    elif bar_type == BarType.TICK:
+        return ohlc_df['Trade count'].to_numpy(dtype=np.float64)
+    elif bar_type == BarType.IMBALANCE:
+        taker_buy_volume = ohlc_df['Taker base volume'].to_numpy(dtype=np.float64)
+        return 2.0 * taker_buy_volume - ohlc_df['Volume'].to_numpy(dtype=np.float64)
+
+    raise ValueError(f"Invalid bar type {bar_type}. Choose from {[t.value for t in BarType]}.")
+
+
+@njit(cache=True)
+def _sample_bars_nb(bar_metric, bar_sizes, high, low, sum_values, state):
+    """
+    Single pass over the rows that finds the bar boundaries for every bar size and reduces High/Low
+    and the summed columns at the same time, so each row is read once however many sizes are built.
+    Dollar, volume, tick and imbalance bars only differ in the bar_metric they pass in.
+
+    A bar closes on the row where the absolute running bar_metric reaches its bar size, and that row
+    opens the next bar. The very first row never adds to the running value, which is what the
+    original dollar bar iloc loop did.
+
+    sum_values is a tuple of 1-D arrays (one per summed column) so no 2-D copy of the source is made.
+    state carries the open bar of every size between calls and is updated in place, one row per size:
+    [has_bar, cumulative_value, bar_high, bar_low, bar_sum_0, bar_sum_1, ...]
+
+    Returns the start/end (exclusive) row positions of every bar completed in this call plus the
+    reduced values, stored back to back for all sizes (offsets/counts give each size's slice), and
+    the position where each still open bar starts. A position of -1 means the bar started in an
+    earlier call.
+    """
+    n = len(bar_metric)
+    num_sizes = len(bar_sizes)
+    num_sums = len(sum_values)
+
+    # Every bar needs at least its bar size of absolute value, so this is an upper bound on the bar count.
+    # A NaN metric makes the running value NaN and no bar closes after it (as in the original loop), so
+    # NaNs are skipped here, and an infinite value closes at most one bar.
+    chunk_value = 0.0
+    infinite_rows = 0
+    for i in range(n):
+        value = abs(bar_metric[i])
+        if value == np.inf:
+            infinite_rows += 1
+        elif value == value:
+            chunk_value += value
+    offsets = np.empty(num_sizes, dtype=np.int64)
+    max_bars = 0
+    for k in range(num_sizes):
+        offsets[k] = max_bars
+        carried_value = abs(state[k, 1]) if np.isfinite(state[k, 1]) else 0.0
+        max_bars += int((carried_value + chunk_value) / bar_sizes[k]) + infinite_rows + 1
+
+    starts = np.empty(max_bars, dtype=np.int64)
+    ends = np.empty(max_bars, dtype=np.int64)
+    highs = np.empty(max_bars, dtype=np.float64)
+    lows = np.empty(max_bars, dtype=np.float64)
+    sums = np.empty((max_bars, num_sums), dtype=np.float64)
+    counts = np.zeros(num_sizes, dtype=np.int64)
+    bar_starts = np.full(num_sizes, -1, dtype=np.int64)
+    if n == 0:
+        return starts, ends, highs, lows, sums, offsets, counts, bar_starts
+
+    first_row = 0
+    if state[0, 0] == 0.0:
+        # Nothing carried over, the first row opens the first bar of every size
+        for k in range(num_sizes):
+            state[k, 0] = 1.0
+            state[k, 1] = 0.0
+            state[k, 2] = high[0]
+            state[k, 3] = low[0]
+            for j in range(num_sums):
+                state[k, 4 + j] = sum_values[j][0] if sum_values[j][0] == sum_values[j][0] else 0.0
+            bar_starts[k] = 0
+        first_row = 1
+
+    for i in range(first_row, n):
+        for k in range(num_sizes):
+            state[k, 1] += bar_metric[i]
+            if abs(state[k, 1]) >= bar_sizes[k]:
+                # Row i closes the current bar and opens the next one
+                bar = offsets[k] + counts[k]
+                starts[bar] = bar_starts[k]
+                ends[bar] = i
+                highs[bar] = state[k, 2]
+                lows[bar] = state[k, 3]
+                sums[bar] = state[k, 4:]
+                counts[k] += 1
+
+                bar_starts[k] = i
+                state[k, 1] = 0.0
+                state[k, 2] = high[i]
+                state[k, 3] = low[i]
+                for j in range(num_sums):
+                    state[k, 4 + j] = sum_values[j][i] if sum_values[j][i] == sum_values[j][i] else 0.0
+            else:
+                # NaN-skipping reductions, the same as pandas max/min/sum
+                if high[i] > state[k, 2] or state[k, 2] != state[k, 2]:
+                    state[k, 2] = high[i]
+                if low[i] < state[k, 3] or state[k, 3] != state[k, 3]:
+                    state[k, 3] = low[i]
+                for j in range(num_sums):
+                    if sum_values[j][i] == sum_values[j][i]:
+                        state[k, 4 + j] += sum_values[j][i]
+
+    return starts, ends, highs, lows, sums, offsets, counts, bar_starts
+
+
+def _as_float_array(series):
+    # Read-only float64 view of a column. Numba only indexes a tuple of arrays with a runtime index
+    # when every array has the same type, so all inputs are handed over read-only.
+    values = series.to_numpy(dtype=np.float64).view()
+    values.flags.writeable = False
+    return values
+
+
+class MultiBarAggregator:
+    """
+    Stateful bar builder for one bar type and several bar sizes that can be fed the price data one
+    chunk at a time.
+
+    Every size is built in the same pass over each chunk, sharing the bar metric computation. The
+    open bars and the running values are carried from one chunk to the next, so feeding a file chunk
+    by chunk gives exactly the same bars as feeding it whole, while only one chunk is ever held in
+    memory. The trailing partial bars are never emitted.
+
+    With next_row_close, Close and Close Time come from the row that closes the bar and opens the next
+    one, as the dollar_bar_func copies of the notebook scripts did. xgb_rolling_production.py's model
+    was trained on those bars.
+    """
+
+    def __init__(self, bar_type, bar_sizes, next_row_close=False):
+        self.bar_type = BarType(bar_type)
+        self.bar_sizes = list(bar_sizes)
+        self.next_row_close = next_row_close
+
+        num_sizes = len(self.bar_sizes)
+        self._sizes = np.array(self.bar_sizes, dtype=np.float64)
+        self._state = np.zeros((num_sizes, 4 + len(BAR_SUM_COLUMNS)), dtype=np.float64)
+        self._sum_dtypes = None
+        self._bar_opens = [np.nan] * num_sizes
+        self._bar_open_times = [pd.NaT] * num_sizes
+        self._last_close = np.nan
+        self._last_time = pd.NaT
+
+    def _chunk_times(self, ohlc_df):
+        # Returns the open time of every row and whether Close Time comes from the row that opens the
+        # next bar ('Open Time' column) or from the last row of the bar (DatetimeIndex)
+        if isinstance(ohlc_df.index, pd.DatetimeIndex):
+            return ohlc_df.index, False
+        elif 'Open Time' in ohlc_df.columns:
+            return pd.DatetimeIndex(pd.to_datetime(ohlc_df['Open Time'])), True
+        return None, False
+
+    def _build_bars_df(self, ohlc_df, k, starts, ends, highs, lows, sums):
+        # Assemble the reduced arrays into the same column layout the iloc version produced. Only the
+        # first bar of a chunk can have started in an earlier chunk (start == -1) or ended on the last
+        # row of the previous chunk (end == 0), those take the carried values.
+        opens = ohlc_df['Open'].to_numpy()[np.maximum(starts, 0)]
+        opens[starts < 0] = self._bar_opens[k]
+        if self.next_row_close:
+            # The row that closes a bar is always in the chunk that completes it
+            closes = ohlc_df['Close'].to_numpy()[ends]
+        else:
+            closes = ohlc_df['Close'].to_numpy()[np.maximum(ends - 1, 0)]
+            closes[ends == 0] = self._last_close
+
+        bars = {
+            'Open': opens,
+            'High': highs,
+            'Low': lows,
+            'Close': closes,
+        }
+        for j, col in enumerate(BAR_SUM_COLUMNS):
+            if pd.api.types.is_integer_dtype(self._sum_dtypes[j]):
+                bars[col] = sums[:, j].astype(self._sum_dtypes[j])
+            else:
+                bars[col] = sums[:, j]
+
+        times, close_from_next_row = self._chunk_times(ohlc_df)
+        if times is not None:
+            bars['Open Time'] = times[np.maximum(starts, 0)].where(starts >= 0, self._bar_open_times[k])
+            if close_from_next_row or self.next_row_close:
+                bars['Close Time'] = times[ends] - pd.Timedelta(milliseconds=1)
+            else:
+                close_times = times[np.maximum(ends - 1, 0)].where(ends > 0, self._last_time)
+                bars['Close Time'] = close_times - pd.Timedelta(milliseconds=1)
+
+        return pd.DataFrame(bars)
+
+    def update(self, ohlc_df):
+        """
+        Feed the next chunk of price data.
+
+        Parameters:
+        ohlc_df (DataFrame): The next rows of price data, in time order.
+
+        Returns:
+        bars (dict): Bar size -> DataFrame of the bars completed by this chunk (can be empty).
+        """
+        if self._sum_dtypes is None:
+            self._sum_dtypes = [ohlc_df[col].dtype for col in BAR_SUM_COLUMNS]
+
+        starts, ends, highs, lows, sums, offsets, counts, bar_starts = _sample_bars_nb(
+            _bar_metric(ohlc_df, self.bar_type),    # Computed once for all bar sizes
+            self._sizes,
+            _as_float_array(ohlc_df['High']),
+            _as_float_array(ohlc_df['Low']),
+            tuple(_as_float_array(ohlc_df[col]) for col in BAR_SUM_COLUMNS),
+            self._state,
+        )
+
+        bars = {}
+        for k, bar_size in enumerate(self.bar_sizes):
+            size_bars = slice(offsets[k], offsets[k] + counts[k])
+            bars[bar_size] = self._build_bars_df(
+                ohlc_df, k, starts[size_bars], ends[size_bars], highs[size_bars], lows[size_bars], sums[size_bars]
+            )
+
+        # Remember what the open bars need from this chunk
+        if len(ohlc_df):
+            times, _ = self._chunk_times(ohlc_df)
+            for k, bar_start in enumerate(bar_starts):
+                if bar_start >= 0:
+                    self._bar_opens[k] = ohlc_df['Open'].iloc[bar_start]
+                    self._bar_open_times[k] = times[bar_start] if times is not None else pd.NaT
+            self._last_close = ohlc_df['Close'].iloc[-1]
+            self._last_time = times[-1] if times is not None else pd.NaT
+
+        return bars
+
+
+class BarAggregator(MultiBarAggregator):
+    """
+    Stateful bar builder for a single bar type and size, see MultiBarAggregator.
+    """
+
+    def __init__(self, bar_type, bar_size):
+        super().__init__(bar_type, [bar_size])
+        self.bar_size = bar_size
+
+    def update(self, ohlc_df):
+        """
+        Feed the next chunk of price data.
+
+        Parameters:
+        ohlc_df (DataFrame): The next rows of price data, in time order.
+
+        Returns:
+        bars_df (DataFrame): The bars completed by this chunk (can be empty).
+        """
+        return super().update(ohlc_df)[self.bar_size]
+
+
+class MultiDollarBarAggregator(MultiBarAggregator):
+    """
+    MultiBarAggregator for dollar bars.
+    """
+
+    def __init__(self, dollar_bar_sizes):
+        super().__init__(BarType.DOLLAR, dollar_bar_sizes)
+
+
+class DollarBarAggregator(BarAggregator):
+    """
+    BarAggregator for dollar bars.
+    """
+
+    def __init__(self, dollar_bar_size):
+        super().__init__(BarType.DOLLAR, dollar_bar_size)
+
+
+def iter_bars(price_chunks, bar_type, bar_size):
+    """
+    Generator that turns an iterable of price chunks into bars.
+
+    Parameters:
+    price_chunks (iterable): DataFrames of consecutive price rows, e.g. from read_price_chunks.
+    bar_type (BarType): Which running value closes a bar.
+    bar_size (float): Running value that closes a bar.
+
+    Yields:
+    bars_df (DataFrame): The bars completed by each chunk, empty chunks are skipped.
+    """
+    aggregator = BarAggregator(bar_type, bar_size)
+    for chunk_df in price_chunks:
+        bars_df = aggregator.update(chunk_df)
+        if len(bars_df):
+            yield bars_df
+
+
+def iter_dollar_bars(price_chunks, dollar_bar_size):
+    """
+    Generator that turns an iterable of price chunks into dollar bars, see iter_bars.
+    """
+    return iter_bars(price_chunks, BarType.DOLLAR, dollar_bar_size)
+
+
+def read_price_chunks(price_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read a price file written by price_file_converter.py in chunks of chunk_size rows.
+
+    CSV files are read with pd.read_csv(chunksize=...) and Parquet files one row group batch at a
+    time, so the whole file is never loaded. A month-partitioned directory is read one month file
+    after the other and a price store (price_store.py) is sliced from its memory maps. Each chunk
+    is indexed by its 'Open time'.
+    """
+    if is_price_store(price_file):
+        yield from PriceStore(price_file).iter_chunks(chunk_size)
+    elif os.path.isdir(price_file):
+        for partition_file in sorted(glob.glob(os.path.join(price_file, '*.parquet'))):
+            yield from read_price_chunks(partition_file, chunk_size)
+    elif price_file.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(price_file).iter_batches(batch_size=chunk_size):
+            chunk_df = batch.to_pandas()
+            if 'Open time' in chunk_df.columns:
+                chunk_df = chunk_df.set_index('Open time')
+            yield chunk_df
+    else:
+        for chunk_df in pd.read_csv(price_file, chunksize=chunk_size):
+            chunk_df.index = pd.to_datetime(chunk_df['Open time'])
+            yield chunk_df.drop(columns=['Open time'])
+
+
+def multi_bar_func(ohlc_df, bar_type, bar_sizes, next_row_close=False):
+    """
+    Build bars of one type for several bar sizes in a single pass over the price data.
+
+    Parameters:
+    ohlc_df (DataFrame): Price data with the Binance kline columns (Open, High, Low, Close, Volume, ...).
+    bar_type (BarType): DOLLAR, VOLUME, TICK or IMBALANCE.
+    bar_sizes (list): Running values that close a bar.
+    next_row_close (bool): Close and Close Time from the row that opens the next bar, see MultiBarAggregator.
+
+    Returns:
+    bars (dict): Bar size -> DataFrame with one row per completed bar, all with the dollar bar column layout.
+    """
+    return MultiBarAggregator(bar_type, bar_sizes, next_row_close).update(ohlc_df)
+
+
+def multi_bar_func_from_chunks(price_chunks, bar_type, bar_sizes, next_row_close=False):
+    """
+    Build bars of one type for several bar sizes from an iterable of consecutive price chunks.
+    """
+    aggregator = MultiBarAggregator(bar_type, bar_sizes, next_row_close)
+    bars = {bar_size: [] for bar_size in aggregator.bar_sizes}
+    for chunk_df in price_chunks:
+        for bar_size, bars_df in aggregator.update(chunk_df).items():
+            if len(bars_df) or not bars[bar_size]:
+                bars[bar_size].append(bars_df)
+
+    return {bar_size: pd.concat(dfs, ignore_index=True) for bar_size, dfs in bars.items()}
+
+
+def multi_bar_func_from_file(price_file, bar_type, bar_sizes, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Build bars of one type for several bar sizes with a single read of a price file.
+    """
+    return multi_bar_func_from_chunks(read_price_chunks(price_file, chunk_size), bar_type, bar_sizes)
+
+
+def bar_func(ohlc_df, bar_type, bar_size, next_row_close=False):
+    """
+    Build bars of any type from an OHLCV DataFrame.
+
+    Parameters:
+    ohlc_df (DataFrame): Price data with the Binance kline columns (Open, High, Low, Close, Volume, ...).
+    bar_type (BarType): DOLLAR, VOLUME, TICK or IMBALANCE.
+    bar_size (float): Running value that closes a bar.
+    next_row_close (bool): Close and Close Time from the row that opens the next bar, see MultiBarAggregator.
+
+    Returns:
+    bars_df (DataFrame): One row per completed bar, with the dollar bar column layout.
+    """
+    return multi_bar_func(ohlc_df, bar_type, [bar_size], next_row_close)[bar_size]
+
+
+def bar_func_from_file(price_file, bar_type, bar_size, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Build bars of any type straight from a price file without loading it whole.
+
+    Only one chunk of chunk_size rows is in memory at a time, the result is the same as bar_func on
+    the fully loaded file.
+    """
+    return multi_bar_func_from_file(price_file, bar_type, [bar_size], chunk_size)[bar_size]
+
+
+def dollar_bar_func(ohlc_df, dollar_bar_size):
+    """
+    Build dollar bars from an OHLCV DataFrame.
+
+    Parameters:
+    ohlc_df (DataFrame): Price data with the Binance kline columns (Open, High, Low, Close, Volume, ...).
+    dollar_bar_size (float): Dollar value traded that closes a bar.
+
+    Returns:
+    dollar_bars_df (DataFrame): One row per completed dollar bar.
+    """
+    return bar_func(ohlc_df, BarType.DOLLAR, dollar_bar_size)
+
+
+def dollar_bar_func_from_file(price_file, dollar_bar_size, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Build dollar bars straight from a price file without loading it whole, see bar_func_from_file.
+    """
+    return bar_func_from_file(price_file, BarType.DOLLAR, dollar_bar_size, chunk_size)
+
+
+def multi_dollar_bar_func(ohlc_df, dollar_bar_sizes):
+    """
+    Build dollar bars for several bar sizes in a single pass over the price data.
+
+    Returns:
+    dollar_bars (dict): Bar size -> DataFrame, the same as dollar_bar_func(ohlc_df, size) for each size.
+    """
+    return multi_bar_func(ohlc_df, BarType.DOLLAR, dollar_bar_sizes)
+
+
+def multi_dollar_bar_func_from_file(price_file, dollar_bar_sizes, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Build dollar bars for several bar sizes with a single read of a price file.
+    """
+    return multi_bar_func_from_file(price_file, BarType.DOLLAR, dollar_bar_sizes, chunk_size)
+
+
+def volume_bar_func(ohlc_df, volume_bar_size):
+    """
+    Build volume bars, a bar closes every volume_bar_size of base volume traded.
+    """
+    return bar_func(ohlc_df, BarType.VOLUME, volume_bar_size)
+
+
+def tick_bar_func(ohlc_df, tick_bar_size):
+    """
+    Build tick bars, a bar closes every tick_bar_size trades ('Trade count').
+    """
+    return bar_func(ohlc_df, BarType.TICK, tick_bar_size)
+
+
+def imbalance_bar_func(ohlc_df, imbalance_bar_size):
+    """
+    Build buy/sell imbalance bars, a bar closes once taker buy volume minus taker sell volume since
+    the bar opened reaches imbalance_bar_size in either direction.
+    """
+    return bar_func(ohlc_df, BarType.IMBALANCE, imbalance_bar_size)
+
+
+# Create a simple function to simplify the number so we can use it in our column names
+def simplify_number(num):
+    """
+    Simplifies a large number by converting it to a shorter representation with a suffix (K, M, B).
+    simplify_number(1000) -> 1K
+    """
+    suffixes = ['', 'K', 'M', 'B']
+    suffix_index = 0
+
+    while abs(num) >= 1000 and suffix_index < len(suffixes) - 1:
+        num /= 1000.0
+        suffix_index += 1
+
+    suffix = suffixes[suffix_index] if suffix_index > 0 else ''
+    simplified_num = f'{int(num)}{suffix}'
+
+    return simplified_num
+
+
+def bar_ids_for_index(index, bars_df):
+    """
+    Map every row of a finer time index to the bar it falls in.
+
+    Parameters:
+    index (DatetimeIndex): Index of the frame the bars were built from (or any finer index).
+    bars_df (DataFrame): Bars with an 'Open Time' column, in time order.
+
+    Returns:
+    bar_ids (ndarray): Position in bars_df of the latest bar opened at or before each row, -1 before the first bar.
+    """
+    bar_open_times = pd.DatetimeIndex(bars_df['Open Time'])
+    return bar_open_times.searchsorted(index, side='right') - 1
+
+
+def _expand_bar_columns(index, bars_df, dollar_bar_prefix, bar_ids):
+    # Spread the bar columns onto the fine index with one take() per column. Rows before the first
+    # bar get NaN/NaT, every other row gets the bar it falls in, which is what the merge + ffill did.
+    if len(bars_df) == 0:
+        # No bar completed (e.g. a range shorter than one bar), every row is before the first bar
+        columns = {dollar_bar_prefix + col: bars_df[col].reindex(np.zeros(len(index), dtype=np.int64)).array
+                   for col in bars_df.columns}
+        columns[dollar_bar_prefix + 'NewDBFlag'] = np.zeros(len(index), dtype=bool)
+        return columns
+
+    valid = bar_ids >= 0
+    safe_ids = np.where(valid, bar_ids, 0)
+
+    columns = {}
+    for col in bars_df.columns:
+        values = bars_df[col].take(safe_ids)
+        if not valid.all():
+            values = values.where(valid)
+        columns[dollar_bar_prefix + col] = values.array
+
+    # A new bar starts on the row whose time is the bar's Open Time
+    bar_open_times = pd.DatetimeIndex(bars_df['Open Time'])
+    columns[dollar_bar_prefix + 'NewDBFlag'] = valid & (bar_open_times[safe_ids] == index)
+
+    return columns
+
+
+def merge_and_fill_dollar_bars(original_df, dollar_bars_df, dollar_bar_size, inplace=False, bar_ids=None):
+    """
+    Add the dollar bar columns (prefixed db_<size>_) to every row of the frame the bars came from.
+
+    Each row gets the bar it falls in plus a NewDBFlag that is True on the row where the bar opens.
+    The rows are aligned with searchsorted/take on the bar open times instead of a merge followed by
+    a forward fill of the whole frame, so only the new columns are allocated.
+
+    Parameters:
+    original_df (DataFrame): The fine (e.g. minute) data, with a DatetimeIndex.
+    dollar_bars_df (DataFrame): Output of dollar_bar_func.
+    dollar_bar_size (float): Size the bars were built with, used for the column prefix.
+    inplace (bool): Add the columns to original_df itself instead of returning a copy.
+    bar_ids (ndarray, optional): Precomputed bar_ids_for_index(original_df.index, dollar_bars_df).
+
+    Returns:
+    merged_df (DataFrame): original_df with the dollar bar columns.
+    """
+    return merge_and_fill_multi_dollar_bars(original_df, {dollar_bar_size: dollar_bars_df}, inplace=inplace,
+                                            bar_ids={dollar_bar_size: bar_ids} if bar_ids is not None else None)
+
+
+def merge_and_fill_multi_dollar_bars(original_df, dollar_bars_by_size, inplace=False, bar_ids=None):
+    """
+    merge_and_fill_dollar_bars for several bar sizes at once, e.g. the output of multi_dollar_bar_func.
+
+    Parameters:
+    original_df (DataFrame): The fine (e.g. minute) data, with a DatetimeIndex.
+    dollar_bars_by_size (dict): Bar size -> dollar bars DataFrame.
+    inplace (bool): Add the columns to original_df itself instead of returning a copy.
+    bar_ids (dict, optional): Bar size -> precomputed bar_ids_for_index result.
+
+    Returns:
+    merged_df (DataFrame): original_df with the db_<size>_ columns of every size.
+    """
+    new_columns = {}
+    for dollar_bar_size, dollar_bars_df in dollar_bars_by_size.items():
+        dollar_bar_prefix = f'db_{simplify_number(dollar_bar_size)}_'
+        size_bar_ids = bar_ids.get(dollar_bar_size) if bar_ids else None
+        if size_bar_ids is None:
+            size_bar_ids = bar_ids_for_index(original_df.index, dollar_bars_df)
+        new_columns.update(_expand_bar_columns(original_df.index, dollar_bars_df, dollar_bar_prefix, size_bar_ids))
+
+    if inplace:
+        for col, values in new_columns.items():
+            original_df[col] = values
+        return original_df
+
+    return pd.concat([original_df, pd.DataFrame(new_columns, index=original_df.index)], axis=1)
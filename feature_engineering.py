@@ -34,100 +34,17 @@ import matplotlib.pyplot as plt
 
 ### Dollar Bar Functions ###
 
+from bar_funcs import dollar_bar_func, simplify_number, merge_and_fill_dollar_bars
+from indicator_cache import IndicatorRegistry
+from feature_store import FEATURE_STORE_DIR, load_feature_group
+from wqa_alphas import WQA_ALPHAS, build_alpha_index, compute_wqa_alphas, load_alpha_index
+from return_features import RETURN_HORIZONS, historical_return_features, return_features_history
+import return_features
+import wqa_alphas
 
-def dollar_bar_func(ohlc_df, dollar_bar_size):
-    # Calculate dollar value traded for each row
-    ohlc_df['DollarValue'] = ohlc_df['Close'] * ohlc_df['Volume']
-    
-    # Calculate cumulative dollar value
-    ohlc_df['CumulativeDollarValue'] = ohlc_df['DollarValue'].cumsum()
-    
-    # Determine the number of dollar bars
-    num_bars = int(ohlc_df['CumulativeDollarValue'].iloc[-1] / dollar_bar_size)
-    
-    # Generate index positions for dollar bars
-    bar_indices = [0]
-    cumulative_value = 0
-    for i in range(1, len(ohlc_df)):
-        cumulative_value += ohlc_df['DollarValue'].iloc[i]
-        if cumulative_value >= dollar_bar_size:
-            bar_indices.append(i)
-            cumulative_value = 0
-    
-    # Create a new dataframe with dollar bars
-    dollar_bars = []
-    for i in range(len(bar_indices) - 1):
-        start_idx = bar_indices[i]
-        end_idx = bar_indices[i + 1]
-        
-        dollar_bar = {
-            'Open': ohlc_df['Open'].iloc[start_idx],
-            'High': ohlc_df['High'].iloc[start_idx:end_idx].max(),
-            'Low': ohlc_df['Low'].iloc[start_idx:end_idx].min(),
-            'Close': ohlc_df['Close'].iloc[end_idx-1],
-            'Volume': ohlc_df['Volume'].iloc[start_idx:end_idx].sum(),
-            'Quote volume': ohlc_df['Quote volume'].iloc[start_idx:end_idx].sum(),
-            'Trade count': ohlc_df['Trade count'].iloc[start_idx:end_idx].sum(),
-            'Taker base volume': ohlc_df['Taker base volume'].iloc[start_idx:end_idx].sum(),
-            'Taker quote volume': ohlc_df['Taker quote volume'].iloc[start_idx:end_idx].sum()
-        }
-        
-        if isinstance(ohlc_df.index, pd.DatetimeIndex):
-            dollar_bar['Open Time'] = ohlc_df.index[start_idx]
-            dollar_bar['Close Time'] = ohlc_df.index[end_idx-1] - pd.Timedelta(milliseconds=1)
-        elif 'Open Time' in ohlc_df.columns:
-            dollar_bar['Open Time'] = ohlc_df['Open Time'].iloc[start_idx]
-            dollar_bar['Close Time'] = ohlc_df['Open Time'].iloc[end_idx] - pd.Timedelta(milliseconds=1)
-        
-        dollar_bars.append(dollar_bar)
-    
-    dollar_bars_df = pd.concat([pd.DataFrame([bar]) for bar in dollar_bars], ignore_index=True)
-    
-    return dollar_bars_df
-
-# Create a simple function to simplify the number so we can use it in our column names
-def simplify_number(num):
-    """
-    Simplifies a large number by converting it to a shorter representation with a suffix (K, M, B).
-    simplify_number(1000) -> 1K
-    """
-    suffixes = ['', 'K', 'M', 'B']
-    suffix_index = 0
-
-    while abs(num) >= 1000 and suffix_index < len(suffixes) - 1:
-        num /= 1000.0
-        suffix_index += 1
-
-    suffix = suffixes[suffix_index] if suffix_index > 0 else ''
-    simplified_num = f'{int(num)}{suffix}'
-
-    return simplified_num
-
-def merge_and_fill_dollar_bars(original_df, dollar_bars_df, dollar_bar_size):
-    # Add prefix to column names in dollar bars dataframe
-    dollar_bar_prefix = f'db_{simplify_number(dollar_bar_size)}_'
-    dollar_bars_df_renamed = dollar_bars_df.add_prefix(dollar_bar_prefix)
-
-    # Convert 'Open Time' columns to pandas datetime format and set them as index
-    dollar_bars_df_renamed.index = pd.to_datetime(dollar_bars_df_renamed[dollar_bar_prefix + 'Open Time'])
-
-    # Merge the dataframes on the index
-    merged_df = original_df.merge(dollar_bars_df_renamed, how='left', left_index=True, right_index=True)
+FEATURE_GROUP_PREFIX = 'feature_engineering'     # Feature store group names of this module, the other feature module's groups are computed differently
+from bar_cache import load_bar_data
 
-    # Set the flag for a new dollar bar with prefix
-    merged_df[dollar_bar_prefix + 'NewDBFlag'] = ~merged_df[dollar_bar_prefix + 'Close'].isna()
-
-    # Forward fill the NaN values for all columns except the new dollar bar flag
-    columns_to_ffill = [col for col in merged_df.columns if col != dollar_bar_prefix + 'NewDBFlag']
-    merged_df[columns_to_ffill] = merged_df[columns_to_ffill].fillna(method='ffill')
-
-    # Fill the remaining NaN values in the new dollar bar flag column with False
-    merged_df[dollar_bar_prefix + 'NewDBFlag'] = merged_df[dollar_bar_prefix + 'NewDBFlag'].fillna(False)
-    
-    # Assign the renamed 'Open Time' column back to the dataframe
-    merged_df[dollar_bar_prefix + 'Open Time'] = merged_df[dollar_bar_prefix + 'Open Time']
-
-    return merged_df
 
 ###################### Feature Engineering ######################
 
@@ -139,72 +56,57 @@ def merge_and_fill_dollar_bars(original_df, dollar_bars_df, dollar_bar_size):
 # drop_cols = ['Open Time', 'Close Time', 'Open', 'High', 'Low', 'Volume', 'Quote volume', 'Trade count',]
 drop_cols = ['Open Time', 'Close Time']
 
-def _add_pivot_trends(X, data, pivot_up_th, pivot_down_th, pivot_up_th2, pivot_down_th2, pivot_up_th3, pivot_down_th3):
-    pivot_info = data.run("pivotinfo", up_th=pivot_up_th, down_th=pivot_down_th)
+def _add_wqa_alphas(X, data, indicators=None, alphas=WQA_ALPHAS, workers=None):
+    indicators = IndicatorRegistry() if indicators is None else indicators
+    # The 101 strategies (or the ones an alpha index keeps) run in a process pool on shared memory (wqa_alphas.py), as float32
+    alphas, report = indicators.cached(data, "wqa101", lambda data, alphas: compute_wqa_alphas(data, list(alphas), workers), alphas=tuple(alphas))
+    if report['failed'] or report['all_nan']:
+        print(f"WQA alphas: {len(report['failed'])} failed {report['failed']}, {len(report['all_nan'])} all NaN {report['all_nan']}")
+    return pd.concat([X, alphas], axis=1)
+
+def _add_pivot_trends(X, data, pivot_up_th, pivot_down_th, pivot_up_th2, pivot_down_th2, pivot_up_th3, pivot_down_th3, indicators=None):
+    indicators = IndicatorRegistry() if indicators is None else indicators
+    pivot_info = indicators.run(data, "pivotinfo", up_th=pivot_up_th, down_th=pivot_down_th)
     binary_pivot_labels = np.where(data.close > pivot_info.conf_value,1,0) # Create binary labels for pivot points
     X['trend'] = binary_pivot_labels # add pivot label as a feature
     
-    pivot_info2 = data.run("pivotinfo", up_th=pivot_up_th2, down_th=pivot_down_th2)
+    pivot_info2 = indicators.run(data, "pivotinfo", up_th=pivot_up_th2, down_th=pivot_down_th2)
     binary_pivot_labels2 = np.where(data.close > pivot_info2.conf_value,1,0) # Create binary labels for pivot points
     X['trend2'] = binary_pivot_labels2 # add pivot label as a feature
     
-    pivot_info3 = data.run("pivotinfo", up_th=pivot_up_th3, down_th=pivot_down_th3)
+    pivot_info3 = indicators.run(data, "pivotinfo", up_th=pivot_up_th3, down_th=pivot_down_th3)
     binary_pivot_labels3 = np.where(data.close > pivot_info3.conf_value,1,0) # Create binary labels for pivot points
     X['trend3'] = binary_pivot_labels3 # add pivot label as a feature
     
     return X
 
-def _add_ta_features(X, data, lookback_window):
+def _add_ta_features(X, data, lookback_window, indicators=None):
+    indicators = IndicatorRegistry() if indicators is None else indicators
 
     # Add some TA features
-    X['supert'] = data.run("supertrend", period=lookback_window, multiplier=10).trend
-    X['supert_cross_up'] = data.close.vbt.crossed_above(data.run('supertrend', period=lookback_window, multiplier=10).trend)
-    X['supert_cross_down'] = data.close.vbt.crossed_below(data.run('supertrend', period=lookback_window, multiplier=10).trend)
-    # X['vwap'] = data.run("VWAP").vwap
-    X['rsi'] = data.run("rsi", window=lookback_window).rsi
+    X['supert'] = indicators.run(data, "supertrend", period=lookback_window, multiplier=10).trend
+    X['supert_cross_up'] = data.close.vbt.crossed_above(indicators.run(data, 'supertrend', period=lookback_window, multiplier=10).trend)
+    X['supert_cross_down'] = data.close.vbt.crossed_below(indicators.run(data, 'supertrend', period=lookback_window, multiplier=10).trend)
+    # X['vwap'] = indicators.run(data, "VWAP").vwap
+    X['rsi'] = indicators.run(data, "rsi", window=lookback_window).rsi
     X['rsi_overbought'] = pd.Series(np.where(X['rsi'] > 60, 1, 0), index=X.index)
     X['rsi_oversold'] = pd.Series(np.where(X['rsi'] < 40, 1, 0), index=X.index)
-    X['bb_width'] = data.run("bbands", window=lookback_window).bandwidth
-    X['bb_width_pct'] = data.run("bbands", window=lookback_window).percent_b
-    X['fast_k'] = data.run("stoch", fast_k_window=lookback_window, slow_k_window=lookback_window*2, slow_d_window=lookback_window*2).fast_k
-    X['slow_k'] = data.run("stoch", fast_k_window=lookback_window, slow_k_window=lookback_window*2, slow_d_window=lookback_window*2).slow_k
+    X['bb_width'] = indicators.run(data, "bbands", window=lookback_window).bandwidth
+    X['bb_width_pct'] = indicators.run(data, "bbands", window=lookback_window).percent_b
+    X['fast_k'] = indicators.run(data, "stoch", fast_k_window=lookback_window, slow_k_window=lookback_window*2, slow_d_window=lookback_window*2).fast_k
+    X['slow_k'] = indicators.run(data, "stoch", fast_k_window=lookback_window, slow_k_window=lookback_window*2, slow_d_window=lookback_window*2).slow_k
     X['slow_k_trending_up'] = X['slow_k'] > X['slow_k'].shift(lookback_window)
     X['slow_k_trending_down'] = X['slow_k'] < X['slow_k'].shift(lookback_window)
-    X['slow_d'] = data.run("stoch", fast_k_window=lookback_window, slow_k_window=lookback_window*2, slow_d_window=lookback_window*2).slow_d
+    X['slow_d'] = indicators.run(data, "stoch", fast_k_window=lookback_window, slow_k_window=lookback_window*2, slow_d_window=lookback_window*2).slow_d
     X['slow_k_over_slow_d'] = X['slow_k'] > X['slow_d']
     X['slow_k_under_slow_d'] = X['slow_k'] < X['slow_d']
     return X
 
-def _add_historical_returns(X, data, lookback_window):
-    # Add in historical returns
-    X['pct_change_1'] = data.close.pct_change(1)
-    X['pct_change_5'] = data.close.pct_change(5)
-    X['pct_change_10'] = data.close.pct_change(10)
-    X['pct_change_20'] = data.close.pct_change(20)
-    X['pct_change_40'] = data.close.pct_change(40)
-    X['pct_change_60'] = data.close.pct_change(60)
-    X['pct_change_100'] = data.close.pct_change(100)
-    X['pct_change_160'] = data.close.pct_change(160)
-    X['pct_change_260'] = data.close.pct_change(260)
-    X['pct_change_420'] = data.close.pct_change(420)
-    
-    # Add in the relative change as a boolean
-    X['yesterday_up'] = np.where(X['pct_change_160'] > 0, 1, 0) # Using 160 bar lookback as a proxy for yesterday
-    X['yesterday_down'] = np.where(X['pct_change_160'] < 0, 1, 0) # Using 160 bar lookback as a proxy for yesterday
-    X['up_down_run_160'] = np.sign(data.close.diff(160)).rolling(lookback_window).sum()
-    X['up_down_run_1'] = np.sign(data.close.diff(1)).rolling(lookback_window).sum()
-    # Add in runs of up/down days TODO: Need to make this a function and do it properly
-    # X['up_day_count'] = data.close.vbt.rolling_count(data.close > data.close.shift(160), window=lookback_window)
-    
-    X['mid_range_momentum']= pd.Series(np.where(X['pct_change_100'] > X['pct_change_420'], True, False), index=X.index)
-    X['short_range_momentum']= pd.Series(np.where(X['pct_change_20'] > X['pct_change_40'], True, False), index=X.index)
-    X['short_over_long_momentum'] = pd.Series(np.where(X['pct_change_20'] > X['pct_change_420'], True, False), index=X.index)
-    X['momentum_trending'] = pd.Series(np.where(X['pct_change_20'] > X['pct_change_20'].shift(lookback_window), True, False), index=X.index)
-    # Label large moves
-    X['large_move_up'] = np.where(data.close > data.close.shift(lookback_window) * 1.05, 1, 0)
-    X['large_move_down'] = np.where(data.close < data.close.shift(lookback_window) * 0.95, 1, 0)  
-    # Drop the time columns
-    return X
+def _add_historical_returns(X, data, lookback_window, horizons=RETURN_HORIZONS):
+    # Returns of every horizon as one 2D block on the close array, the yesterday flags, up/down runs,
+    # momentum comparisons and large moves are derived from it (return_features.py, also used for streaming updates)
+    features = historical_return_features(data.close.to_numpy(), lookback_window, horizons)
+    return pd.concat([X, pd.DataFrame(features, index=X.index, copy=False)], axis=1)
 
 def _add_time_features(X):
     X['dayofmonth']  = X.index.day
@@ -222,6 +124,28 @@ def _handle_missing_data(df):
     df = df.loc[~invalid_row_mask]
     return df
 
+def _compact_dtypes(X):
+    # float32 for the continuous features, uint8 for the 0/1 and boolean flags and the smallest integer type for
+    # the other integers (calendar features). Other columns, e.g. timestamps, are left as they are.
+    memory_before = X.memory_usage(deep=True).sum()
+    columns = {}
+    for column in X.columns:
+        values = X[column]
+        if values.dtype == bool or values.dtype == object and values.map(lambda value: isinstance(value, (bool, np.bool_))).all():
+            columns[column] = values.astype(np.uint8)
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            is_flag = values.isin([0, 1]).all()
+            columns[column] = values.astype(np.uint8) if is_flag else pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values.dtype):
+            columns[column] = values.astype(np.float32)
+        else:
+            columns[column] = values
+    X = pd.DataFrame(columns, index=X.index)
+
+    memory_after = X.memory_usage(deep=True).sum()
+    print(f'Compact X: {memory_before / 2**20:,.1f} MB -> {memory_after / 2**20:,.1f} MB ({1 - memory_after / max(memory_before, 1):.0%} saved)')
+    return X
+
 def _create_target(X, periods_future, base_predictions=None, meta=False):
     # Now we are trying to generate future price predictions so we will set the y labels to the price change n periods in the future
     y = (X.Close.shift(-periods_future) / X.Close - 1) # future price change
@@ -238,38 +162,58 @@ def _create_target(X, periods_future, base_predictions=None, meta=False):
     return y
 drop_cols = ['Open Time', 'Close Time']
 
-def _generate_features(data, lookback_window, pivot_up_th, pivot_down_th, drop_cols=drop_cols):
-    pivot_up_th2 = pivot_up_th * 1.5
-    pivot_down_th2 = pivot_down_th * 1.5
-    pivot_up_th3 = pivot_up_th * 2
-    pivot_down_th3 = pivot_down_th * 2
-    
-    # Generate the features (X)
-    X = data.get()
-
-    # Add all of the World Quant Alphas
-    alphas = data.run(["wqa101_%d" % i for i in range(1, 102)], missing_index="drop") # 101 strategies
-    X = pd.concat([X, alphas], axis=1)
-    # Replace NaNs with 0s
-    X = X.fillna(0)
-    # Add pivot trends
-    X = _add_pivot_trends(X, data, pivot_up_th, pivot_down_th, pivot_up_th2, pivot_down_th2, pivot_up_th3, pivot_down_th3)
-    # Add TA features
-    X = _add_ta_features(X, data, lookback_window)
-    # Add historical returns
-    X = _add_historical_returns(X, data, lookback_window)
-    # Add time features
-    X = _add_time_features(X)
+def _feature_groups(lookback_window, pivot_up_th, pivot_down_th, indicators, alphas=WQA_ALPHAS):
+    # (name, function, parameters, warm-up bars, compute) of each feature group in column order, compute(data) returns
+    # only the group's columns. The historical returns and time features look back a fixed number of bars, so the
+    # feature store can extend them to new bars, the supertrend, pivots and alphas depend on every bar before.
+    pivot_params = {'pivot_up_th': pivot_up_th, 'pivot_down_th': pivot_down_th,
+                    'pivot_up_th2': pivot_up_th * 1.5, 'pivot_down_th2': pivot_down_th * 1.5,
+                    'pivot_up_th3': pivot_up_th * 2, 'pivot_down_th3': pivot_down_th * 2}
+    empty_X = lambda data: pd.DataFrame(index=data.get().index)
+
+    return [
+        # The alphas and the historical returns are computed in their own modules, whose code is part of the feature store key
+        ('wqa_alphas', (_add_wqa_alphas, wqa_alphas), {'alphas': tuple(alphas)}, None,
+         lambda data: _add_wqa_alphas(empty_X(data), data, indicators, alphas)),
+        ('pivot_trends', _add_pivot_trends, pivot_params, None,
+         lambda data: _add_pivot_trends(empty_X(data), data, indicators=indicators, **pivot_params)),
+        ('ta_features', _add_ta_features, {'lookback_window': lookback_window}, None,
+         lambda data: _add_ta_features(empty_X(data), data, lookback_window, indicators)),
+        ('historical_returns', (_add_historical_returns, return_features), {'lookback_window': lookback_window}, return_features_history(lookback_window) - 1,
+         lambda data: _add_historical_returns(empty_X(data), data, lookback_window)),
+        ('time_features', _add_time_features, {}, 0,
+         lambda data: _add_time_features(empty_X(data))),
+    ]
+
+def _generate_features(data, lookback_window, pivot_up_th, pivot_down_th, drop_cols=drop_cols, indicators=None, feature_store_dir=None, alphas=WQA_ALPHAS):
+    # Every indicator goes through the registry, so it is computed once even if several features use it
+    indicators = IndicatorRegistry() if indicators is None else indicators
+
+    # Each group is read from the feature store (feature_store.py) when feature_store_dir is given, only the groups and
+    # bars that are not stored yet are computed
+    groups = []
+    for name, func, params, warmup_bars, compute in _feature_groups(lookback_window, pivot_up_th, pivot_down_th, indicators, alphas):
+        if feature_store_dir is None:
+            groups.append(compute(data))
+        else:
+            groups.append(load_feature_group(data, f'{FEATURE_GROUP_PREFIX}_{name}', params, compute, warmup_bars, func, feature_store_dir))
+
+    # Generate the features (X): the prices and all of the World Quant Alphas with NaNs replaced with 0s, then the pivot
+    # trends, TA features, historical returns and time features
+    X = pd.concat([data.get(), groups[0]], axis=1).fillna(0)
+    X = pd.concat([X] + groups[1:], axis=1)
     # Drop columns
     if drop_cols:
         drop_cols = [col for col in drop_cols if col in X.columns]
         X = X.drop(columns=drop_cols)
     return X
 
-def prepare_data(data, base_predictions=None, meta=False, pivot_up_th=0.10, pivot_down_th=0.10, periods_future=150, drop_cols=drop_cols):
+def prepare_data(data, base_predictions=None, meta=False, pivot_up_th=0.10, pivot_down_th=0.10, periods_future=150, drop_cols=drop_cols, indicators=None, feature_store_dir=None, alpha_index=None, compact=False):
     
     lookback_window = 14*periods_future  # Number of dollar bars we are predicting into the future times the typical RSI lookback window of 14
-    X = _generate_features(data, lookback_window, pivot_up_th, pivot_down_th, drop_cols)
+    # With an alpha index (wqa_alphas.build_alpha_index) only its kept alphas are computed, the degenerate and redundant ones are skipped
+    alphas = WQA_ALPHAS if alpha_index is None else alpha_index['keep']
+    X = _generate_features(data, lookback_window, pivot_up_th, pivot_down_th, drop_cols, indicators, feature_store_dir, alphas)
     
     # Create y using cleaned X data
     y = _create_target(X, periods_future, base_predictions, meta)
@@ -282,6 +226,10 @@ def prepare_data(data, base_predictions=None, meta=False, pivot_up_th=0.10, pivo
 
     # Convert column names to string
     X.columns = X.columns.astype(str)
+
+    # Compact mode: narrower dtypes, a fraction of the memory for every copy the cross validation takes
+    if compact:
+        X = _compact_dtypes(X)
     
     # Reindex y based on X's index to ensure they match
     y = y.reindex(X.index)
@@ -730,9 +678,9 @@ if __name__ == "__main__":
     
     # Import some data to play with
     print("Loading data...")
-    btc_90M_db_vbt = vbt.BinanceData.load('data/btc_90M_db_vbt.pkl')
-    data = btc_90M_db_vbt['2021-01-01':'2023-01-01']
-    outofsample_data = btc_90M_db_vbt['2023-01-01':'2023-06-03']
+    # The 90M dollar bars are built from the minute data once and read back from the bar cache after that
+    data = load_bar_data(bar_size=90_000_000, start='2021-01-01', end='2023-01-01')
+    outofsample_data = load_bar_data(bar_size=90_000_000, start='2023-01-01', end='2023-06-03')
     print(f'The in sample data.shape is {data.shape} The out of sample data.shape is {outofsample_data.shape}')
     # Wherever you saved the pickle file
     # data_path = 'data/BTCUSDT_1m_futures2.pkl'
@@ -767,8 +715,10 @@ if __name__ == "__main__":
     
     # Prep Data
     print("Preparing data...")
-    X, y = prepare_data(data, pivot_up_th=pivot_up_th, pivot_down_th=pivot_down_th, periods_future=periods_future, drop_cols=drop_cols) # in-sample
-    Xoos, yoos = prepare_data(outofsample_data, pivot_up_th=pivot_up_th, pivot_down_th=pivot_down_th, periods_future=periods_future, drop_cols=drop_cols) # out-of-sample
+    # The alphas that are degenerate or redundant in-sample are not computed for either set, so X and Xoos keep the same columns
+    alpha_index = load_alpha_index(data) or build_alpha_index(data)
+    X, y = prepare_data(data, pivot_up_th=pivot_up_th, pivot_down_th=pivot_down_th, periods_future=periods_future, drop_cols=drop_cols, alpha_index=alpha_index, feature_store_dir=FEATURE_STORE_DIR) # in-sample
+    Xoos, yoos = prepare_data(outofsample_data, pivot_up_th=pivot_up_th, pivot_down_th=pivot_down_th, periods_future=periods_future, drop_cols=drop_cols, alpha_index=alpha_index, feature_store_dir=FEATURE_STORE_DIR) # out-of-sample
 
     # Set up the pipeline and create the cross validation splits
     pipeline = create_pipeline(X, model='xgb')
@@ -0,0 +1,119 @@
+import os
+import glob
+import inspect
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+FEATURE_STORE_DIR = os.path.join("data", "feature_store")
+BAR_HASH_COLUMN = "_bar_hash"          # Hash of the bar each feature row was computed from, checked before a row is reused
+ROW_GROUP_SIZE = 50_000
+
+
+def _bars_frame(data):
+    # The bars of a vbt Data object, a DataFrame is used as is (DataFrame.get needs a key)
+    return data if isinstance(data, pd.DataFrame) else data.get()
+
+
+def bar_hashes(data):
+    """
+    One uint64 hash per bar of a vbt Data object (or a DataFrame), over its time and all of its columns.
+    """
+    return pd.util.hash_pandas_object(_bars_frame(data), index=True).to_numpy()
+
+
+def _code_bytes(code):
+    try:
+        return inspect.getsource(code).encode()
+    except (OSError, TypeError):
+        # No source file, e.g. a function exec'd in a notebook kernel without its cell cached
+        if hasattr(code, '__code__'):
+            return code.__code__.co_code + repr(code.__code__.co_consts).encode()
+        return repr(code).encode()
+
+
+def _code_key(func):
+    # func is the group's function, or a tuple of it and the modules (or functions) it does its work in
+    if func is None:
+        return hashlib.sha1(b'').hexdigest()[:12]
+    sha = hashlib.sha1()
+    for code in (func if isinstance(func, (tuple, list)) else (func,)):
+        sha.update(_code_bytes(code))
+    return sha.hexdigest()[:12]
+
+
+def _group_file(store_dir, name, params, func, first_bar_hash):
+    # Group name + parameters + first bar identify the dataset, the last part is the code of the function that computes
+    # the group, so editing it maps to the same prefix and the old file is removed
+    params_key = hashlib.sha1(repr(sorted(params.items())).encode()).hexdigest()[:8]
+    code_key = _code_key(func)
+
+    return os.path.join(store_dir, f'{name}_{params_key}_{first_bar_hash:016x}_{code_key}.parquet')
+
+
+def _write_group_file(group_df, hashes, group_file):
+    for stale_file in glob.glob(group_file.rsplit('_', 1)[0] + '_*.parquet'):
+        if stale_file != group_file:
+            os.remove(stale_file)
+
+    tmp_file = group_file + '.tmp'
+    group_df.assign(**{BAR_HASH_COLUMN: hashes}).to_parquet(tmp_file, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_file, group_file)
+
+
+def load_feature_group(data, name, params, compute, warmup_bars=None, func=None, store_dir=FEATURE_STORE_DIR):
+    """
+    The columns of one feature group, read from the store when they were computed before and computed otherwise.
+
+    The features are causal (a row only depends on the bars up to it), so the stored rows stay valid for any data
+    that starts with the same bars: a shorter range is sliced from the file, and for a longer one only the new
+    bars are computed. Each row is checked against the hash of its bar, a rebuilt bar invalidates it and the rows after it.
+
+    Parameters:
+    data (vbt.Data): Bars the features are computed from.
+    name (str): Feature group name, part of the file name.
+    params (dict): Parameters of the group, e.g. {'lookback_window': 2100}.
+    compute (callable): compute(data) -> DataFrame of the group's columns on data's index.
+    warmup_bars (int): Bars before the new bars needed to compute them exactly, e.g. the longest rolling window.
+                       None when every bar before matters (supertrend, pivots), new bars then recompute the whole group.
+    func (function or tuple): Function that computes the group, its code is part of the key. A tuple also puts the
+                              code of the modules or functions it calls into the key, e.g. (_add_historical_returns, return_features).
+    store_dir (str): Directory of the feature files.
+
+    Returns:
+    group_df (DataFrame): The group's columns, one row per bar of data.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    hashes = bar_hashes(data)
+    if len(hashes) == 0:
+        return compute(data)
+    group_file = _group_file(store_dir, name, params, func, int(hashes[0]))
+
+    valid_rows, cached_df = 0, None
+    if os.path.exists(group_file):
+        cached_df = pd.read_parquet(group_file)
+        cached_hashes = cached_df.pop(BAR_HASH_COLUMN).to_numpy()
+        overlap = min(len(cached_hashes), len(hashes))
+        mismatch = np.flatnonzero(cached_hashes[:overlap] != hashes[:overlap])
+        valid_rows = int(mismatch[0]) if len(mismatch) else overlap
+
+    if valid_rows == len(hashes):
+        return cached_df.iloc[:valid_rows]
+
+    # Parquet needs string column names, prepare_data turns them into strings at the end anyway
+    if valid_rows > 0 and warmup_bars is not None:
+        print(f'Extending feature group {name} by {len(hashes) - valid_rows:,} bars...')
+        start_row = max(valid_rows - warmup_bars, 0)
+        new_df = compute(data.iloc[start_row:]).iloc[valid_rows - start_row:]
+        new_df.columns = [str(column) for column in new_df.columns]
+        group_df = pd.concat([cached_df.iloc[:valid_rows], new_df])
+    else:
+        print(f'Computing feature group {name} for {len(hashes):,} bars...')
+        group_df = compute(data)
+        group_df.columns = [str(column) for column in group_df.columns]
+
+    group_df = group_df.reindex(_bars_frame(data).index)
+    _write_group_file(group_df, hashes, group_file)
+
+    return group_df
@@ -0,0 +1,69 @@
+import time
+import hashlib
+import pandas as pd
+
+
+def data_fingerprint(data):
+    """
+    Content fingerprint of a vbt Data object (or a DataFrame): a hash of its index and values, so two
+    objects holding the same bars share their cached indicators and a different slice never does.
+    """
+    df = data if isinstance(data, pd.DataFrame) else data.get()     # DataFrame.get needs a key
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()).hexdigest()
+
+
+class IndicatorRegistry:
+    """
+    Memoizes data.run(indicator, **params). Results are keyed by (indicator, params, data fingerprint), so
+    each indicator is computed once however many feature functions ask for it.
+
+    A registry is created per prepare_data call unless one is passed in, passing the same registry to
+    several calls on the same data also reuses the indicators across them.
+    """
+
+    def __init__(self):
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.compute_seconds = {}     # Key -> seconds the indicator took to compute, what each hit saves
+        self.saved_seconds = 0.0
+        self._fingerprints = {}       # id(data) -> (data, fingerprint), the data is kept so the id is not reused
+
+    def _fingerprint(self, data):
+        if id(data) not in self._fingerprints:
+            self._fingerprints[id(data)] = (data, data_fingerprint(data))
+        return self._fingerprints[id(data)][1]
+
+    def run(self, data, indicator, **params):
+        """
+        data.run(indicator, **params), computed on the first call and returned from the cache after that.
+        indicator can be a name or a list of names, as for data.run.
+        """
+        name = indicator if isinstance(indicator, str) else tuple(indicator)
+        return self.cached(data, name, lambda data, **params: data.run(indicator, **params), **params)
+
+    def cached(self, data, name, compute, **params):
+        """
+        compute(data, **params) memoized under name, for indicators that are not computed by data.run.
+        """
+        key = (name, tuple(sorted(params.items())), self._fingerprint(data))
+
+        if key in self.cache:
+            self.hits += 1
+            self.saved_seconds += self.compute_seconds[key]
+            return self.cache[key]
+
+        self.misses += 1
+        start_time = time.perf_counter()
+        self.cache[key] = compute(data, **params)
+        self.compute_seconds[key] = time.perf_counter() - start_time
+        return self.cache[key]
+
+    def clear(self):
+        self.cache.clear()
+        self.compute_seconds.clear()
+        self._fingerprints.clear()
+
+    def __repr__(self):
+        return (f'IndicatorRegistry({len(self.cache)} cached, {self.hits} hits, {self.misses} misses, '
+                f'{self.saved_seconds:.2f} seconds saved)')
@@ -0,0 +1,740 @@
+from dataclasses import dataclass
+from typing import List
+import numpy as np
+import pandas as pd
+from numba import njit, prange
+
+# Order types carried from one bar to the next, orders are filled on the following bar like backtesting.py does
+ORDER_NONE            = 0
+ORDER_OPEN            = 1
+ORDER_CLOSE_ALL       = 2
+
+# Columns of an open trade
+TRADE_SIZE            = 0
+TRADE_ENTRY_PRICE     = 1
+TRADE_ENTRY_BAR       = 2
+
+# Account state carried between kernel calls
+STATE_CASH            = 0
+STATE_N_OPEN          = 1
+STATE_ORDER_TYPE      = 2
+STATE_ORDER_SIZE      = 3
+STATE_PREV_CLOSE      = 4             # Close of the last bar of the previous chunk, orders placed on it fill at this price
+STATE_SIZE            = 5
+
+TRADE_LOG_SIZE        = 4096          # Closed trades buffered per kernel call (at least, see _trade_log_size): size, entry bar, exit bar, entry price, exit price, commissions
+TRADE_LOG_COLUMNS     = 6
+
+# The rules of backtest_script.pos_manager. The Strategy and the PosManagerParams defaults both read these, so the two engines run the same rules
+POS_MANAGER_LONG_SIZE         = 0.4
+POS_MANAGER_SHORT_SIZE        = 0.3
+POS_MANAGER_PYRAMID_SIZE      = 0.2
+POS_MANAGER_TAKE_PROFIT_PCT   = 0.003
+POS_MANAGER_STOP_LOSS_PCT     = -0.05
+POS_MANAGER_PYRAMID_TRADE_PCT = -0.0040
+POS_MANAGER_PYRAMID_BARS      = 60 * 60     # backtest_script passes its NUM_PRICES_PER_HOUR
+POS_MANAGER_MAX_TRADES        = 5
+
+# Per parameter set totals of a sweep, updated bar by bar and trade by trade
+SWEEP_EQUITY_PEAK     = 0
+SWEEP_MAX_DRAWDOWN    = 1
+SWEEP_LAST_EQUITY     = 2
+SWEEP_N_TRADES        = 3
+SWEEP_N_WINS          = 4
+SWEEP_BEST_RETURN     = 5
+SWEEP_WORST_RETURN    = 6
+SWEEP_SUM_RETURN      = 7
+SWEEP_SUM_LOG_RETURN  = 8             # Sum of log(1 + return), for the geometric mean. nan once a trade loses it all
+SWEEP_GROSS_PROFIT    = 9             # Sum of the positive trade returns
+SWEEP_GROSS_LOSS      = 10            # Sum of the negative trade returns
+SWEEP_SUM_PL          = 11
+SWEEP_SUM_PL_SQUARED  = 12
+SWEEP_COMMISSIONS     = 13
+SWEEP_SIZE            = 14
+
+SWEEP_PARAMETERS      = ['long_size', 'short_size', 'pyramid_size', 'take_profit_pct', 'stop_loss_pct', 'pyramid_trade_pct', 'pyramid_bars', 'max_trades']
+
+
+
+@dataclass
+class PosManagerParams:
+  """
+  The rules of backtest_script.pos_manager and the Backtest() arguments it runs with. The thresholds are
+  compared against backtesting.py's Position.pl_pct (in percent) and Trade.pl_pct (a fraction), the same
+  way pos_manager.next() does.
+  """
+  cash              : float = 100_000_000
+  commission        : float = .0014
+  margin            : float = 0.25
+  long_size         : float = POS_MANAGER_LONG_SIZE
+  short_size        : float = POS_MANAGER_SHORT_SIZE
+  pyramid_size      : float = POS_MANAGER_PYRAMID_SIZE
+  take_profit_pct   : float = POS_MANAGER_TAKE_PROFIT_PCT     # Close when Position.pl_pct is above this
+  stop_loss_pct     : float = POS_MANAGER_STOP_LOSS_PCT       # Close a long when Position.pl_pct is below this
+  pyramid_trade_pct : float = POS_MANAGER_PYRAMID_TRADE_PCT   # Add to the position when the last Trade.pl_pct is below this ...
+  pyramid_bars      : int   = POS_MANAGER_PYRAMID_BARS        # ... more than this many bars after the last entry ...
+  max_trades        : int   = POS_MANAGER_MAX_TRADES          # ... while fewer than this many trades are open
+
+
+
+@njit(cache=True)
+def _trade_log_size(max_trades):
+  # The kernel only runs a bar while max_trades more closed trades fit in the log, so it has to hold more than that
+  return max(TRADE_LOG_SIZE, 2 * max_trades + 1)
+
+
+
+@njit(cache=True)
+def _open_pl(open_trades, n_open, price):
+  # backtesting.py: last_price * position_size - sum(size * entry_price), summed in trade order
+  position_size = 0.0
+  cost          = 0.0
+  for k in range(n_open):
+    position_size += open_trades[k, TRADE_SIZE]
+    cost          += open_trades[k, TRADE_SIZE] * open_trades[k, TRADE_ENTRY_PRICE]
+  return price * position_size - cost
+
+
+
+@njit(cache=True)
+def _log_closed_trade(trade_log, n_logged, open_trades, k, exit_bar, exit_price, commission):
+  size, entry_price       = open_trades[k, TRADE_SIZE], open_trades[k, TRADE_ENTRY_PRICE]
+  exit_commission         = 0 + abs(size) * exit_price * commission
+  trade_log[n_logged, 0]  = size
+  trade_log[n_logged, 1]  = open_trades[k, TRADE_ENTRY_BAR]
+  trade_log[n_logged, 2]  = exit_bar
+  trade_log[n_logged, 3]  = entry_price
+  trade_log[n_logged, 4]  = exit_price
+  trade_log[n_logged, 5]  = exit_commission + (0 + abs(size) * entry_price * commission)
+  return size * (exit_price - entry_price) - 0 - exit_commission
+
+
+
+@njit(cache=True)
+def _pos_manager_nb(close, signal, start, bar_offset, equity, trade_log, open_trades, state, commission, leverage,
+                    long_size, short_size, pyramid_size, take_profit_pct, stop_loss_pct,
+                    pyramid_trade_pct, pyramid_bars, max_trades):
+  """
+  Simulate bars start.. of backtest_script.pos_manager under backtesting.py's broker rules.
+
+  The account lives in state/open_trades and closed trades are written to trade_log. The loop returns
+  early when trade_log could overflow on the next bar, the caller empties it and calls again from the
+  returned bar.
+
+  close[0] is bar bar_offset of the whole run. Bar numbers in open_trades and trade_log count from the
+  start of the run, so the same state can be carried into the next chunk of prices.
+  """
+  n             = len(close)
+  cash          = state[STATE_CASH]
+  n_open        = int(state[STATE_N_OPEN])
+  order_type    = int(state[STATE_ORDER_TYPE])
+  order_size    = state[STATE_ORDER_SIZE]
+  n_logged      = 0
+
+  i = start
+  while i < n and n_logged + max_trades < len(trade_log):
+    # Broker.next(): fill the order placed on the previous bar at its close (trade_on_close=True)
+    if order_type != ORDER_NONE:
+      price = close[i - 1] if i > 0 else state[STATE_PREV_CLOSE]
+
+      if order_type == ORDER_CLOSE_ALL:
+        # Position.close() queues one order per trade at the front of the queue, so the last opened trade is closed first
+        for k in range(n_open - 1, -1, -1):
+          cash     += _log_closed_trade(trade_log, n_logged, open_trades, k, bar_offset + i - 1, price, commission)
+          n_logged += 1
+        n_open = 0
+
+      else:
+        # Relative order size -> units, from the margin available at this bar's close
+        margin_used = 0.0
+        for k in range(n_open):
+          margin_used += abs(open_trades[k, TRADE_SIZE]) * close[i] / leverage
+        margin_available  = max(0.0, cash + _open_pl(open_trades, n_open, close[i]) - margin_used)
+        price_plus_comm   = price + (0 + abs(order_size) * price * commission) / abs(order_size)
+        units             = (margin_available * leverage * abs(order_size)) // price_plus_comm
+        units             = units if order_size > 0 else -units
+
+        # Orders the margin cannot cover are canceled by the broker
+        if units != 0 and not abs(units) * price_plus_comm > margin_available * leverage:
+          open_trades[n_open, TRADE_SIZE]         = units
+          open_trades[n_open, TRADE_ENTRY_PRICE]  = price
+          open_trades[n_open, TRADE_ENTRY_BAR]    = bar_offset + i - 1
+          n_open                                 += 1
+          cash                                   -= 0 + abs(units) * price * commission
+
+      order_type = ORDER_NONE
+
+    equity[i] = cash + _open_pl(open_trades, n_open, close[i])
+
+    if equity[i] <= 0:
+      # Out of money: backtesting.py closes the open trades while removing them from the list it iterates,
+      # so only every other trade is closed, then the run stops with zero equity
+      for k in range(0, n_open, 2):
+        _log_closed_trade(trade_log, n_logged, open_trades, k, bar_offset + i, close[i], commission)
+        n_logged += 1
+      equity[i:] = 0
+      cash       = 0.0
+      n_open     = 0
+      i          = n
+      break
+
+    # pos_manager.next()
+    if n_open == 0:
+      if signal[i] == 1:
+        order_type, order_size = ORDER_OPEN, long_size
+      if signal[i] == 2:
+        order_type, order_size = ORDER_OPEN, -short_size
+      i += 1
+      continue
+
+    position_size = 0.0
+    invested      = 0.0
+    for k in range(n_open):
+      position_size += open_trades[k, TRADE_SIZE]
+      invested      += abs(open_trades[k, TRADE_SIZE]) * open_trades[k, TRADE_ENTRY_PRICE]
+    last_size             = open_trades[n_open - 1, TRADE_SIZE]
+    last_entry_price      = open_trades[n_open - 1, TRADE_ENTRY_PRICE]
+    position_pl_pct       = (_open_pl(open_trades, n_open, close[i]) / invested) * 100 if invested else 0.0
+    last_trade_pl_pct     = (1.0 if last_size > 0 else -1.0) * (close[i] / last_entry_price - 1)
+    bars_since_prev_trade = bar_offset + i + 1 - open_trades[n_open - 1, TRADE_ENTRY_BAR]
+    can_pyramid           = last_trade_pl_pct < pyramid_trade_pct and bars_since_prev_trade > pyramid_bars and n_open < max_trades
+
+    if position_size > 0:
+      if position_pl_pct > take_profit_pct:
+        order_type = ORDER_CLOSE_ALL
+      elif position_pl_pct < -0.00 and signal[i] == 2:
+        order_type = ORDER_CLOSE_ALL
+      elif position_pl_pct < stop_loss_pct:
+        order_type = ORDER_CLOSE_ALL
+      elif can_pyramid:
+        order_type, order_size = ORDER_OPEN, pyramid_size
+
+    elif position_size < 0:
+      if position_pl_pct > take_profit_pct:
+        order_type = ORDER_CLOSE_ALL
+      elif position_pl_pct < -0.00 and (signal[i] == 1 or signal[i] == 2):
+        order_type = ORDER_CLOSE_ALL
+      elif can_pyramid:
+        order_type, order_size = ORDER_OPEN, -pyramid_size
+
+    i += 1
+
+  state[STATE_CASH]       = cash
+  state[STATE_N_OPEN]     = n_open
+  state[STATE_ORDER_TYPE] = order_type
+  state[STATE_ORDER_SIZE] = order_size
+  if i == n and n > 0:
+    state[STATE_PREV_CLOSE] = close[n - 1]
+
+  return i, n_logged
+
+
+
+def _simulate(close: np.ndarray, signal: np.ndarray, params: PosManagerParams):
+  equity      = np.full(len(close), np.nan)
+  trade_log   = np.empty((_trade_log_size(params.max_trades), TRADE_LOG_COLUMNS))
+  open_trades = np.zeros((params.max_trades + 1, 3))
+  state       = np.zeros(STATE_SIZE)
+  state[STATE_CASH] = params.cash
+
+  logged_trades = []
+  i = 1
+  while i < len(close):
+    i, n_logged = _pos_manager_nb(close, signal, i, 0, equity, trade_log, open_trades, state, float(params.commission), 1 / params.margin,
+                                  float(params.long_size), float(params.short_size), float(params.pyramid_size),
+                                  float(params.take_profit_pct), float(params.stop_loss_pct), float(params.pyramid_trade_pct),
+                                  int(params.pyramid_bars), int(params.max_trades))
+    logged_trades.append(trade_log[:n_logged].copy())
+
+  return equity, np.concatenate(logged_trades) if logged_trades else trade_log[:0]
+
+
+
+class _ClosedTrade:
+  # The attributes backtesting's compute_stats reads from a closed Trade
+  def __init__(self, index: pd.Index, size: int, entry_bar: int, exit_bar: int, entry_price: float, exit_price: float, commissions: float):
+    self.size         = size
+    self.entry_bar    = entry_bar
+    self.exit_bar     = exit_bar
+    self.entry_price  = entry_price
+    self.exit_price   = exit_price
+    self.sl           = None
+    self.tp           = None
+    self.tag          = None
+    self._commissions = commissions
+    self.pl           = size * (exit_price - entry_price) - commissions
+    self.pl_pct       = np.copysign(1, size) * (exit_price / entry_price - 1) - commissions / (abs(size) * entry_price)
+    self.entry_time   = index[entry_bar]
+    self.exit_time    = index[exit_bar]
+
+
+
+def run_pos_manager(df: pd.DataFrame, params: PosManagerParams = PosManagerParams()) -> pd.Series:
+  """
+  Compiled equivalent of Backtest(df, pos_manager, cash=..., trade_on_close=True, commission=..., margin=...).run().
+
+  df needs 'Open', 'High', 'Low', 'Close' and 'signal' columns like the merged frame backtest_script builds.
+  Returns the same stats Series, with the same '_trades' and '_equity_curve' frames.
+  """
+  from backtesting._stats import compute_stats     # Private API, requirements.txt pins the backtesting version it was checked against
+
+  close   = np.ascontiguousarray(df['Close'].to_numpy(dtype=np.float64))
+  signal  = np.ascontiguousarray(df['signal'].to_numpy(dtype=np.float64))
+
+  equity, trade_log = _simulate(close, signal, params)
+
+  trades = [_ClosedTrade(df.index, int(size), int(entry_bar), int(exit_bar), entry_price, exit_price, commissions)
+            for size, entry_bar, exit_bar, entry_price, exit_price, commissions in trade_log.tolist()]
+  equity = pd.Series(equity).bfill().fillna(params.cash).values
+
+  stats = compute_stats(trades=trades, equity=equity, ohlc_data=df, strategy_instance=None, risk_free_rate=0.0)
+  trades_df = stats['_trades']
+  if len(trades_df):
+    trades_df['Entry_λ'] = signal[trades_df['EntryBar'].values]
+    trades_df['Exit_λ']  = signal[trades_df['ExitBar'].values]
+  stats['_strategy'] = 'pos_manager'
+
+  return stats
+
+
+
+def _same_stat(expected, actual, rtol: float) -> bool:
+  if pd.isna(expected) is True or pd.isna(actual) is True:
+    return pd.isna(expected) is True and pd.isna(actual) is True
+  if isinstance(expected, (float, np.floating)) or isinstance(actual, (float, np.floating)):
+    return bool(np.isclose(expected, actual, rtol=rtol, atol=0))
+  return expected == actual
+
+
+
+def stats_differences(expected: pd.Series, actual: pd.Series, rtol: float = 1e-9) -> List[str]:
+  """
+  Where two stats Series of Backtest.run() / run_pos_manager differ: the '_trades' and '_equity_curve' frames
+  and every stat. Floats are compared to rtol, an empty list means the runs match.
+  """
+  differences = []
+  for name in ['_trades', '_equity_curve']:
+    try:
+      pd.testing.assert_frame_equal(expected[name], actual[name], check_dtype=False, rtol=rtol, atol=0)
+    except AssertionError as error:
+      differences.append(f'{name}: {error}')
+
+  for key in expected.index:
+    if key.startswith('_'):
+      continue
+    if key not in actual.index:
+      differences.append(f'{key}: missing')
+    elif not _same_stat(expected[key], actual[key], rtol):
+      differences.append(f'{key}: {expected[key]} != {actual[key]}')
+
+  return differences
+
+
+
+def _round_timedelta(value, period: pd.Timedelta):
+  # backtesting._stats rounds the durations up to the resolution of the bar period
+  if not isinstance(value, pd.Timedelta):
+    return value
+  return value.ceil(getattr(period, 'resolution_string', None) or period.resolution)
+
+
+
+def _trades_frame(trade_log: np.ndarray, entry_times: list, exit_times: list, entry_signals: list, exit_signals: list) -> pd.DataFrame:
+  # The stats['_trades'] layout compute_stats builds from the closed Trade objects
+  size, entry_bar, exit_bar, entry_price, exit_price, commissions = trade_log.T
+  trades_df = pd.DataFrame({
+    'Size'        : size.astype(np.int64),
+    'EntryBar'    : entry_bar.astype(np.int64),
+    'ExitBar'     : exit_bar.astype(np.int64),
+    'EntryPrice'  : entry_price,
+    'ExitPrice'   : exit_price,
+    'SL'          : [None] * len(size),
+    'TP'          : [None] * len(size),
+    'PnL'         : size * (exit_price - entry_price) - commissions,
+    'Commission'  : commissions,
+    'ReturnPct'   : np.copysign(1, size) * (exit_price / entry_price - 1) - commissions / (abs(size) * entry_price),
+    'EntryTime'   : pd.to_datetime(pd.Series(entry_times, dtype=object)),
+    'ExitTime'    : pd.to_datetime(pd.Series(exit_times, dtype=object)),
+  })
+  trades_df['Duration'] = trades_df['ExitTime'] - trades_df['EntryTime']
+  trades_df['Tag']      = [None] * len(size)
+  trades_df['Entry_λ']  = np.asarray(entry_signals, dtype=np.float64)
+  trades_df['Exit_λ']   = np.asarray(exit_signals, dtype=np.float64)
+
+  return trades_df
+
+
+
+class RunningStats:
+  """
+  backtesting's compute_stats, accumulated one chunk of the equity curve at a time: running peak and
+  drawdown episodes, the daily equity, the moments behind Beta and the bar counts. Only a few numbers
+  per drawdown episode and one value per day are kept.
+  """
+  def __init__(self):
+    self.n_bars         = 0
+    self.start          = None
+    self.end            = None
+    self.last_times     = pd.DatetimeIndex([])
+    self.first_equity   = np.nan
+    self.last_equity    = np.nan
+    self.peak           = -np.inf
+    self.max_dd         = 0.0
+    self.first_close    = np.nan
+    self.last_close     = np.nan
+    self.weekend_bars   = 0
+    self.daily_equity   = pd.Series(dtype=float)
+
+    # Drawdown episodes run from one bar at the equity peak (dd == 0) to the next one
+    self.last_zero_bar  = 0
+    self.last_zero_time = None
+    self.dd_since_zero  = 0.0
+    self.n_episodes     = 0
+    self.dd_dur_sum     = 0
+    self.dd_dur_max     = 0
+    self.dd_peak_sum    = 0.0
+    self.dd_positive    = [0, 0.0, 0.0]         # Count, sum and max of dd > 0, used by compute_stats when there is no episode
+
+    # Sums of the bar log returns of the equity (x) and the close (y)
+    self.moments        = np.zeros(6)           # n, sx, sy, sxx, syy, sxy
+
+  def update(self, index: pd.DatetimeIndex, equity: np.ndarray, close: np.ndarray) -> pd.DataFrame:
+    times = index.as_unit('ns').asi8
+    if self.n_bars == 0:
+      self.start, self.first_equity, self.first_close, self.last_zero_time = index[0], equity[0], close[0], times[0]
+      prev_equity, prev_close = equity[:1], close[:1]
+    else:
+      prev_equity, prev_close = np.r_[self.last_equity], np.r_[self.last_close]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+      x = np.log(equity / np.r_[prev_equity, equity[:-1]])[0 if self.n_bars else 1:]
+      y = np.log(close / np.r_[prev_close, close[:-1]])[0 if self.n_bars else 1:]
+      self.moments += [len(x), x.sum(), y.sum(), (x * x).sum(), (y * y).sum(), (x * y).sum()]
+
+    peak        = np.maximum.accumulate(np.r_[self.peak, equity])[1:]
+    dd          = 1 - equity / peak
+    self.peak   = peak[-1]
+    self.max_dd = max(self.max_dd, np.nan_to_num(dd.max()))
+    positive    = dd[dd > 0]
+    self.dd_positive = [self.dd_positive[0] + len(positive), self.dd_positive[1] + positive.sum(), max(self.dd_positive[2], positive.max(initial=0))]
+
+    dd_dur = np.full(len(dd), np.timedelta64('NaT', 'ns'))
+    zeros  = np.flatnonzero(dd == 0)
+    if len(zeros):
+      seg_max     = np.maximum.reduceat(dd, zeros)
+      peaks       = np.r_[max(self.dd_since_zero, dd[:zeros[0]].max(initial=0)), seg_max[:-1]]
+      prev_bars   = np.r_[self.last_zero_bar, zeros[:-1] + self.n_bars]
+      durations   = times[zeros] - np.r_[self.last_zero_time, times[zeros[:-1]]]
+      is_episode  = zeros + self.n_bars > prev_bars + 1
+      self.n_episodes  += int(is_episode.sum())
+      self.dd_dur_sum  += int(durations[is_episode].sum())
+      self.dd_dur_max   = max(self.dd_dur_max, int(durations[is_episode].max(initial=0)))
+      self.dd_peak_sum += peaks[is_episode].sum()
+      dd_dur[zeros[is_episode]] = durations[is_episode].astype('timedelta64[ns]')
+      self.last_zero_bar, self.last_zero_time, self.dd_since_zero = int(zeros[-1]) + self.n_bars, times[zeros[-1]], seg_max[-1]
+    else:
+      self.dd_since_zero = max(self.dd_since_zero, dd.max())
+
+    chunk_daily       = pd.Series(equity, index=index).resample('D').last().dropna()
+    self.daily_equity = pd.concat([self.daily_equity, chunk_daily]) if len(self.daily_equity) else chunk_daily
+    self.daily_equity = self.daily_equity.groupby(level=0).last()
+
+    self.n_bars      += len(equity)
+    self.end          = index[-1]
+    self.last_times   = index[-100:] if len(index) >= 100 else self.last_times.append(index)[-100:]
+    self.last_equity  = equity[-1]
+    self.last_close   = close[-1]
+    self.weekend_bars += int(index.dayofweek.isin([5, 6]).sum())
+
+    # The duration of a drawdown still running at the end of the run is only in the stats, not in the curve
+    return pd.DataFrame({'Equity': equity, 'DrawdownPct': dd, 'DrawdownDuration': pd.to_timedelta(dd_dur)}, index=index)
+
+  def drawdown_durations(self, period: pd.Timedelta):
+    n_episodes, dd_dur_sum, dd_dur_max, dd_peak_sum = self.n_episodes, self.dd_dur_sum, self.dd_dur_max, self.dd_peak_sum
+    if self.n_bars - 1 > self.last_zero_bar + 1:
+      # compute_stats ends the last episode on the last bar
+      duration      = self.end.as_unit('ns').value - self.last_zero_time
+      n_episodes   += 1
+      dd_dur_sum   += duration
+      dd_dur_max    = max(dd_dur_max, duration)
+      dd_peak_sum  += self.dd_since_zero
+
+    if not n_episodes:
+      count, total, maximum = self.dd_positive
+      mean = total / count if count else np.nan
+      return (maximum if count else np.nan), mean, mean
+
+    return (_round_timedelta(pd.Timedelta(dd_dur_max), period), _round_timedelta(pd.Timedelta(dd_dur_sum / n_episodes), period),
+            dd_peak_sum / n_episodes)
+
+  def stats(self, trades_df: pd.DataFrame) -> pd.Series:
+    """
+    Stats of the whole run, computed like backtesting's compute_stats. trades_df holds the closed trades
+    of the run in the stats['_trades'] layout, with bar numbers counted from the start of the run.
+    """
+    from backtesting._stats import geometric_mean
+
+    pl        = trades_df['PnL']
+    returns   = trades_df['ReturnPct']
+    durations = trades_df['Duration']
+    period    = pd.Series(self.last_times).diff().dropna().median()
+
+    s = {}
+    s['Start']    = self.start
+    s['End']      = self.end
+    s['Duration'] = s['End'] - s['Start']
+
+    # Bars covered by a closed trade, overlapping trades counted once
+    exposed_bars, covered_until = 0, -1
+    for entry_bar, exit_bar in sorted(zip(trades_df['EntryBar'], trades_df['ExitBar'])):
+      exposed_bars  += max(0, exit_bar - max(entry_bar, covered_until + 1) + 1)
+      covered_until  = max(covered_until, exit_bar)
+    s['Exposure Time [%]']  = exposed_bars / self.n_bars * 100
+    s['Equity Final [$]']   = self.last_equity
+    s['Equity Peak [$]']    = self.peak
+    commissions             = trades_df['Commission'].sum()
+    if commissions:
+      s['Commissions [$]']  = commissions
+    s['Return [%]']         = (self.last_equity - self.first_equity) / self.first_equity * 100
+    s['Buy & Hold Return [%]'] = (self.last_close - self.first_close) / self.first_close * 100
+
+    freq_days           = period.days
+    have_weekends       = self.weekend_bars / self.n_bars > 2 / 7 * .6
+    annual_trading_days = 52 if freq_days == 7 else 12 if freq_days == 31 else 1 if freq_days == 365 else (365 if have_weekends else 252)
+    freq                = {7: 'W', 31: 'ME', 365: 'YE'}.get(freq_days, 'D')
+    day_returns         = self.daily_equity.resample(freq).last().dropna().pct_change().dropna()
+    gmean_day_return    = geometric_mean(day_returns)
+
+    annualized_return           = (1 + gmean_day_return)**annual_trading_days - 1
+    s['Return (Ann.) [%]']      = annualized_return * 100
+    s['Volatility (Ann.) [%]']  = np.sqrt((day_returns.var(ddof=1) + (1 + gmean_day_return)**2)**annual_trading_days - (1 + gmean_day_return)**(2 * annual_trading_days)) * 100
+    time_in_years               = (s['Duration'].days + s['Duration'].seconds / 86400) / 365.25
+    s['CAGR [%]']               = ((s['Equity Final [$]'] / self.first_equity)**(1 / time_in_years) - 1) * 100 if time_in_years else np.nan
+    s['Sharpe Ratio']           = s['Return (Ann.) [%]'] / (s['Volatility (Ann.) [%]'] or np.nan)
+    with np.errstate(divide='ignore'):
+      s['Sortino Ratio']        = annualized_return / (np.sqrt(np.mean(day_returns.clip(-np.inf, 0)**2)) * np.sqrt(annual_trading_days))
+    s['Calmar Ratio']           = annualized_return / (self.max_dd or np.nan)
+
+    n, sx, sy, sxx, syy, sxy = self.moments
+    beta = np.nan
+    if n > 1:
+      beta = ((sxy - sx * sy / n) / (n - 1)) / ((syy - sy * sy / n) / (n - 1))
+    s['Alpha [%]']    = s['Return [%]'] - beta * s['Buy & Hold Return [%]']
+    s['Beta']         = beta
+
+    max_dd_duration, avg_dd_duration, avg_dd = self.drawdown_durations(period)
+    s['Max. Drawdown [%]']      = -self.max_dd * 100
+    s['Avg. Drawdown [%]']      = -avg_dd * 100
+    s['Max. Drawdown Duration'] = max_dd_duration
+    s['Avg. Drawdown Duration'] = avg_dd_duration
+    s['# Trades'] = n_trades    = len(trades_df)
+    win_rate                    = np.nan if not n_trades else (pl > 0).mean()
+    s['Win Rate [%]']           = win_rate * 100
+    s['Best Trade [%]']         = returns.max() * 100
+    s['Worst Trade [%]']        = returns.min() * 100
+    s['Avg. Trade [%]']         = geometric_mean(returns) * 100
+    s['Max. Trade Duration']    = _round_timedelta(durations.max(), period)
+    s['Avg. Trade Duration']    = _round_timedelta(durations.mean(), period)
+    s['Profit Factor']          = returns[returns > 0].sum() / (abs(returns[returns < 0].sum()) or np.nan)
+    s['Expectancy [%]']         = returns.mean() * 100
+    s['SQN']                    = np.sqrt(n_trades) * pl.mean() / (pl.std() or np.nan)
+    s['Kelly Criterion']        = win_rate - (1 - win_rate) / (pl[pl > 0].mean() / -pl[pl < 0].mean())
+    s['_strategy']              = 'pos_manager'
+
+    return pd.Series(s, dtype=object)
+
+
+
+class PosManagerSession:
+  """
+  One pos_manager backtest fed with consecutive chunks of prices. Open trades, cash, the pending order
+  and the bar count are carried from one chunk to the next, so the equity and the trades are the ones
+  run_pos_manager gives on the whole series while only one chunk is in memory.
+
+  session = PosManagerSession()
+  for df in chunks:
+    equity_df, trades_df = session.run_chunk(df)
+  stats = session.finish()
+  """
+  def __init__(self, params: PosManagerParams = PosManagerParams()):
+    self.params       = params
+    self.trade_log    = np.empty((_trade_log_size(params.max_trades), TRADE_LOG_COLUMNS))
+    self.open_trades  = np.zeros((params.max_trades + 1, 3))
+    self.state        = np.zeros(STATE_SIZE)
+    self.state[STATE_CASH] = params.cash
+    self.n_bars       = 0
+    self.bar_info     = {}            # Bar -> (time, signal) of the bars before the current chunk that may still be looked up
+    self.trades       = []
+    self.equity_stats = RunningStats()
+
+  def _lookup_bars(self, bars: np.ndarray, index: pd.Index, signal: np.ndarray):
+    times   = [index[bar - self.n_bars] if bar >= self.n_bars else self.bar_info[bar][0] for bar in bars]
+    signals = [signal[bar - self.n_bars] if bar >= self.n_bars else self.bar_info[bar][1] for bar in bars]
+    return times, signals
+
+  def run_chunk(self, df: pd.DataFrame):
+    """
+    Run the next chunk, df has the columns run_pos_manager needs and starts right after the previous chunk.
+
+    Returns:
+    equity_df (DataFrame): The chunk's part of the equity curve ('Equity', 'DrawdownPct', 'DrawdownDuration').
+    trades_df (DataFrame): The trades closed in this chunk, in the layout of stats['_trades'].
+    """
+    close   = np.ascontiguousarray(df['Close'].to_numpy(dtype=np.float64))
+    signal  = np.ascontiguousarray(df['signal'].to_numpy(dtype=np.float64))
+    equity  = np.full(len(close), np.nan)
+    params  = self.params
+
+    logged_trades = []
+    i = 1 if self.n_bars == 0 else 0         # backtesting.py starts on the second bar
+    while i < len(close):
+      i, n_logged = _pos_manager_nb(close, signal, i, self.n_bars, equity, self.trade_log, self.open_trades, self.state,
+                                    float(params.commission), 1 / params.margin,
+                                    float(params.long_size), float(params.short_size), float(params.pyramid_size),
+                                    float(params.take_profit_pct), float(params.stop_loss_pct), float(params.pyramid_trade_pct),
+                                    int(params.pyramid_bars), int(params.max_trades))
+      logged_trades.append(self.trade_log[:n_logged].copy())
+    if self.n_bars == 0 and len(equity):
+      equity[0] = params.cash
+
+    trade_log = np.concatenate(logged_trades) if logged_trades else self.trade_log[:0]
+    entry_times, entry_signals = self._lookup_bars(trade_log[:, 1].astype(int), df.index, signal)
+    exit_times, exit_signals   = self._lookup_bars(trade_log[:, 2].astype(int), df.index, signal)
+    trades_df = _trades_frame(trade_log, entry_times, exit_times, entry_signals, exit_signals)
+    self.trades.append(trades_df)
+
+    equity_df = self.equity_stats.update(pd.DatetimeIndex(df.index), equity, close)
+
+    # Keep the entry bars of the trades still open, and this chunk's last bar that an order placed on it fills at
+    if len(close):
+      open_bars     = {int(bar) for bar in self.open_trades[:int(self.state[STATE_N_OPEN]), TRADE_ENTRY_BAR]}
+      self.bar_info = {bar: info for bar, info in self.bar_info.items() if bar in open_bars}
+      for bar in open_bars:
+        if bar >= self.n_bars:
+          self.bar_info[bar] = (df.index[bar - self.n_bars], signal[bar - self.n_bars])
+      self.n_bars += len(close)
+      self.bar_info[self.n_bars - 1] = (df.index[-1], signal[-1])
+
+    return equity_df, trades_df
+
+  def finish(self) -> pd.Series:
+    """
+    Stats of the whole run, trades still open at the end are left out of the trade stats as Backtest.run() does.
+    """
+    trades_df = pd.concat(self.trades, ignore_index=True) if self.trades else _trades_frame(self.trade_log[:0], [], [], [], [])
+    return self.equity_stats.stats(trades_df)
+
+
+
+@njit(cache=True, parallel=True)
+def _sweep_chunk_nb(close, signal, bar_offset, param_table, states, open_trades, totals):
+  # One chunk for every parameter set, the sets are spread over the cores. param_table columns: cash, commission,
+  # leverage, then SWEEP_PARAMETERS. Each set keeps its account in states/open_trades between chunks.
+  n = len(close)
+  for p in prange(len(param_table)):
+    equity    = np.empty(n)
+    trade_log = np.empty((_trade_log_size(int(param_table[p, 10])), TRADE_LOG_COLUMNS))
+    i         = 0
+    if bar_offset == 0 and n > 0:
+      # backtesting.py starts on the second bar, the first one gets the starting cash
+      equity[0] = param_table[p, 0]
+      i         = 1
+    first_bar = 0
+
+    while first_bar < n:
+      i, n_logged = _pos_manager_nb(close, signal, i, bar_offset, equity, trade_log, open_trades[p], states[p],
+                                    param_table[p, 1], param_table[p, 2], param_table[p, 3], param_table[p, 4], param_table[p, 5],
+                                    param_table[p, 6], param_table[p, 7], param_table[p, 8], int(param_table[p, 9]), int(param_table[p, 10]))
+
+      for k in range(n_logged):
+        size, entry_price, exit_price, commissions = trade_log[k, 0], trade_log[k, 3], trade_log[k, 4], trade_log[k, 5]
+        pl          = size * (exit_price - entry_price) - commissions
+        trade_return = np.sign(size) * (exit_price / entry_price - 1) - commissions / (abs(size) * entry_price)
+        totals[p, SWEEP_N_TRADES]       += 1
+        totals[p, SWEEP_N_WINS]         += 1 if pl > 0 else 0
+        totals[p, SWEEP_BEST_RETURN]     = max(totals[p, SWEEP_BEST_RETURN], trade_return)
+        totals[p, SWEEP_WORST_RETURN]    = min(totals[p, SWEEP_WORST_RETURN], trade_return)
+        totals[p, SWEEP_SUM_RETURN]     += trade_return
+        totals[p, SWEEP_SUM_LOG_RETURN] += np.log(1 + trade_return) if trade_return > -1 else np.nan
+        totals[p, SWEEP_GROSS_PROFIT]   += max(trade_return, 0.0)
+        totals[p, SWEEP_GROSS_LOSS]     += min(trade_return, 0.0)
+        totals[p, SWEEP_SUM_PL]         += pl
+        totals[p, SWEEP_SUM_PL_SQUARED] += pl * pl
+        totals[p, SWEEP_COMMISSIONS]    += commissions
+
+      for j in range(first_bar, i):
+        totals[p, SWEEP_EQUITY_PEAK]  = max(totals[p, SWEEP_EQUITY_PEAK], equity[j])
+        totals[p, SWEEP_MAX_DRAWDOWN] = max(totals[p, SWEEP_MAX_DRAWDOWN], 1 - equity[j] / totals[p, SWEEP_EQUITY_PEAK])
+      if i > first_bar:
+        totals[p, SWEEP_LAST_EQUITY] = equity[i - 1]
+      first_bar = i
+
+
+
+def _sweep_table(params: PosManagerParams) -> list:
+  return [params.cash, params.commission, 1 / params.margin] + [getattr(params, name) for name in SWEEP_PARAMETERS]
+
+
+
+def sweep_pos_manager(chunks, param_grid: List[PosManagerParams], sort_by: str = 'Return [%]') -> pd.DataFrame:
+  """
+  Run every parameter set of param_grid over the same prices in a single pass, as one continuous backtest per set.
+
+  chunks is an iterable of consecutive DataFrames with 'Close' and 'signal' columns, e.g. the merged chunks of
+  backtest_script, so the price data is read once for the whole grid. The trades and the equity curve of each
+  set are folded into totals as they happen, nothing per bar is kept.
+
+  Returns:
+  ranking_df (DataFrame): One row per parameter set with its parameters and the stats of a _stat.csv that can
+                          be computed from the totals, ranked by sort_by (best first, rank 1).
+  """
+  param_table = np.array([_sweep_table(params) for params in param_grid], dtype=np.float64)
+  states      = np.zeros((len(param_grid), STATE_SIZE))
+  states[:, STATE_CASH] = param_table[:, 0]
+  open_trades = np.zeros((len(param_grid), max(params.max_trades for params in param_grid) + 1, 3))
+  totals      = np.zeros((len(param_grid), SWEEP_SIZE))
+  totals[:, SWEEP_EQUITY_PEAK]  = -np.inf
+  totals[:, SWEEP_BEST_RETURN]  = -np.inf
+  totals[:, SWEEP_WORST_RETURN] = np.inf
+
+  bar_offset, start, end, first_close, last_close = 0, None, None, np.nan, np.nan
+  for df in chunks:
+    if len(df) == 0:
+      continue
+    close   = np.ascontiguousarray(df['Close'].to_numpy(dtype=np.float64))
+    signal  = np.ascontiguousarray(df['signal'].to_numpy(dtype=np.float64))
+    _sweep_chunk_nb(close, signal, bar_offset, param_table, states, open_trades, totals)
+
+    if bar_offset == 0:
+      start, first_close = df.index[0], close[0]
+    end, last_close = df.index[-1], close[-1]
+    bar_offset += len(close)
+
+  ranking_df  = pd.DataFrame([{name: getattr(params, name) for name in SWEEP_PARAMETERS} for params in param_grid])
+  n_trades    = totals[:, SWEEP_N_TRADES]
+  cash        = param_table[:, 0]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    pl_mean = totals[:, SWEEP_SUM_PL] / n_trades
+    pl_std  = np.sqrt((totals[:, SWEEP_SUM_PL_SQUARED] - n_trades * pl_mean**2) / (n_trades - 1))
+    ranking_df['Start']                 = start
+    ranking_df['End']                   = end
+    ranking_df['Equity Final [$]']      = totals[:, SWEEP_LAST_EQUITY]
+    ranking_df['Equity Peak [$]']       = totals[:, SWEEP_EQUITY_PEAK]
+    ranking_df['Commissions [$]']       = totals[:, SWEEP_COMMISSIONS]
+    ranking_df['Return [%]']            = (totals[:, SWEEP_LAST_EQUITY] - cash) / cash * 100
+    ranking_df['Buy & Hold Return [%]'] = (last_close - first_close) / first_close * 100
+    ranking_df['Max. Drawdown [%]']     = -totals[:, SWEEP_MAX_DRAWDOWN] * 100
+    ranking_df['# Trades']              = n_trades.astype(np.int64)
+    ranking_df['Win Rate [%]']          = np.where(n_trades > 0, totals[:, SWEEP_N_WINS] / n_trades * 100, np.nan)
+    ranking_df['Best Trade [%]']        = np.where(n_trades > 0, totals[:, SWEEP_BEST_RETURN] * 100, np.nan)
+    ranking_df['Worst Trade [%]']       = np.where(n_trades > 0, totals[:, SWEEP_WORST_RETURN] * 100, np.nan)
+    ranking_df['Avg. Trade [%]']        = np.where(n_trades > 0, np.nan_to_num(np.exp(totals[:, SWEEP_SUM_LOG_RETURN] / n_trades) - 1, nan=0.0) * 100, np.nan)
+    ranking_df['Profit Factor']         = totals[:, SWEEP_GROSS_PROFIT] / np.where(totals[:, SWEEP_GROSS_LOSS] != 0, -totals[:, SWEEP_GROSS_LOSS], np.nan)
+    ranking_df['Expectancy [%]']        = totals[:, SWEEP_SUM_RETURN] / n_trades * 100
+    ranking_df['SQN']                   = np.sqrt(n_trades) * pl_mean / np.where(pl_std != 0, pl_std, np.nan)
+
+  ranking_df = ranking_df.sort_values(sort_by, ascending=False, kind='stable', na_position='last').reset_index(drop=True)
+  ranking_df.index = pd.RangeIndex(1, len(ranking_df) + 1, name='Rank')
+
+  return ranking_df
+
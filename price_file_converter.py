@@ -2,18 +2,57 @@ from enum import Enum
 import os
 import argparse
 import time
+import glob
+import json
+import hashlib
 from typing import List
+import numpy as np
 import pandas as pd
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 DATA_DIR              = "data"
 
+OUTPUT_FORMAT_CSV     = "csv"
+OUTPUT_FORMAT_PARQUET = "parquet"
+OUTPUT_FORMAT_FEATHER = "feather"
+OUTPUT_FORMATS        = [OUTPUT_FORMAT_PARQUET, OUTPUT_FORMAT_FEATHER, OUTPUT_FORMAT_CSV]
+DEFAULT_OUTPUT_FORMAT = OUTPUT_FORMAT_PARQUET
+
+INDEX_COLUMN          = "Open time"
+PARTITION_NAME_FORMAT = "%Y-%m"         # One file per month, e.g. data/BTCUSDT-1s-2019-202304/2021-03.parquet
+ROW_GROUP_SIZE        = 500_000         # Parquet row groups are the unit the date filters can skip inside a month
+DEFAULT_WORKERS       = os.cpu_count()  # Processes parsing the monthly CSV files
+MANIFEST_FILE_NAME    = "manifest.json" # Source files already converted into a partitioned dataset, with their hash and row count
+HASH_BLOCK_SIZE       = 1 << 24
+
+PRICE_COLUMN_DTYPES   = { 'Open'                  : 'float64'
+                        , 'High'                  : 'float64'
+                        , 'Low'                   : 'float64'
+                        , 'Close'                 : 'float64'
+                        , 'Volume'                : 'float64'
+                        , 'Quote volume'          : 'float64'
+                        , 'Trade count'           : 'int64'
+                        , 'Taker base volume'     : 'float64'
+                        , 'Taker quote volume'    : 'float64'}
+
 class PriceFileFormatType(Enum):
   FORMAT_TYPE_1 = 1
   FORMAT_TYPE_2 = 2
 
 
 FORMAT_TYPE_1_COLUMNS = ["open_time", "open", "high", "low", "close", "volume", "close_time", "quote_volume", "count", "taker_buy_volume", "taker_buy_quote_volume", "ignore"]
+FORMAT_TYPE_1_USED_COLUMNS = [column for column in FORMAT_TYPE_1_COLUMNS if column not in ("close_time", "ignore")]
+FORMAT_TYPE_1_DTYPES  = { 'open_time'             : 'int64'       # Epoch ms, converted to the UTC index after parsing
+                        , 'open'                  : 'float64'
+                        , 'high'                  : 'float64'
+                        , 'low'                   : 'float64'
+                        , 'close'                 : 'float64'
+                        , 'volume'                : 'float64'
+                        , 'quote_volume'          : 'float64'
+                        , 'count'                 : 'int64'
+                        , 'taker_buy_volume'      : 'float64'
+                        , 'taker_buy_quote_volume': 'float64'}
 
 
 
@@ -36,7 +75,7 @@ def _convert_chunk_df_to_correct_format(chunk_df: pd.DataFrame, format: PriceFil
                                         , 'taker_buy_quote_volume': 'Taker quote volume'})
     
     chunk_df.index = pd.to_datetime(chunk_df['Open time'], unit='ms', utc=True)
-    chunk_df = chunk_df.drop(columns=['ignore', 'close_time', 'Open time'])    
+    chunk_df = chunk_df.drop(columns=['ignore', 'close_time', 'Open time'], errors='ignore')
   else:
     chunk_df = chunk_df.rename(columns={  'Number of trades'      : 'Trade count'
                                        })
@@ -47,60 +86,273 @@ def _convert_chunk_df_to_correct_format(chunk_df: pd.DataFrame, format: PriceFil
 
 
 
-def _read_csv_format1_no_header(file_path: str) -> pd.DataFrame:
-  return pd.read_csv(file_path, header=None, names=FORMAT_TYPE_1_COLUMNS)
+def _read_csv_format1(file_path: str, has_header: bool) -> pd.DataFrame:
+  # Fixed schema: no type inference, and the unused columns are never parsed
+  return pd.read_csv(  file_path
+                     , header   = 0 if has_header else None
+                     , names    = FORMAT_TYPE_1_COLUMNS
+                     , usecols  = FORMAT_TYPE_1_USED_COLUMNS
+                     , dtype    = FORMAT_TYPE_1_DTYPES)
 
 
 
-def _read_monthly_csv_format1(file_names: str) -> pd.DataFrame:
-  combined_df = None
+def _read_and_convert_file(file_name: str, format: PriceFileFormatType, has_header: bool) -> pd.DataFrame:
+  # Runs in a worker process: parse one file and convert it, epoch ms -> UTC index included
+  if format == PriceFileFormatType.FORMAT_TYPE_1:
+    df = _read_csv_format1(_get_absolute_path_to_data_file(file_name), has_header)
+  else:
+    df = pd.read_csv(_get_absolute_path_to_data_file(file_name))
 
-  for file_name in file_names:
-    df = _read_csv_format1_no_header(_get_absolute_path_to_data_file(file_name))
+  return _convert_chunk_df_to_correct_format(df, format)
 
-    if df is not None:
-      if combined_df is None:
-        combined_df = df
-      else:
-        combined_df = pd.concat([combined_df, df])
 
-  return combined_df
 
+def _read_files_in_parallel(file_tasks: List[tuple], workers: int) -> List[pd.DataFrame]:
+  if workers <= 1 or len(file_tasks) <= 1:
+    return [_read_and_convert_file(*file_task) for file_task in file_tasks]
+
+  with ProcessPoolExecutor(max_workers=min(workers, len(file_tasks))) as executor:
+    futures = [executor.submit(_read_and_convert_file, *file_task) for file_task in file_tasks]
+    return [future.result() for future in futures]
+
+
+
+def _build_file_tasks(files_for_2021: List[str], file2: str, file3: str = None) -> List[tuple]:
+  file_tasks  = [(file_name, PriceFileFormatType.FORMAT_TYPE_1, False) for file_name in files_for_2021]
+  file_tasks += [(file2, PriceFileFormatType.FORMAT_TYPE_1, True)]
+  if file3 is not None:
+    file_tasks += [(file3, PriceFileFormatType.FORMAT_TYPE_2, True)]
+
+  return file_tasks
 
 
-def _convert_format1_files(files_for_2021: List[str], file2: str) -> pd.DataFrame:
-  monthly_df  = _read_monthly_csv_format1(files_for_2021)  
-  part2_df    = pd.read_csv(_get_absolute_path_to_data_file(file2))
 
-  combined_df = pd.concat([monthly_df, part2_df])
-  combined_df = _convert_chunk_df_to_correct_format(combined_df, PriceFileFormatType.FORMAT_TYPE_1)
+def _combine_into_one_df(file_tasks: List[tuple], workers: int = DEFAULT_WORKERS) -> pd.DataFrame:
+  start_time  = time.time()
+  dfs         = _read_files_in_parallel(file_tasks, workers)
+  combined_df = pd.concat(dfs)
+  print(f'      Read {len(file_tasks)} files ({len(combined_df):,} rows) in {time.time() - start_time:.1f} seconds.')
 
   return combined_df
 
 
 
-def _convert_format2_file(file: str) -> pd.DataFrame:
-  df = pd.read_csv(_get_absolute_path_to_data_file(file))
-  df = _convert_chunk_df_to_correct_format(df, PriceFileFormatType.FORMAT_TYPE_2)
+def _apply_price_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+  # The format 1 index is parsed as UTC and the format 2 one is not, put both on UTC so the partitions share one index type
+  df.index      = pd.to_datetime(df.index, utc=True)
+  df.index.name = INDEX_COLUMN
 
-  return df
+  return df.astype({column: dtype for column, dtype in PRICE_COLUMN_DTYPES.items() if column in df.columns})
 
 
 
-def _combine_into_one_df(files_for_2021: List[str], file2: str, file3: str = None) -> pd.DataFrame:
-  part1_df = _convert_format1_files(files_for_2021, file2)
+def _read_partition_file(partition_file: str) -> pd.DataFrame:
+  if partition_file.endswith('.parquet'):
+    return pd.read_parquet(partition_file)
 
-  if file3 is not None:
-    part2_df = _convert_format2_file(file3)
-    combined_df = pd.concat([part1_df, part2_df])
+  return pd.read_feather(partition_file).set_index(INDEX_COLUMN)
+
+
+
+def _write_month_partitions(df: pd.DataFrame, dataset_dir: str, output_format: str, append: bool = False):
+  # In append mode the new rows of a month that already has a partition are merged into it, the other months are written as is
+  os.makedirs(dataset_dir, exist_ok=True)
+
+  df = _apply_price_dtypes(df).sort_index(kind='stable')
+
+  # The index is sorted, so every month is one slice. Months are found on year*100+month and only one name per month is formatted
+  month_keys   = (df.index.year * 100 + df.index.month).to_numpy()
+  month_starts = np.flatnonzero(np.diff(month_keys, prepend=-1))
+  month_ends   = np.append(month_starts[1:], len(df))
+  for month_start, month_end in zip(month_starts, month_ends):
+    month_df = df.iloc[month_start:month_end]
+    month    = month_df.index[0].strftime(PARTITION_NAME_FORMAT)
+    partition_file = os.path.join(dataset_dir, f'{month}.{output_format}')
+    if append and os.path.exists(partition_file):
+      month_df = pd.concat([_read_partition_file(partition_file), month_df]).sort_index(kind='stable')
+
+    tmp_file = partition_file + '.tmp'
+    if output_format == OUTPUT_FORMAT_PARQUET:
+      month_df.to_parquet(tmp_file, row_group_size=ROW_GROUP_SIZE)
+    else:
+      month_df.reset_index().to_feather(tmp_file)
+    os.replace(tmp_file, partition_file)
+    print(f'      Wrote {len(month_df):,} rows to "{partition_file}"')
+
+
+
+def _file_sha1(file_path: str) -> str:
+  sha = hashlib.sha1()
+  with open(file_path, 'rb') as f:
+    for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+      sha.update(block)
+
+  return sha.hexdigest()
+
+
+
+def _read_manifest(dataset_dir: str) -> dict:
+  manifest_file = os.path.join(dataset_dir, MANIFEST_FILE_NAME)
+  if not os.path.exists(manifest_file):
+    return {'output_format': None, 'sources': {}}
+
+  with open(manifest_file) as f:
+    return json.load(f)
+
+
+
+def _write_manifest(dataset_dir: str, manifest: dict):
+  manifest_file = os.path.join(dataset_dir, MANIFEST_FILE_NAME)
+  with open(manifest_file + '.tmp', 'w') as f:
+    json.dump(manifest, f, indent=2)
+  os.replace(manifest_file + '.tmp', manifest_file)
+
+
+
+def _hash_source_file(file_name: str, manifest_entry: dict) -> str:
+  # Hashing a multi GB file still costs seconds, skip it when the size and modification time are unchanged
+  file_path = _get_absolute_path_to_data_file(file_name)
+  stat      = os.stat(file_path)
+  if manifest_entry is not None and manifest_entry.get('size') == stat.st_size and manifest_entry.get('mtime') == stat.st_mtime:
+    return manifest_entry['sha1']
+
+  return _file_sha1(file_path)
+
+
+
+def _refresh_file_stats(manifest: dict) -> dict:
+  # Only called once the hashes matched, so a touched but unchanged file is not hashed again on the next run
+  for file_name, entry in manifest['sources'].items():
+    stat           = os.stat(_get_absolute_path_to_data_file(file_name))
+    entry['size']  = stat.st_size
+    entry['mtime'] = stat.st_mtime
+
+  return manifest
+
+
+
+def _clear_dataset_dir(dataset_dir: str):
+  for file_path in glob.glob(os.path.join(dataset_dir, '*.parquet')) + glob.glob(os.path.join(dataset_dir, '*.feather')):
+    os.remove(file_path)
+
+
+
+def _update_month_partitions(file_tasks: List[tuple], dataset_name: str, output_format: str, workers: int, rebuild: bool = False):
+  dataset_dir = _get_absolute_path_to_data_file(dataset_name)
+  manifest    = {'output_format': output_format, 'sources': {}} if rebuild else _read_manifest(dataset_dir)
+  sources     = manifest['sources']
+  hashes      = {file_task[0]: _hash_source_file(file_task[0], sources.get(file_task[0])) for file_task in file_tasks}
+
+  # Appending is only valid while every converted source is unchanged, a rewritten or removed source means the months it fed are stale
+  changed_sources = [file_name for file_name, entry in sources.items() if hashes.get(file_name) != entry['sha1']]
+  if rebuild or changed_sources or manifest['output_format'] not in (None, output_format):
+    if changed_sources:
+      print(f'      Source files changed since the last conversion {changed_sources}, rebuilding "{dataset_dir}"...')
+    _clear_dataset_dir(dataset_dir)
+    manifest = {'output_format': output_format, 'sources': {}}
+    sources  = manifest['sources']
+
+  new_file_tasks = [file_task for file_task in file_tasks if file_task[0] not in sources]
+  if not new_file_tasks:
+    print(f'      "{dataset_dir}" is up to date.')
+    _write_manifest(dataset_dir, _refresh_file_stats(manifest))
+    return
+
+  start_time  = time.time()
+  dfs         = _read_files_in_parallel(new_file_tasks, workers)
+  print(f'      Read {len(new_file_tasks)} new files ({sum(len(df) for df in dfs):,} rows) in {time.time() - start_time:.1f} seconds.')
+  _write_month_partitions(pd.concat(dfs), dataset_dir, output_format, append=bool(sources))
+
+  for (file_name, _, _), df in zip(new_file_tasks, dfs):
+    sources[file_name] = {  'sha1'  : hashes[file_name]
+                          , 'rows'  : len(df)
+                          , 'first' : str(df.index.min())
+                          , 'last'  : str(df.index.max())}
+  manifest['output_format'] = output_format
+  _write_manifest(dataset_dir, _refresh_file_stats(manifest))
+
+
+
+def _convert_files(file_tasks: List[tuple], dataset_name: str, output_format: str, workers: int, rebuild: bool):
+  if output_format == OUTPUT_FORMAT_CSV:
+    df = _combine_into_one_df(file_tasks, workers)
+    df.to_csv(_get_absolute_path_to_data_file(dataset_name + ".csv"))
   else:
-    combined_df = part1_df
+    _update_month_partitions(file_tasks, dataset_name, output_format, workers, rebuild)
+
+
+
+def _to_utc_timestamp(value) -> pd.Timestamp:
+  ts = pd.Timestamp(value)
+  return ts.tz_localize('UTC') if ts.tz is None else ts.tz_convert('UTC')
+
+
+
+def _slice_time_range(df: pd.DataFrame, start, end) -> pd.DataFrame:
+  # Plain label slicing, so '2021-01-25' or '2021-01-25 12:00' as end includes that whole day / minute like df[start:end]
+  return df.loc[start:end]
+
 
-  return combined_df
 
+def _extract_partition_month(partition_file: str) -> str:
+  return os.path.splitext(os.path.basename(partition_file))[0]
 
 
-def _convert_btc_files():
+
+def _partitions_in_range(dataset_dir: str, start, end) -> List[str]:
+  # The partition file names are their month, so whole months outside [start, end] are never opened
+  start_month = None if start is None else _to_utc_timestamp(start).strftime(PARTITION_NAME_FORMAT)
+  end_month   = None if end is None else _to_utc_timestamp(end).strftime(PARTITION_NAME_FORMAT)
+
+  partition_files = []
+  for partition_file in sorted(glob.glob(os.path.join(dataset_dir, '*.parquet')) + glob.glob(os.path.join(dataset_dir, '*.feather'))):
+    month = _extract_partition_month(partition_file)
+    if (start_month is None or month >= start_month) and (end_month is None or month <= end_month):
+      partition_files.append(partition_file)
+
+  return partition_files
+
+
+
+def _read_partition(partition_file: str, start, end, columns: List[str]) -> pd.DataFrame:
+  if partition_file.endswith('.parquet'):
+    filters = []
+    if start is not None:
+      filters.append((INDEX_COLUMN, '>=', _to_utc_timestamp(start)))
+    if end is not None:
+      filters.append((INDEX_COLUMN, '<', _to_utc_timestamp(end) + pd.Timedelta(days=1)))
+    df = pd.read_parquet(partition_file, columns=columns, filters=filters or None)
+    return _slice_time_range(df, start, end)
+
+  # Feather has no predicate pushdown, only the month pruning applies
+  df = pd.read_feather(partition_file, columns=None if columns is None else [INDEX_COLUMN] + columns)
+  return _slice_time_range(df.set_index(INDEX_COLUMN), start, end)
+
+
+
+def read_price_data(dataset_path: str, start=None, end=None, columns: List[str] = None) -> pd.DataFrame:
+  """
+  Read the rows of a converted price file between start and end, sliced like df[start:end], indexed by 'Open time'.
+
+  dataset_path is either a month-partitioned directory written by this script or a single CSV file.
+  For the partitioned layout the date range is pushed down: months outside the range are skipped by
+  file name and the remaining Parquet files only read the row groups that overlap the range (padded by
+  a day on the end side, the exact label slice is applied after reading).
+  """
+  if not os.path.isdir(dataset_path):
+    df = pd.read_csv(dataset_path, usecols=None if columns is None else [INDEX_COLUMN] + columns)
+    df = _apply_price_dtypes(df.set_index(INDEX_COLUMN))
+    return _slice_time_range(df, start, end)
+
+  partition_dfs = [_read_partition(partition_file, start, end, columns) for partition_file in _partitions_in_range(dataset_path, start, end)]
+  if not partition_dfs:
+    return pd.DataFrame(columns=columns if columns is not None else list(PRICE_COLUMN_DTYPES), index=pd.DatetimeIndex([], tz='UTC', name=INDEX_COLUMN))
+
+  return pd.concat(partition_dfs)
+
+
+
+def _convert_btc_files(output_format: str, workers: int, rebuild: bool):
   files_for_2021 = [
     "BTCUSDT-1s-2019-01.csv"
   , "BTCUSDT-1s-2019-02.csv"
@@ -114,12 +366,11 @@ def _convert_btc_files():
   file2 = "secbtcusdtm_20192020.csv"
   file3 = "btcsec2021-23.csv"
 
-  df = _combine_into_one_df(files_for_2021, file2, file3)
-  df.to_csv(_get_absolute_path_to_data_file("BTCUSDT-1s-2019-202304.csv"))
+  _convert_files(_build_file_tasks(files_for_2021, file2, file3), "BTCUSDT-1s-2019-202304", output_format, workers, rebuild)
 
 
 
-def _convert_eth_files():
+def _convert_eth_files(output_format: str, workers: int, rebuild: bool):
   files_for_2021 = [
     "ETHUSDT-1s-2019-01.csv"
   , "ETHUSDT-1s-2019-02.csv"
@@ -132,17 +383,24 @@ def _convert_eth_files():
   ]
   file2 = "ETHUSDT-1s-201909-202308.csv"  
 
-  df = _combine_into_one_df(files_for_2021, file2, None)
-  df.to_csv(_get_absolute_path_to_data_file("ETHUSDT-1s-2019-202308.csv"))
+  _convert_files(_build_file_tasks(files_for_2021, file2, None), "ETHUSDT-1s-2019-202308", output_format, workers, rebuild)
 
 
 
-def _perform_file_conversion():
-  _convert_eth_files()  
+def _perform_file_conversion(output_format: str, workers: int, rebuild: bool):
+  _convert_eth_files(output_format, workers, rebuild)  
 
   
   
   
   
 if __name__ == '__main__':
-  _perform_file_conversion()
\ No newline at end of file
+  parser = argparse.ArgumentParser(description="Convert the downloaded price files into one dataset.")
+  parser.add_argument("--output_format"   , default=DEFAULT_OUTPUT_FORMAT, choices=OUTPUT_FORMATS, help=f"parquet/feather write one file per month into a directory, csv writes a single file (default: {DEFAULT_OUTPUT_FORMAT})")
+  parser.add_argument("--workers"         , default=DEFAULT_WORKERS, help=f"Processes used to parse the monthly files (default: {DEFAULT_WORKERS}, use 1 to parse them in this process)")
+
+  parser.add_argument("--rebuild"         , action="store_true", help="Convert every source file again instead of only the ones missing from the manifest")
+
+  args = parser.parse_args()
+
+  _perform_file_conversion(args.output_format, int(args.workers), args.rebuild)
\ No newline at end of file
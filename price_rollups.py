@@ -0,0 +1,128 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+from bar_funcs import BAR_SUM_COLUMNS
+from price_store import PriceStore, TIME_COLUMN, is_price_store, truncate_price_store, write_price_store
+
+
+# Each timeframe is built from the one before it, so only the 1m level reads the 1s rows
+ROLLUP_PERIODS = {'1m': 60, '5m': 5 * 60, '15m': 15 * 60, '1h': 60 * 60, '4h': 4 * 60 * 60, '1d': 24 * 60 * 60}
+ROLLUP_TIMEFRAMES = list(ROLLUP_PERIODS)
+
+ROLLUP_DIR = "rollups"
+ROLLUP_CHUNK_ROWS = 10_000_000    # Source rows aggregated at a time, bounds the temporaries on the 1s level
+
+
+def rollup_store_dir(store_dir, timeframe):
+    return os.path.join(store_dir, ROLLUP_DIR, timeframe)
+
+
+def _rollup_chunk(times, arrays, period_ns, is_last_chunk):
+    """
+    Aggregate sorted rows into bars of period_ns, aligned on the epoch (so 1d bars start at 00:00 UTC).
+
+    Unless is_last_chunk, the last period is left out because it may continue in the next chunk.
+
+    Returns:
+    bars_df (DataFrame): One row per period that has rows, empty periods are skipped.
+    rows_used (int): Number of source rows aggregated into bars_df.
+    """
+    bins = times // period_ns
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    rows_used = len(times) if is_last_chunk else int(starts[-1])
+    starts = starts[starts < rows_used]
+    if len(starts) == 0:
+        return None, 0
+    ends = np.r_[starts[1:], rows_used] - 1
+
+    bars = {'Open': arrays['Open'][starts],
+            'High': np.maximum.reduceat(arrays['High'][:rows_used], starts),
+            'Low': np.minimum.reduceat(arrays['Low'][:rows_used], starts),
+            'Close': arrays['Close'][ends]}
+    for column in BAR_SUM_COLUMNS:
+        bars[column] = np.add.reduceat(arrays[column][:rows_used], starts)
+
+    index = pd.DatetimeIndex((bins[starts] * period_ns).view('datetime64[ns]'), name=TIME_COLUMN).tz_localize('UTC')
+    return pd.DataFrame(bars, index=index), rows_used
+
+
+def _iter_rollup_chunks(source, period_ns, start_row):
+    row = start_row
+    while row < len(source):
+        end_row = min(row + ROLLUP_CHUNK_ROWS, len(source))
+        arrays = {column: source.arrays[column][row:end_row] for column in source.columns}
+        bars_df, rows_used = _rollup_chunk(source.times[row:end_row], arrays, period_ns, end_row == len(source))
+        if rows_used == 0:
+            # A single period longer than the chunk, only possible with a tiny ROLLUP_CHUNK_ROWS
+            raise ValueError(f'ROLLUP_CHUNK_ROWS ({ROLLUP_CHUNK_ROWS}) is smaller than one {period_ns // 10**9}s period of the source')
+        yield bars_df
+        row += rows_used
+
+
+def _update_rollup(source_dir, rollup_dir, period_ns):
+    source = PriceStore(source_dir)
+
+    # The last stored bar may have been built from an unfinished period, drop it and rebuild from its first source row
+    start_row = 0
+    if is_price_store(rollup_dir) and len(PriceStore(rollup_dir)) > 0:
+        rollup = PriceStore(rollup_dir)
+        start_row = int(np.searchsorted(source.times, rollup.times[-1], side='left'))
+        truncate_price_store(rollup_dir, len(rollup) - 1)
+
+    float_dtype = source.arrays['Close'].dtype.name
+    return write_price_store(_iter_rollup_chunks(source, period_ns, start_row), rollup_dir, float_dtype, append=True)
+
+
+def update_rollups(store_dir, timeframes=ROLLUP_TIMEFRAMES):
+    """
+    Build or extend the rollup pyramid of a 1s price store (price_store.py).
+
+    Each timeframe is a price store of its own under <store_dir>/rollups/<timeframe>, built from the
+    next finer timeframe. Only the periods from the last stored bar onwards are recomputed, so a run
+    after appending a month to the 1s store only aggregates that month.
+
+    Returns:
+    rows (dict): Timeframe -> number of bars.
+    """
+    rows = {}
+    source_dir = store_dir
+    for timeframe in sorted(timeframes, key=ROLLUP_PERIODS.get):
+        start_time = pd.Timestamp.now()
+        rollup_dir = rollup_store_dir(store_dir, timeframe)
+        rows[timeframe] = _update_rollup(source_dir, rollup_dir, ROLLUP_PERIODS[timeframe] * 10**9)
+        print(f'      {timeframe}: {rows[timeframe]:,} bars ({(pd.Timestamp.now() - start_time).total_seconds():.2f} seconds)')
+        source_dir = rollup_dir
+
+    return rows
+
+
+def load_rollup(store_dir, timeframe, start=None, end=None, columns=None):
+    """
+    Bars of one timeframe with start <= Open time < end. Only the requested bars are read, the cost
+    does not depend on how much 1s data the store holds.
+    """
+    if timeframe not in ROLLUP_PERIODS:
+        raise ValueError(f'Unknown timeframe {timeframe}, expected one of {ROLLUP_TIMEFRAMES}')
+
+    return PriceStore(rollup_store_dir(store_dir, timeframe)).to_frame(start, end, columns)
+
+
+def load_rollup_data(store_dir, timeframe, start=None, end=None):
+    """
+    load_rollup wrapped as a vbt.BinanceData object, ready for prepare_data and the strategy notebooks.
+    """
+    import vectorbtpro as vbt
+
+    return vbt.BinanceData.from_data(load_rollup(store_dir, timeframe, start, end))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or extend the 1m/5m/15m/1h/4h/1d rollups of a 1s price store.")
+    parser.add_argument("--store", required=True, help="Price store directory in the data dir, built by price_store.py")
+    parser.add_argument("--timeframes", nargs="+", default=ROLLUP_TIMEFRAMES, choices=ROLLUP_TIMEFRAMES, help=f"Timeframes to build (default: {ROLLUP_TIMEFRAMES})")
+
+    args = parser.parse_args()
+
+    update_rollups(os.path.join(os.getcwd(), "data", args.store), args.timeframes)
@@ -0,0 +1,196 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+
+STORE_META_FILE = "meta.json"
+STORE_SUFFIX = ".store"
+TIME_COLUMN = "Open time"
+
+# Columns kept in a store, Trade count stays an integer column and the others use the store's float dtype
+STORE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Quote volume', 'Trade count', 'Taker base volume', 'Taker quote volume']
+INT_COLUMNS = ['Trade count']
+
+DEFAULT_CHUNK_SIZE = 5000000
+
+
+def is_price_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, STORE_META_FILE))
+
+
+def _column_file(store_dir, column):
+    return os.path.join(store_dir, column.replace(' ', '_') + '.bin')
+
+
+def _read_meta(store_dir):
+    with open(os.path.join(store_dir, STORE_META_FILE)) as f:
+        return json.load(f)
+
+
+def _write_meta(store_dir, meta):
+    meta_file = os.path.join(store_dir, STORE_META_FILE)
+    with open(meta_file + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_file + '.tmp', meta_file)
+
+
+def _chunk_times_ns(chunk_df):
+    times = pd.DatetimeIndex(chunk_df.index)
+    times = times.tz_convert('UTC') if times.tz is not None else times.tz_localize('UTC')
+    return times.as_unit('ns').asi8
+
+
+def write_price_store(price_chunks, store_dir, float_dtype='float64', append=False):
+    """
+    Write price chunks into a memory-mappable store: one raw int64 array of UTC nanosecond timestamps
+    and one raw array per column, plus a meta.json with the dtypes and the row count.
+
+    Parameters:
+    price_chunks (iterable): DataFrames indexed by 'Open time' in time order, e.g. bar_funcs.read_price_chunks(...).
+    store_dir (str): Store directory, created if needed.
+    float_dtype (str): 'float64' or 'float32' for the price and volume columns.
+    append (bool): Append after the last stored row instead of replacing the store. Rows at or before
+                   the last stored timestamp are skipped.
+
+    Returns:
+    rows (int): Number of rows in the store.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    if append and is_price_store(store_dir):
+        meta = _read_meta(store_dir)
+    else:
+        meta = {'rows': 0, 'last_time': None,
+                'columns': {column: 'int64' if column in INT_COLUMNS else float_dtype for column in STORE_COLUMNS}}
+    columns = list(meta['columns'])
+
+    # The meta file is written last, a store interrupted mid-write keeps its old row count and the
+    # extra bytes are truncated on the next append
+    files = {TIME_COLUMN: open(_column_file(store_dir, TIME_COLUMN), 'r+b' if meta['rows'] else 'wb')}
+    for column in columns:
+        files[column] = open(_column_file(store_dir, column), 'r+b' if meta['rows'] else 'wb')
+    try:
+        for column, f in files.items():
+            f.truncate(meta['rows'] * np.dtype(meta['columns'].get(column, 'int64')).itemsize)
+            f.seek(0, os.SEEK_END)
+
+        for chunk_df in price_chunks:
+            times = _chunk_times_ns(chunk_df)
+            if meta['last_time'] is not None:
+                new_rows = times > meta['last_time']
+                chunk_df, times = chunk_df[new_rows], times[new_rows]
+            if len(times) == 0:
+                continue
+
+            files[TIME_COLUMN].write(np.ascontiguousarray(times, dtype=np.int64).tobytes())
+            for column in columns:
+                files[column].write(np.ascontiguousarray(chunk_df[column].to_numpy(), dtype=meta['columns'][column]).tobytes())
+            meta['rows'] += len(times)
+            meta['last_time'] = int(times[-1])
+    finally:
+        for f in files.values():
+            f.close()
+
+    _write_meta(store_dir, meta)
+    return meta['rows']
+
+
+def truncate_price_store(store_dir, rows):
+    """
+    Keep only the first rows rows of a store. Only meta.json changes, the column files are cut to
+    size by the next write_price_store(..., append=True).
+    """
+    meta = _read_meta(store_dir)
+    rows = min(rows, meta['rows'])
+    last_time = None
+    if rows > 0:
+        last_time = int(np.memmap(_column_file(store_dir, TIME_COLUMN), dtype='int64', mode='r', shape=(meta['rows'],))[rows - 1])
+
+    meta['rows'] = rows
+    meta['last_time'] = last_time
+    _write_meta(store_dir, meta)
+
+
+class PriceStore:
+    """
+    Read-only view of a store written by write_price_store. Every column is an np.memmap, so opening
+    a store costs nothing and processes that open the same store share one copy through the page cache.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        meta = _read_meta(store_dir)
+        self.rows = meta['rows']
+        self.columns = list(meta['columns'])
+        self.times = self._open(TIME_COLUMN, 'int64')
+        self.arrays = {column: self._open(column, dtype) for column, dtype in meta['columns'].items()}
+
+    def _open(self, column, dtype):
+        if self.rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(_column_file(self.store_dir, column), dtype=dtype, mode='r', shape=(self.rows,))
+
+    def __len__(self):
+        return self.rows
+
+    def slice_indices(self, start=None, end=None):
+        """
+        Row range [i0, i1) of the rows with start <= Open time < end, found by binary search on the timestamps.
+        """
+        i0 = 0 if start is None else int(np.searchsorted(self.times, _to_ns(start), side='left'))
+        i1 = self.rows if end is None else int(np.searchsorted(self.times, _to_ns(end), side='left'))
+        return i0, max(i0, i1)
+
+    def get_arrays(self, start=None, end=None, columns=None):
+        """
+        Zero-copy views of the rows with start <= Open time < end.
+
+        Returns:
+        times (ndarray): int64 UTC nanosecond timestamps.
+        arrays (dict): Column -> memmap view.
+        """
+        i0, i1 = self.slice_indices(start, end)
+        return self.times[i0:i1], {column: self.arrays[column][i0:i1] for column in (columns or self.columns)}
+
+    def _frame(self, i0, i1, columns):
+        index = pd.DatetimeIndex(self.times[i0:i1].view('datetime64[ns]'), name=TIME_COLUMN).tz_localize('UTC')
+        return pd.DataFrame({column: self.arrays[column][i0:i1] for column in (columns or self.columns)}, index=index)
+
+    def to_frame(self, start=None, end=None, columns=None):
+        """
+        The rows with start <= Open time < end as a DataFrame indexed by 'Open time', only that slice is read.
+        """
+        i0, i1 = self.slice_indices(start, end)
+        return self._frame(i0, i1, columns)
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE, start=None, end=None, columns=None):
+        """
+        The rows with start <= Open time < end as DataFrames of chunk_size rows. Over the whole store
+        these are the same chunks pd.read_csv(chunksize=chunk_size) gives on the source CSV file.
+        """
+        i0, i1 = self.slice_indices(start, end)
+        for chunk_start in range(i0, i1, chunk_size):
+            yield self._frame(chunk_start, min(chunk_start + chunk_size, i1), columns)
+
+
+def _to_ns(value):
+    ts = pd.Timestamp(value)
+    ts = ts.tz_localize('UTC') if ts.tz is None else ts.tz_convert('UTC')
+    return ts.as_unit('ns').value
+
+
+if __name__ == '__main__':
+    from bar_funcs import read_price_chunks
+
+    parser = argparse.ArgumentParser(description="Build a memory-mapped price store from a converted price file.")
+    parser.add_argument("--price_file", required=True, help="CSV file or month-partitioned directory written by price_file_converter.py, in the data dir")
+    parser.add_argument("--float_dtype", default="float64", choices=["float64", "float32"], help="dtype of the price and volume columns (default: float64)")
+    parser.add_argument("--append", action="store_true", help="Only append the rows newer than the last stored row")
+
+    args = parser.parse_args()
+
+    price_file = os.path.join(os.getcwd(), "data", args.price_file)
+    store_dir = os.path.splitext(os.path.normpath(price_file))[0] + STORE_SUFFIX
+    rows = write_price_store(read_price_chunks(price_file), store_dir, args.float_dtype, args.append)
+    print(f'Wrote {rows:,} rows to "{store_dir}"')
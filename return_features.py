@@ -0,0 +1,119 @@
+import numpy as np
+
+
+RETURN_HORIZONS = (1, 5, 10, 20, 40, 60, 100, 160, 260, 420)
+YESTERDAY_HORIZON = 160                     # 160 bar lookback as a proxy for yesterday
+RUN_HORIZONS = (160, 1)                     # up_down_run_<h>: rolling sum of the signs of the h bar returns
+TREND_HORIZON = 20                          # momentum_trending compares this return with its value lookback_window bars before
+MOMENTUM_PAIRS = {'mid_range_momentum': (100, 420),
+                  'short_range_momentum': (20, 40),
+                  'short_over_long_momentum': (20, 420)}
+LARGE_MOVE = 0.05
+
+
+def _block_horizons(horizons):
+    return sorted(set(horizons) | {YESTERDAY_HORIZON, TREND_HORIZON, *RUN_HORIZONS, *np.ravel(list(MOMENTUM_PAIRS.values()))})
+
+
+def return_features_history(lookback_window, horizons=RETURN_HORIZONS):
+    """
+    Closes needed for the features of one bar, that bar included.
+    """
+    return max(max(_block_horizons(horizons)), lookback_window + TREND_HORIZON, lookback_window - 1 + max(RUN_HORIZONS)) + 1
+
+
+def return_block(close, horizons, start=0):
+    """
+    close[t] / close[t - h] - 1 for every horizon h and row t from start, as one 2D array of
+    len(horizons) x (len(close) - start), a row per horizon. NaN where t < h, as pct_change gives.
+    """
+    horizons = np.asarray(horizons)
+    # NaN before the first close, so the lags before it give NaN returns. Row j of the lag windows is close shifted by horizons[j]
+    padded = np.concatenate((np.full(horizons.max(), np.nan), close))
+    lagged = np.lib.stride_tricks.sliding_window_view(padded, len(close) - start)[start + horizons.max() - horizons]
+    return close[start:] / lagged - 1
+
+
+def _shift(values, periods):
+    # values.shift(periods) for a 1D array
+    return np.concatenate((np.full(min(periods, len(values)), np.nan), values[:max(len(values) - periods, 0)]))
+
+
+def _rolling_sum(values, window):
+    # Sum of the last window values, NaN until window values are available or when one of them is NaN (pandas rolling(window).sum())
+    is_nan = np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(is_nan, 0.0, values))))
+    nans = np.concatenate(([0], np.cumsum(is_nan)))
+    rolled = np.full(len(values), np.nan)
+    if len(values) < window:
+        return rolled
+    rolled[window - 1:] = np.where(nans[window:] > nans[:len(nans) - window], np.nan, sums[window:] - sums[:len(sums) - window])
+    return rolled
+
+
+def historical_return_features(close, lookback_window, horizons=RETURN_HORIZONS, last_rows=None):
+    """
+    The historical return features of feature_engineering._add_historical_returns as NumPy arrays.
+
+    The returns of every horizon are one return_block, the yesterday flags, up/down runs and momentum
+    comparisons are derived from it. With last_rows only the last rows are computed, the rows before them
+    are only read as history, which is how HistoricalReturnsStream updates the newest bar.
+
+    Parameters:
+    close (ndarray): Close prices, oldest first.
+    lookback_window (int): Window of the up/down runs and of the momentum trend and large move comparisons.
+    horizons (tuple): Horizons of the pct_change_<h> columns.
+    last_rows (int): Number of rows to compute at the end of close (default: all).
+
+    Returns:
+    features (dict): Column name -> array of len(close) rows, or last_rows rows.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    first_row = 0 if last_rows is None else max(len(close) - last_rows, 0)
+    block_start = max(first_row - lookback_window, 0)
+    block_horizons = _block_horizons(horizons)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        block = return_block(close, block_horizons, block_start)
+    returns = dict(zip(block_horizons, block))
+
+    # Output rows inside the block, the rows before them are history for the runs and the momentum trend
+    out = slice(first_row - block_start, None)
+
+    features = {f'pct_change_{horizon}': returns[horizon][out] for horizon in horizons}
+    yesterday = returns[YESTERDAY_HORIZON][out]
+    features['yesterday_up'] = np.where(yesterday > 0, 1, 0)
+    features['yesterday_down'] = np.where(yesterday < 0, 1, 0)
+    for horizon in RUN_HORIZONS:
+        features[f'up_down_run_{horizon}'] = _rolling_sum(np.sign(returns[horizon]), lookback_window)[out]
+
+    for name, (short_horizon, long_horizon) in MOMENTUM_PAIRS.items():
+        features[name] = returns[short_horizon][out] > returns[long_horizon][out]
+    trend = returns[TREND_HORIZON]
+    features['momentum_trending'] = trend[out] > _shift(trend, lookback_window)[out]
+
+    lagged_close = _shift(close, lookback_window)[first_row:]
+    features['large_move_up'] = np.where(close[first_row:] > lagged_close * (1 + LARGE_MOVE), 1, 0)
+    features['large_move_down'] = np.where(close[first_row:] < lagged_close * (1 - LARGE_MOVE), 1, 0)
+
+    return features
+
+
+class HistoricalReturnsStream:
+    """
+    The historical return features of the newest bar, one close at a time, with the same code as the batch build.
+    Only the last return_features_history(...) closes are kept.
+    """
+
+    def __init__(self, lookback_window, horizons=RETURN_HORIZONS, closes=()):
+        self.lookback_window = lookback_window
+        self.horizons = horizons
+        self.history = return_features_history(lookback_window, horizons)
+        self.closes = np.asarray(closes, dtype=np.float64)[-self.history:]
+
+    def update(self, close):
+        """
+        Add the newest close. Returns its features, column name -> value.
+        """
+        self.closes = np.append(self.closes[max(len(self.closes) - self.history + 1, 0):], close)
+        features = historical_return_features(self.closes, self.lookback_window, self.horizons, last_rows=1)
+        return {name: values[0] for name, values in features.items()}
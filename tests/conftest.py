@@ -0,0 +1,69 @@
+import os
+import sys
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The parallel sweep kernel starts numba's thread pool in the test process and a worker forked after that can hang,
+# the process pools of the tests start their workers from a clean server process instead
+multiprocessing.set_start_method('forkserver', force=True)
+
+
+def make_klines(rows, seed=0, start='2024-01-01', freq='min'):
+    """
+    Synthetic 1m Binance klines with the columns price_file_converter.py writes, indexed by Open time.
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, rows)))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    volume = rng.uniform(1, 10, rows)
+    taker_volume = volume * rng.uniform(0, 1, rows)
+    index = pd.date_range(start, periods=rows, freq=freq, name='Open time')
+
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) * (1 + rng.uniform(0, 0.001, rows)),
+        'Low': np.minimum(open_, close) * (1 - rng.uniform(0, 0.001, rows)),
+        'Close': close,
+        'Volume': volume,
+        'Quote volume': volume * close,
+        'Trade count': rng.integers(1, 50, rows),
+        'Taker base volume': taker_volume,
+        'Taker quote volume': taker_volume * close,
+    }, index=index)
+
+
+@pytest.fixture
+def klines():
+    return make_klines(20_000)
+
+
+def make_merged(rows, seed=0, start='2024-01-01', freq='s', signal_rate=0.002):
+    """
+    A price frame with a sparse 'signal' column (1 long, 2 short), like the merged chunks backtest_script runs.
+    """
+    rng = np.random.default_rng(seed + 1)
+    merged_df = make_klines(rows, seed=seed, start=start, freq=freq)
+    merged_df['signal'] = np.where(rng.random(rows) < signal_rate, rng.integers(1, 3, rows), 0).astype(np.float64)
+    merged_df.index.name = 'datetime'
+    return merged_df
+
+
+@pytest.fixture
+def merged():
+    return make_merged(20_000)
+
+
+def write_backtest_files(merged_df, directory):
+    """
+    Write merged_df as the price file and the trade file backtest_script reads. Returns (price_file, trade_file).
+    """
+    price_file = os.path.join(directory, 'prices.csv')
+    trade_file = os.path.join(directory, 'signals.csv')
+    merged_df.drop(columns='signal').rename_axis('Open time').reset_index().to_csv(price_file, index=False)
+    merged_df.loc[merged_df['signal'] != 0, ['signal']].rename_axis('Date/Time').reset_index().to_csv(trade_file, index=False)
+    return price_file, trade_file
@@ -0,0 +1,150 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest_script
+from backtest_script import OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_PARQUET, _ResultWriter
+from conftest import make_merged, write_backtest_files
+from pos_manager_engine import run_pos_manager, stats_differences
+
+
+@pytest.fixture
+def results_dir(tmp_path, monkeypatch):
+    # The result files go to results/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(backtest_script.RESULTS_DIR)
+    return tmp_path / backtest_script.RESULTS_DIR
+
+
+def _read(file_name):
+    return pd.read_parquet(file_name) if file_name.endswith(OUTPUT_FORMAT_PARQUET) else pd.read_csv(file_name, index_col=0)
+
+
+@pytest.mark.parametrize('output_format', [OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_PARQUET])
+def test_result_writer_without_equity_rows(results_dir, output_format):
+    stats = pd.Series({'Return [%]': 0.0})
+    writer = _ResultWriter('empty', output_format)
+    writer.write(pd.DataFrame(columns=['Equity', 'DrawdownPct', 'DrawdownDuration']).iloc[:0], pd.DataFrame())
+
+    index_row = writer.close(stats)
+
+    assert index_row['equity_rows'] == 0
+    assert len(_read(index_row['equity_file'])) == 0
+    assert list(_read(index_row['equity_file']).columns) == ['Equity', 'DrawdownPct', 'DrawdownDuration']
+
+
+@pytest.mark.parametrize('output_format', [OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_PARQUET])
+def test_result_writer_with_no_chunk(results_dir, output_format):
+    writer = _ResultWriter('nothing', output_format, equity_resample='1min')
+
+    index_row = writer.close(pd.Series({'Return [%]': 0.0}))
+
+    assert len(_read(index_row['equity_file'])) == 0
+
+
+@pytest.mark.parametrize('output_format', [OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_PARQUET])
+def test_result_writer_round_trip(results_dir, merged, output_format):
+    stats = run_pos_manager(merged)
+    writer = _ResultWriter('chunks', output_format)
+    for start in range(0, len(merged), 6_000):
+        equity_df = stats['_equity_curve'].iloc[start:start + 6_000]
+        writer.write(equity_df, stats['_trades'].iloc[:0] if start else stats['_trades'])
+
+    index_row = writer.close(stats)
+
+    assert index_row['equity_rows'] == len(merged)
+    equity_df = _read(index_row['equity_file'])
+    assert len(equity_df) == len(merged)
+    assert np.allclose(equity_df['Equity'], stats['_equity_curve']['Equity'], rtol=1e-12, atol=0)
+    assert len(_read(index_row['trades_file'])) == len(stats['_trades'])
+
+
+def test_stage_metrics_without_peak_rss(results_dir, monkeypatch):
+    import json
+    import sys
+
+    # Windows without psutil: no resource module and no psutil
+    monkeypatch.setitem(sys.modules, 'resource', None)
+    monkeypatch.setitem(sys.modules, 'psutil', None)
+    assert np.isnan(backtest_script._peak_rss_mb())
+
+    metrics_file = str(results_dir / 'metrics.jsonl')
+    metrics = backtest_script._StageMetrics(metrics_file, {'engine': 'numba'})
+    with metrics.stage(backtest_script.STAGE_ENGINE, 0, rows=10):
+        pass
+    metrics.summary()
+
+    with open(metrics_file) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['chunk'] for line in lines] == ['0', 'summary']
+    assert all(line['peak_rss_mb'] is None for line in lines)
+
+
+def test_help():
+    # argparse %-formats the help strings, the 'Return [%]' default has to be escaped
+    import subprocess
+    import sys
+
+    result = subprocess.run([sys.executable, backtest_script.__file__, '--help'], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert '(default: Return [%])' in result.stdout
+
+
+def _whole_series_stats(price_file, trade_file):
+    # run_pos_manager on the whole price file merged with the trade file, what a chunked run has to reproduce
+    price_df = backtest_script._convert_chunk_df_to_correct_format(pd.read_csv(price_file))
+    merged_df = backtest_script._merge_price_and_trade(price_df, backtest_script._read_trade_file(trade_file))
+    return run_pos_manager(merged_df, backtest_script._pos_manager_params())
+
+
+def _result_stats(index_row, expected):
+    # The stats of a result as written to its files: the scalars of the index row, the trades and the equity curve
+    stats = pd.Series({key: index_row[key] for key in expected.index if not key.startswith('_')}, dtype=object)
+    stats['_trades'] = _read(index_row['trades_file'])
+    stats['_equity_curve'] = _read(index_row['equity_file'])
+    return stats
+
+
+@pytest.fixture
+def backtest_files(results_dir):
+    return write_backtest_files(make_merged(20_000, signal_rate=0.01), str(results_dir.parent))
+
+
+def _run(mode, price_file, trade_file, **kwargs):
+    metrics = backtest_script._StageMetrics(os.path.join(backtest_script.RESULTS_DIR, 'metrics.jsonl'), {})
+    signal_sets = {trade_file: backtest_script._read_trade_file(trade_file)}
+    return mode(price_file, signal_sets, 3_000, metrics=metrics, output_format=OUTPUT_FORMAT_PARQUET, **kwargs)[trade_file]
+
+
+def test_continuous_run_matches_the_whole_series(backtest_files):
+    price_file, trade_file = backtest_files
+    expected = _whole_series_stats(price_file, trade_file)
+
+    index_row = _run(backtest_script._process_continuous_backtest, price_file, trade_file)
+
+    # The streamed equity curve leaves the duration of a drawdown running at the end to the stats
+    expected_curve = expected['_equity_curve'].copy()
+    expected_curve.iloc[-1, expected_curve.columns.get_loc('DrawdownDuration')] = pd.NaT
+    expected['_equity_curve'] = expected_curve
+
+    assert expected['# Trades'] > 0
+    assert stats_differences(expected, _result_stats(index_row, expected)) == []
+
+
+def test_stitched_run_matches_the_continuous_run(backtest_files):
+    price_file, trade_file = backtest_files
+    expected = _whole_series_stats(price_file, trade_file)
+
+    index_row = _run(backtest_script._process_parallel_backtest, price_file, trade_file, engine=backtest_script.ENGINE_NUMBA, workers=2,
+                     warmup_bars=1_000)
+    actual = _result_stats(index_row, expected)
+
+    # The chunks are rescaled from the starting cash, the trade sizes are rounded to whole units again
+    trade_columns = ['EntryBar', 'ExitBar', 'EntryTime', 'ExitTime']
+    pd.testing.assert_frame_equal(actual['_trades'][trade_columns], expected['_trades'][trade_columns], check_dtype=False)
+    assert np.allclose(actual['_trades']['ReturnPct'], expected['_trades']['ReturnPct'], rtol=1e-9, atol=0)
+    assert np.allclose(actual['_equity_curve']['Equity'], expected['_equity_curve']['Equity'], rtol=1e-6, atol=0)
+    for key in ['Return [%]', 'Max. Drawdown [%]', 'Win Rate [%]', 'Profit Factor', 'SQN']:
+        assert np.isclose(actual[key], expected[key], rtol=1e-5), key
+    assert actual['# Trades'] == expected['# Trades']
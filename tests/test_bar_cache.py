@@ -0,0 +1,72 @@
+import os
+import pandas as pd
+
+from bar_cache import warm_bar_cache, load_bars
+from bar_funcs import BarType, dollar_bar_func
+
+
+def _write_source(klines, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    klines.reset_index().to_parquet(path)
+    return path
+
+
+def test_sizes_with_the_same_simplified_name_keep_their_files(klines, tmp_path):
+    source = _write_source(klines, str(tmp_path / 'BTCUSDT_1m.parquet'))
+    cache_dir = str(tmp_path / 'cache')
+
+    cache_files = warm_bar_cache(source, BarType.DOLLAR, [1_000_000, 1_500_000], cache_dir=cache_dir)
+    assert all(os.path.exists(cache_file) for cache_file in cache_files.values())
+
+    # Alternating loads are both hits
+    for bar_size in [1_000_000, 1_500_000, 1_000_000]:
+        load_bars(source, BarType.DOLLAR, bar_size, cache_dir=cache_dir)
+    assert sorted(os.listdir(cache_dir)) == sorted(os.path.basename(f) for f in cache_files.values())
+
+
+def test_sources_with_the_same_name_in_different_directories(klines, tmp_path):
+    source_a = _write_source(klines.iloc[:10_000], str(tmp_path / 'a' / 'BTCUSDT_1m.parquet'))
+    source_b = _write_source(klines.iloc[10_000:], str(tmp_path / 'b' / 'BTCUSDT_1m.parquet'))
+    cache_dir = str(tmp_path / 'cache')
+
+    file_a = warm_bar_cache(source_a, BarType.DOLLAR, [1_000_000], cache_dir=cache_dir)[1_000_000]
+    file_b = warm_bar_cache(source_b, BarType.DOLLAR, [1_000_000], cache_dir=cache_dir)[1_000_000]
+
+    assert file_a != file_b and os.path.exists(file_a) and os.path.exists(file_b)
+
+
+def test_rebuilt_source_replaces_its_cache_file(klines, tmp_path):
+    source = str(tmp_path / 'BTCUSDT_1m.parquet')
+    cache_dir = str(tmp_path / 'cache')
+    old_file = warm_bar_cache(_write_source(klines.iloc[:10_000], source), BarType.DOLLAR, [1_000_000], cache_dir=cache_dir)[1_000_000]
+    new_file = warm_bar_cache(_write_source(klines, source), BarType.DOLLAR, [1_000_000], cache_dir=cache_dir)[1_000_000]
+
+    assert old_file != new_file and not os.path.exists(old_file)
+    bars_df = load_bars(source, BarType.DOLLAR, 1_000_000, cache_dir=cache_dir)
+    expected_df = dollar_bar_func(klines, 1_000_000)
+    pd.testing.assert_frame_equal(bars_df.reset_index(drop=True), expected_df, check_dtype=False)
+
+
+def test_partial_string_ends_keep_the_whole_period(klines, tmp_path):
+    source = _write_source(klines, str(tmp_path / 'BTCUSDT_1m.parquet'))
+    cache_dir = str(tmp_path / 'cache')
+    bars_df = load_bars(source, BarType.DOLLAR, 20_000, cache_dir=cache_dir)
+    assert bars_df.index[-1] - bars_df.index[0] > pd.Timedelta(days=5)
+
+    for start, end in [(None, '2024'), (None, '2024-01'), ('2024-01-02', '2024-01-05'), (None, '2024-01-05 12'),
+                       (None, bars_df.index[100]), (bars_df.index[10], bars_df.index[-10])]:
+        loaded_df = load_bars(source, BarType.DOLLAR, 20_000, start=start, end=end, cache_dir=cache_dir)
+        pd.testing.assert_frame_equal(loaded_df, bars_df.loc[start:end])
+
+
+def test_next_row_close_bars_have_their_own_cache_file(klines, tmp_path):
+    source = _write_source(klines, str(tmp_path / 'BTCUSDT_1m.parquet'))
+    cache_dir = str(tmp_path / 'cache')
+
+    default_file = warm_bar_cache(source, BarType.DOLLAR, [1_000_000], cache_dir=cache_dir)[1_000_000]
+    next_row_file = warm_bar_cache(source, BarType.DOLLAR, [1_000_000], cache_dir=cache_dir, next_row_close=True)[1_000_000]
+
+    assert default_file != next_row_file and os.path.exists(default_file) and os.path.exists(next_row_file)
+    bars_df = load_bars(source, BarType.DOLLAR, 1_000_000, cache_dir=cache_dir, next_row_close=True)
+    expected = dollar_bar_func(klines, 1_000_000)
+    assert (bars_df['Close Time'].to_numpy() > expected['Close Time'].to_numpy()).all()
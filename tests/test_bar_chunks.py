@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bar_funcs import (BarType, BarAggregator, MultiBarAggregator, _bar_metric, bar_func, bar_func_from_file, iter_bars,
+                       multi_bar_func, multi_bar_func_from_chunks)
+
+
+BAR_SIZE_MULTIPLES = (3, 10, 37)    # Bar sizes as multiples of the mean absolute bar metric of a row
+
+
+def _bar_sizes(klines, bar_type):
+    mean_value = np.abs(_bar_metric(klines, bar_type)).mean()
+    return [float(round(mean_value * multiple)) for multiple in BAR_SIZE_MULTIPLES]
+
+
+def _reference_bars(ohlc_df, bar_type, bar_size, next_row_close=False):
+    # The original dollar bar iloc loop, on the bar metric of bar_type. The notebook script copies took Close and
+    # Close Time from end_idx, the row that opens the next bar
+    close_row = 0 if next_row_close else -1
+    metric = _bar_metric(ohlc_df, bar_type)
+    bar_indices = [0]
+    cumulative_value = 0
+    for i in range(1, len(ohlc_df)):
+        cumulative_value += metric[i]
+        if abs(cumulative_value) >= bar_size:
+            bar_indices.append(i)
+            cumulative_value = 0
+
+    bars = []
+    for start_idx, end_idx in zip(bar_indices[:-1], bar_indices[1:]):
+        bars.append({
+            'Open': ohlc_df['Open'].iloc[start_idx],
+            'High': ohlc_df['High'].iloc[start_idx:end_idx].max(),
+            'Low': ohlc_df['Low'].iloc[start_idx:end_idx].min(),
+            'Close': ohlc_df['Close'].iloc[end_idx + close_row],
+            'Volume': ohlc_df['Volume'].iloc[start_idx:end_idx].sum(),
+            'Quote volume': ohlc_df['Quote volume'].iloc[start_idx:end_idx].sum(),
+            'Trade count': ohlc_df['Trade count'].iloc[start_idx:end_idx].sum(),
+            'Taker base volume': ohlc_df['Taker base volume'].iloc[start_idx:end_idx].sum(),
+            'Taker quote volume': ohlc_df['Taker quote volume'].iloc[start_idx:end_idx].sum(),
+            'Open Time': ohlc_df.index[start_idx],
+            'Close Time': ohlc_df.index[end_idx + close_row] - pd.Timedelta(milliseconds=1),
+        })
+
+    return pd.DataFrame(bars)
+
+
+def _chunks(ohlc_df, bounds):
+    return [ohlc_df.iloc[start:end] for start, end in zip([0, *bounds], [*bounds, len(ohlc_df)])]
+
+
+# Chunk boundaries: one chunk, even chunks, single rows and empty chunks
+CHUNK_BOUNDS = [[], [1_000, 2_000, 3_000, 4_000], [1, 2, 3, 2_500, 2_501], [0, 0, 1_700, 1_700, 4_999]]
+
+
+@pytest.mark.parametrize('bar_type', list(BarType))
+def test_bar_func_matches_the_original_loop(klines, bar_type):
+    ohlc_df = klines.iloc[:5_000]
+    for bar_size in _bar_sizes(ohlc_df, bar_type):
+        expected = _reference_bars(ohlc_df, bar_type, bar_size)
+        actual = bar_func(ohlc_df, bar_type, bar_size)
+
+        assert len(expected) > 1
+        pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-12)
+
+
+@pytest.mark.parametrize('bar_type', list(BarType))
+@pytest.mark.parametrize('bounds', CHUNK_BOUNDS)
+def test_chunked_bars_match_whole_frame_bars(klines, bar_type, bounds):
+    ohlc_df = klines.iloc[:5_000]
+    bar_sizes = _bar_sizes(ohlc_df, bar_type)
+
+    whole = multi_bar_func(ohlc_df, bar_type, bar_sizes)
+    chunked = multi_bar_func_from_chunks(_chunks(ohlc_df, bounds), bar_type, bar_sizes)
+
+    for bar_size in bar_sizes:
+        # Several sizes in one pass give the bars of each size on its own
+        pd.testing.assert_frame_equal(whole[bar_size], bar_func(ohlc_df, bar_type, bar_size))
+        pd.testing.assert_frame_equal(chunked[bar_size], whole[bar_size])
+
+        iterated = pd.concat(list(iter_bars(_chunks(ohlc_df, bounds), bar_type, bar_size)), ignore_index=True)
+        pd.testing.assert_frame_equal(iterated, whole[bar_size])
+
+
+@pytest.mark.parametrize('bounds', CHUNK_BOUNDS)
+def test_next_row_close_matches_the_notebook_loop(klines, bounds):
+    ohlc_df = klines.iloc[:5_000]
+    bar_sizes = _bar_sizes(ohlc_df, BarType.DOLLAR)
+
+    chunked = multi_bar_func_from_chunks(_chunks(ohlc_df, bounds), BarType.DOLLAR, bar_sizes, next_row_close=True)
+
+    for bar_size in bar_sizes:
+        expected = _reference_bars(ohlc_df, BarType.DOLLAR, bar_size, next_row_close=True)
+        pd.testing.assert_frame_equal(chunked[bar_size], expected, check_exact=False, rtol=1e-12)
+        pd.testing.assert_frame_equal(bar_func(ohlc_df, BarType.DOLLAR, bar_size, next_row_close=True), chunked[bar_size])
+
+
+def test_chunks_with_an_open_time_column(klines):
+    # Close Time comes from the row that opens the next bar when the times are an 'Open Time' column
+    ohlc_df = klines.iloc[:5_000].rename_axis('Open Time').reset_index()
+    bar_size = _bar_sizes(ohlc_df, BarType.DOLLAR)[1]
+
+    aggregator = BarAggregator(BarType.DOLLAR, bar_size)
+    chunked = pd.concat([aggregator.update(chunk_df) for chunk_df in _chunks(ohlc_df, [1, 1_234, 3_000])], ignore_index=True)
+
+    pd.testing.assert_frame_equal(chunked, bar_func(ohlc_df, BarType.DOLLAR, bar_size))
+
+
+def test_aggregator_keeps_the_partial_bar(klines):
+    ohlc_df = klines.iloc[:5_000]
+    bar_sizes = _bar_sizes(ohlc_df, BarType.TICK)
+    aggregator = MultiBarAggregator(BarType.TICK, bar_sizes)
+
+    first = aggregator.update(ohlc_df.iloc[:2_000])
+    second = aggregator.update(ohlc_df.iloc[2_000:])
+
+    for bar_size in bar_sizes:
+        bars_df = pd.concat([first[bar_size], second[bar_size]], ignore_index=True)
+        pd.testing.assert_frame_equal(bars_df, bar_func(ohlc_df, BarType.TICK, bar_size))
+        # The trailing partial bar is not emitted
+        assert bars_df['Close Time'].iloc[-1] < ohlc_df.index[-1]
+
+
+@pytest.mark.parametrize('extension', ['csv', 'parquet'])
+def test_bars_from_file(klines, tmp_path, extension):
+    ohlc_df = klines.iloc[:5_000]
+    price_file = str(tmp_path / f'prices.{extension}')
+    file_df = ohlc_df.rename_axis('Open time').reset_index()
+    if extension == 'csv':
+        file_df.to_csv(price_file, index=False)
+    else:
+        file_df.to_parquet(price_file, index=False)
+    bar_size = _bar_sizes(ohlc_df, BarType.VOLUME)[0]
+
+    bars_df = bar_func_from_file(price_file, BarType.VOLUME, bar_size, chunk_size=700)
+
+    expected = bar_func(ohlc_df, BarType.VOLUME, bar_size)
+    pd.testing.assert_frame_equal(bars_df, expected, check_dtype=False, check_index_type=False)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from bar_funcs import BarType, dollar_bar_func, merge_and_fill_dollar_bars, multi_bar_func_from_chunks
+
+
+def test_nan_metric_stops_bars_like_the_original_loop(klines):
+    # The running dollar value becomes NaN on the NaN row and no bar closes after it
+    bars_df = dollar_bar_func(klines, 20_000)
+    nan_klines = klines.copy()
+    nan_klines.iloc[12_000, nan_klines.columns.get_loc('Volume')] = np.nan
+
+    nan_bars_df = dollar_bar_func(nan_klines, 20_000)
+
+    assert 0 < len(nan_bars_df) < len(bars_df)
+    assert (nan_bars_df['Close Time'] < nan_klines.index[12_000]).all()
+    pd.testing.assert_frame_equal(nan_bars_df, bars_df.iloc[:len(nan_bars_df)])
+
+
+def test_nan_metric_carried_across_chunks(klines):
+    nan_klines = klines.copy()
+    nan_klines.iloc[12_000, nan_klines.columns.get_loc('Close')] = np.nan
+    chunks = [nan_klines.iloc[:11_000], nan_klines.iloc[11_000:15_000], nan_klines.iloc[15_000:]]
+
+    bars_df = multi_bar_func_from_chunks(chunks, BarType.DOLLAR, [20_000])[20_000]
+
+    pd.testing.assert_frame_equal(bars_df, dollar_bar_func(nan_klines, 20_000))
+
+
+def test_infinite_metric_closes_one_bar(klines):
+    inf_klines = klines.copy()
+    inf_klines.iloc[12_000, inf_klines.columns.get_loc('Volume')] = np.inf
+
+    bars_df = dollar_bar_func(inf_klines, 20_000)
+
+    assert (bars_df['Close Time'] > inf_klines.index[12_000]).any()
+
+
+def test_merge_with_no_completed_bar(klines):
+    short_klines = klines.iloc[:10]
+    bars_df = dollar_bar_func(short_klines, 1e9)
+    assert len(bars_df) == 0
+
+    merged_df = merge_and_fill_dollar_bars(short_klines, bars_df, 1e9)
+
+    bar_columns = [col for col in merged_df.columns if col.startswith('db_1B_')]
+    assert len(bar_columns) == len(bars_df.columns) + 1
+    assert not merged_df['db_1B_NewDBFlag'].any()
+    assert merged_df[[col for col in bar_columns if col != 'db_1B_NewDBFlag']].isna().all().all()
+    pd.testing.assert_frame_equal(merged_df[short_klines.columns], short_klines)
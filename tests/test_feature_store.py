@@ -0,0 +1,52 @@
+import importlib
+import sys
+import numpy as np
+import pandas as pd
+
+import return_features
+from feature_store import _code_key, load_feature_group
+from return_features import historical_return_features, return_features_history
+
+
+def _returns_group(data, lookback_window=50):
+    return pd.DataFrame(historical_return_features(data['Close'].to_numpy(), lookback_window), index=data.index)
+
+
+def test_extended_group_equals_a_full_computation(klines, tmp_path):
+    store_dir = str(tmp_path)
+    warmup_bars = return_features_history(50) - 1
+    func = (_returns_group, return_features)
+
+    load_feature_group(klines.iloc[:12_000], 'historical_returns', {'lookback_window': 50}, _returns_group, warmup_bars, func, store_dir)
+    calls = []
+    group_df = load_feature_group(klines, 'historical_returns', {'lookback_window': 50},
+                                  lambda data: calls.append(len(data)) or _returns_group(data), warmup_bars, func, store_dir)
+
+    # Only the new bars and their warm-up were computed
+    assert calls == [len(klines) - 12_000 + warmup_bars]
+    expected_df = _returns_group(klines)
+    expected_df.columns = expected_df.columns.astype(str)
+    pd.testing.assert_frame_equal(group_df, expected_df, check_freq=False)
+
+
+def test_editing_a_called_module_invalidates_the_group(klines, tmp_path, monkeypatch):
+    module_file = tmp_path / 'scale_features.py'
+    module_file.write_text('SCALE = 2.0\n\ndef scale(values):\n    return values * SCALE\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    scale_features = importlib.import_module('scale_features')
+
+    def scaled_close(data):
+        return pd.DataFrame({'scaled_close': sys.modules['scale_features'].scale(data['Close'])}, index=data.index)
+
+    store_dir = str(tmp_path / 'store')
+    first_df = load_feature_group(klines, 'scaled', {}, scaled_close, 0, (scaled_close, scale_features), store_dir)
+    key = _code_key((scaled_close, scale_features))
+
+    # Same function, edited module: a new key and the group is computed again
+    module_file.write_text('SCALE = 3.0\n\ndef scale(values):\n    return values * SCALE\n')
+    scale_features = importlib.reload(scale_features)
+    second_df = load_feature_group(klines, 'scaled', {}, scaled_close, 0, (scaled_close, scale_features), store_dir)
+
+    assert _code_key((scaled_close, scale_features)) != key
+    assert np.allclose(second_df['scaled_close'], first_df['scaled_close'] * 1.5)
+    assert len(list((tmp_path / 'store').glob('*.parquet'))) == 1
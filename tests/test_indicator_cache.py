@@ -0,0 +1,23 @@
+from indicator_cache import IndicatorRegistry, data_fingerprint
+
+
+def test_fingerprint_of_a_dataframe(klines):
+    assert data_fingerprint(klines) == data_fingerprint(klines.copy())
+    assert data_fingerprint(klines) != data_fingerprint(klines.iloc[1:])
+
+
+def test_cached_computes_once(klines):
+    registry = IndicatorRegistry()
+    calls = []
+
+    def rolling_close(data, window):
+        calls.append(window)
+        return data['Close'].rolling(window).mean()
+
+    first = registry.cached(klines, 'rolling_close', rolling_close, window=20)
+    second = registry.cached(klines.copy(), 'rolling_close', rolling_close, window=20)
+    registry.cached(klines, 'rolling_close', rolling_close, window=50)
+
+    assert second is first
+    assert calls == [20, 50]
+    assert (registry.hits, registry.misses) == (1, 2)
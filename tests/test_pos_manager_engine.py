@@ -0,0 +1,143 @@
+import dataclasses
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_merged, write_backtest_files
+from pos_manager_engine import TRADE_LOG_SIZE, PosManagerParams, PosManagerSession, run_pos_manager, stats_differences, sweep_pos_manager
+
+
+def test_max_trades_above_the_trade_log_size(merged):
+    # The kernel needs room for max_trades closed trades per bar, it used to never advance past the first bar
+    params = PosManagerParams()
+    large_params = dataclasses.replace(params, max_trades=TRADE_LOG_SIZE + 10)
+
+    stats = run_pos_manager(merged, params)
+    large_stats = run_pos_manager(merged, large_params)
+    pd.testing.assert_frame_equal(large_stats['_trades'], stats['_trades'])
+    pd.testing.assert_frame_equal(large_stats['_equity_curve'], stats['_equity_curve'])
+
+    session = PosManagerSession(large_params)
+    trades_df = pd.concat([session.run_chunk(merged.iloc[:10_000])[1], session.run_chunk(merged.iloc[10_000:])[1]], ignore_index=True)
+    assert len(trades_df) == len(stats['_trades'])
+
+    ranking_df = sweep_pos_manager([merged], [params, large_params])
+    assert (ranking_df['# Trades'] == len(stats['_trades'])).all()
+    assert np.allclose(ranking_df['Equity Final [$]'], stats['Equity Final [$]'])
+
+
+def _backtesting_stats(merged_df):
+    import warnings
+    import backtest_script
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return backtest_script._run_backtest(merged_df, backtest_script.ENGINE_BACKTESTING)
+
+
+@pytest.mark.parametrize('rows, seed, freq, signal_rate', [(20_000, 0, 's', 0.002), (20_000, 1, 's', 0.0005), (5_000, 2, 'min', 0.01)])
+def test_numba_engine_matches_backtesting(rows, seed, freq, signal_rate):
+    import backtest_script
+
+    merged_df = make_merged(rows, seed=seed, freq=freq, signal_rate=signal_rate)
+
+    expected = _backtesting_stats(merged_df)
+    actual = run_pos_manager(merged_df, backtest_script._pos_manager_params())
+
+    assert len(expected['_trades']) > 0
+    assert stats_differences(expected, actual) == []
+
+
+@pytest.mark.parametrize('prices_per_hour', [60, 600])
+def test_engines_match_with_another_pyramid_wait(monkeypatch, prices_per_hour):
+    # Minute data runs with NUM_PRICES_PER_HOUR = 60, both engines have to pyramid after that many bars
+    import backtest_script
+
+    monkeypatch.setattr(backtest_script, 'NUM_PRICES_PER_HOUR', prices_per_hour)
+    merged_df = make_merged(5_000, seed=3, freq='min', signal_rate=0.02)
+    params = backtest_script._pos_manager_params()
+
+    expected = _backtesting_stats(merged_df)
+    actual = run_pos_manager(merged_df, params)
+
+    assert params.pyramid_bars == prices_per_hour
+    assert stats_differences(expected, actual) == []
+
+
+def test_stats_differences_reports_a_changed_trade(merged):
+    stats = run_pos_manager(merged)
+    changed = stats.copy()
+    changed['_trades'] = stats['_trades'].copy()
+    changed['_trades'].loc[0, 'ExitPrice'] *= 1.001
+    changed['Return [%]'] = stats['Return [%]'] + 1
+
+    differences = stats_differences(stats, changed)
+
+    assert len(differences) == 2
+    assert differences[0].startswith('_trades') and differences[1].startswith('Return [%]')
+
+
+def test_validate_mode(merged, tmp_path, capsys):
+    import backtest_script
+
+    price_file, trade_file = write_backtest_files(merged, str(tmp_path))
+
+    assert backtest_script._validate_engines(price_file, [trade_file], 8_000, max_chunks=2) == 0
+    output = capsys.readouterr().out
+    assert output.count(', match') == 2 and 'Engines match.' in output
+
+
+def _session_stats(merged_df, chunk_rows, params=PosManagerParams()):
+    # A --continuous run: one PosManagerSession fed chunk by chunk, with the equity and trades of the chunks put together
+    session = PosManagerSession(params)
+    equity_dfs, trades_dfs = [], []
+    for start in range(0, len(merged_df), chunk_rows):
+        equity_df, trades_df = session.run_chunk(merged_df.iloc[start:start + chunk_rows])
+        equity_dfs.append(equity_df)
+        trades_dfs.append(trades_df)
+
+    stats = session.finish()
+    stats['_trades'] = pd.concat(trades_dfs, ignore_index=True)
+    stats['_equity_curve'] = pd.concat(equity_dfs)
+    return stats
+
+
+@pytest.mark.parametrize('rows, freq, chunk_rows', [(20_000, 's', 3_000), (20_000, 's', 20_000), (6_000, 'min', 1_000),
+                                                     (3_000, 'h', 700), (600, 'D', 100), (300, 'W', 50)])
+def test_running_stats_match_compute_stats(rows, freq, chunk_rows):
+    # RunningStats rebuilds backtesting's compute_stats chunk by chunk, run_pos_manager calls compute_stats on the whole series
+    merged_df = make_merged(rows, freq=freq, signal_rate=0.01)
+
+    expected = run_pos_manager(merged_df)
+    actual = _session_stats(merged_df, chunk_rows)
+
+    # compute_stats also puts the duration of a drawdown still running at the end on the last bar of the curve,
+    # the streamed curve is written before the end is known and has it in the stats only
+    expected_curve = expected['_equity_curve'].copy()
+    expected_curve.iloc[-1, expected_curve.columns.get_loc('DrawdownDuration')] = pd.NaT
+    expected['_equity_curve'] = expected_curve
+
+    assert len(expected['_trades']) > 0
+    assert stats_differences(expected, actual) == []
+
+
+SWEEP_STATS = ['Return [%]', '# Trades', 'Equity Final [$]', 'Equity Peak [$]', 'Max. Drawdown [%]', 'Win Rate [%]', 'Best Trade [%]',
+               'Worst Trade [%]', 'Avg. Trade [%]', 'Profit Factor', 'Expectancy [%]', 'SQN', 'Commissions [$]', 'Buy & Hold Return [%]']
+
+
+def test_sweep_default_row_matches_run_pos_manager():
+    import backtest_script
+
+    merged_df = make_merged(20_000, signal_rate=0.01)
+    params = backtest_script._pos_manager_params()
+    param_grid = backtest_script._build_param_grid({'take_profit_pct': [0.005, params.take_profit_pct], 'max_trades': [1, params.max_trades]})
+    chunks = [merged_df.iloc[start:start + 3_000] for start in range(0, len(merged_df), 3_000)]
+
+    ranking_df = sweep_pos_manager(chunks, param_grid)
+    default_row = ranking_df[(ranking_df['take_profit_pct'] == params.take_profit_pct) & (ranking_df['max_trades'] == params.max_trades)].iloc[0]
+    stats = run_pos_manager(merged_df, params)
+
+    assert stats['# Trades'] > 0
+    for name in SWEEP_STATS:
+        assert np.isclose(default_row[name], stats[name], rtol=1e-9, equal_nan=True), name
+    assert (default_row['Start'], default_row['End']) == (stats['Start'], stats['End'])
@@ -0,0 +1,174 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_klines
+from price_file_converter import (DATA_DIR, FORMAT_TYPE_1_COLUMNS, MANIFEST_FILE_NAME, OUTPUT_FORMAT_FEATHER, OUTPUT_FORMAT_PARQUET, PriceFileFormatType,
+                                  _apply_price_dtypes, _build_file_tasks, _combine_into_one_df, _convert_chunk_df_to_correct_format, _read_manifest,
+                                  _read_partition_file, _update_month_partitions, _write_month_partitions, read_price_data)
+
+
+def _utc_klines(rows, freq):
+    klines = make_klines(rows, start='2021-01-30', freq=freq)
+    klines.index = klines.index.tz_localize('UTC')
+    return klines
+
+
+def test_month_partitions(tmp_path):
+    klines = _utc_klines(100_000, '1min')     # 2021-01-30 to 2021-04-08
+
+    for output_format in [OUTPUT_FORMAT_PARQUET, OUTPUT_FORMAT_FEATHER]:
+        dataset_dir = str(tmp_path / output_format)
+        _write_month_partitions(klines.sample(frac=1, random_state=0), dataset_dir, output_format)
+
+        assert sorted(os.listdir(dataset_dir)) == [f'2021-0{month}.{output_format}' for month in range(1, 5)]
+        partitions = [_read_partition_file(os.path.join(dataset_dir, f)) for f in sorted(os.listdir(dataset_dir))]
+        for partition_df in partitions:
+            assert partition_df.index.strftime('%Y-%m').nunique() == 1
+        pd.testing.assert_frame_equal(pd.concat(partitions), klines, check_freq=False)
+
+
+def test_month_partitions_append(tmp_path):
+    klines = _utc_klines(100_000, '1min')
+    dataset_dir = str(tmp_path / 'dataset')
+
+    _write_month_partitions(klines.iloc[:50_000], dataset_dir, OUTPUT_FORMAT_PARQUET)
+    _write_month_partitions(klines.iloc[50_000:], dataset_dir, OUTPUT_FORMAT_PARQUET, append=True)
+
+    partitions = [_read_partition_file(os.path.join(dataset_dir, f)) for f in sorted(os.listdir(dataset_dir))]
+    pd.testing.assert_frame_equal(pd.concat(partitions), klines, check_freq=False)
+
+
+SOURCE_SPLITS = ['2021-02-15 07:00', '2021-03-10']     # The sources overlap months, the second one continues February
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # The source files and the datasets live in data/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(tmp_path / DATA_DIR)
+    return tmp_path / DATA_DIR
+
+
+def _write_format1(klines, file_name, has_header):
+    # A Binance kline download: epoch ms times and the lower case column names
+    open_time = klines.index.as_unit('ms').asi8
+    df = pd.DataFrame({'open_time': open_time, 'open': klines['Open'], 'high': klines['High'], 'low': klines['Low'],
+                       'close': klines['Close'], 'volume': klines['Volume'], 'close_time': open_time + 59_999,
+                       'quote_volume': klines['Quote volume'], 'count': klines['Trade count'], 'taker_buy_volume': klines['Taker base volume'],
+                       'taker_buy_quote_volume': klines['Taker quote volume'], 'ignore': 0})
+    df.to_csv(os.path.join(DATA_DIR, file_name), index=False, header=has_header)
+    return file_name
+
+
+def _write_format2(klines, file_name):
+    df = klines.rename(columns={'Trade count': 'Number of trades'}).reset_index()
+    df.insert(6, 'Close time', df['Open time'] + pd.Timedelta(seconds=59))
+    df.to_csv(os.path.join(DATA_DIR, file_name), index=False)
+    return file_name
+
+
+def _source_files(klines):
+    split_rows = klines.index.searchsorted(pd.DatetimeIndex(SOURCE_SPLITS))
+    parts = [klines.iloc[:split_rows[0]], klines.iloc[split_rows[0]:split_rows[1]], klines.iloc[split_rows[1]:]]
+    return [_write_format1(parts[0], 'BTCUSDT-1s-2021-01.csv', False), _write_format1(parts[1], 'BTCUSDT-1s-2021-02.csv', False),
+            _write_format1(parts[2], 'secbtcusdtm_2021.csv', True)]
+
+
+def _file_tasks(file_names):
+    return _build_file_tasks(file_names[:-1], file_names[-1])
+
+
+def _read_dataset(dataset_name):
+    return read_price_data(os.path.join(DATA_DIR, dataset_name))
+
+
+def _partition_mtimes(dataset_name):
+    dataset_dir = os.path.join(DATA_DIR, dataset_name)
+    return {name: os.stat(os.path.join(dataset_dir, name)).st_mtime_ns for name in os.listdir(dataset_dir) if name != MANIFEST_FILE_NAME}
+
+
+def _sequential_read(files_for_2021, file2, file3=None):
+    # The converter before the parallel fixed-schema ingest: every file read with pd.read_csv, one after the other
+    monthly_df = pd.concat([pd.read_csv(os.path.join(DATA_DIR, file_name), header=None, names=FORMAT_TYPE_1_COLUMNS) for file_name in files_for_2021])
+    part1_df = pd.concat([monthly_df, pd.read_csv(os.path.join(DATA_DIR, file2))])
+    part1_df = _convert_chunk_df_to_correct_format(part1_df, PriceFileFormatType.FORMAT_TYPE_1)
+    if file3 is None:
+        return part1_df
+    part2_df = _convert_chunk_df_to_correct_format(pd.read_csv(os.path.join(DATA_DIR, file3)), PriceFileFormatType.FORMAT_TYPE_2)
+    return pd.concat([part1_df, part2_df])
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_parallel_ingest_matches_the_sequential_read(data_dir, workers):
+    klines = make_klines(12_000, start='2021-01-01', freq='17min')
+    file_names = _source_files(klines.iloc[:9_000])
+    file3 = _write_format2(klines.iloc[9_000:], 'btcsec2021-23.csv')
+    file_tasks = _build_file_tasks(file_names[:-1], file_names[-1], file3)
+
+    combined_df = _combine_into_one_df(file_tasks, workers)
+
+    expected = _sequential_read(file_names[:-1], file_names[-1], file3)
+    pd.testing.assert_frame_equal(combined_df, expected)
+
+    # The partitioned dataset holds the same rows, sorted, with the price dtypes and a UTC index
+    _update_month_partitions(file_tasks, 'dataset', OUTPUT_FORMAT_PARQUET, workers)
+    pd.testing.assert_frame_equal(_read_dataset('dataset'), _apply_price_dtypes(expected).sort_index(kind='stable'), check_freq=False)
+
+
+def test_runs_over_source_subsets_match_one_full_run(data_dir):
+    file_tasks = _file_tasks(_source_files(make_klines(9_000, start='2021-01-01', freq='17min')))
+    _update_month_partitions(file_tasks, 'full', OUTPUT_FORMAT_PARQUET, workers=1)
+
+    _update_month_partitions(file_tasks[:1], 'subsets', OUTPUT_FORMAT_PARQUET, workers=1)
+    january_mtime = _partition_mtimes('subsets')['2021-01.parquet']
+    _update_month_partitions(file_tasks[:2], 'subsets', OUTPUT_FORMAT_PARQUET, workers=1)
+    _update_month_partitions(file_tasks, 'subsets', OUTPUT_FORMAT_PARQUET, workers=1)
+
+    pd.testing.assert_frame_equal(_read_dataset('subsets'), _read_dataset('full'))
+    assert sorted(_partition_mtimes('subsets')) == sorted(_partition_mtimes('full'))
+    # Only the months of the new sources were written
+    assert _partition_mtimes('subsets')['2021-01.parquet'] == january_mtime
+    manifest = _read_manifest(os.path.join(DATA_DIR, 'subsets'))
+    assert manifest['sources'] == _read_manifest(os.path.join(DATA_DIR, 'full'))['sources']
+    assert sum(entry['rows'] for entry in manifest['sources'].values()) == 9_000
+
+
+def test_rerun_with_unchanged_sources_writes_nothing(data_dir, monkeypatch):
+    import price_file_converter
+
+    file_names = _source_files(make_klines(9_000, start='2021-01-01', freq='17min'))
+    _update_month_partitions(_file_tasks(file_names), 'dataset', OUTPUT_FORMAT_PARQUET, workers=1)
+    mtimes = _partition_mtimes('dataset')
+
+    # Touching a source changes its modification time only, it is hashed again and kept
+    os.utime(os.path.join(DATA_DIR, file_names[0]), ns=(0, 10**18))
+    def fail(*args):
+        raise AssertionError('nothing should be read')
+    monkeypatch.setattr(price_file_converter, '_read_files_in_parallel', fail)
+    _update_month_partitions(_file_tasks(file_names), 'dataset', OUTPUT_FORMAT_PARQUET, workers=1)
+
+    assert _partition_mtimes('dataset') == mtimes
+    # The new modification time is recorded, the next run does not hash the file
+    monkeypatch.setattr(price_file_converter, '_file_sha1', fail)
+    _update_month_partitions(_file_tasks(file_names), 'dataset', OUTPUT_FORMAT_PARQUET, workers=1)
+    assert _partition_mtimes('dataset') == mtimes
+
+
+def test_changed_source_rebuilds_its_months(data_dir):
+    klines = make_klines(9_000, start='2021-01-01', freq='17min')
+    file_names = _source_files(klines)
+    _update_month_partitions(_file_tasks(file_names), 'dataset', OUTPUT_FORMAT_PARQUET, workers=1)
+
+    # The second source is downloaded again with a corrected close
+    changed_klines = klines.copy()
+    changed_klines.loc['2021-02-20':'2021-02-21', 'Close'] += 1
+    _source_files(changed_klines)
+    _update_month_partitions(_file_tasks(file_names), 'dataset', OUTPUT_FORMAT_PARQUET, workers=1)
+
+    _update_month_partitions(_file_tasks(file_names), 'fresh', OUTPUT_FORMAT_PARQUET, workers=1)
+    dataset_df = _read_dataset('dataset')
+    pd.testing.assert_frame_equal(dataset_df, _read_dataset('fresh'))
+    assert len(dataset_df) == 9_000
+    assert np.allclose(dataset_df.loc['2021-02-20':'2021-02-21', 'Close'], changed_klines.loc['2021-02-20':'2021-02-21', 'Close'], rtol=1e-15)
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import price_rollups
+from bar_funcs import BAR_SUM_COLUMNS
+from conftest import make_klines
+from price_rollups import ROLLUP_PERIODS, ROLLUP_TIMEFRAMES, load_rollup, update_rollups
+from price_store import PriceStore, write_price_store
+
+
+OHLCV = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', **{column: 'sum' for column in BAR_SUM_COLUMNS}}
+
+
+@pytest.fixture
+def seconds_df():
+    # 7s rows over about five days, with gaps so some periods have no rows at all
+    klines_df = make_klines(60_000, start='2024-01-01 22:13:05', freq='7s')
+    klines_df = klines_df.drop(klines_df.index[20_000:21_000]).drop(klines_df.index[33_333:33_400])
+    return klines_df.set_axis(klines_df.index.tz_localize('UTC').as_unit('ns'))
+
+
+def _assert_rollups_match_resample(store_dir, seconds_df):
+    source_df = PriceStore(store_dir).to_frame()
+    pd.testing.assert_frame_equal(source_df, seconds_df, check_freq=False)
+
+    for timeframe in ROLLUP_TIMEFRAMES:
+        expected = source_df.resample(pd.Timedelta(seconds=ROLLUP_PERIODS[timeframe]), origin='epoch').agg(OHLCV).dropna(subset=['Open'])
+        actual = load_rollup(store_dir, timeframe)
+        assert len(actual) > 1
+        pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-12, check_freq=False, obj=timeframe)
+
+
+def test_full_build_matches_resample(seconds_df, tmp_path, monkeypatch):
+    # Small aggregation chunks, so periods are split across chunks too
+    monkeypatch.setattr(price_rollups, 'ROLLUP_CHUNK_ROWS', 5_003)
+    store_dir = str(tmp_path / 'prices.store')
+    write_price_store([seconds_df], store_dir)
+
+    rows = update_rollups(store_dir)
+
+    assert rows['1d'] == len(load_rollup(store_dir, '1d'))
+    _assert_rollups_match_resample(store_dir, seconds_df)
+
+
+@pytest.mark.parametrize('split_row', [1, 17_777, 41_000])
+def test_append_rebuilds_the_partial_bar(seconds_df, tmp_path, split_row):
+    store_dir = str(tmp_path / 'prices.store')
+    write_price_store([seconds_df.iloc[:split_row]], store_dir)
+    update_rollups(store_dir)
+
+    # The last bar of every timeframe is still open at split_row and gets rows from the appended part
+    write_price_store([seconds_df.iloc[split_row:]], store_dir, append=True)
+    update_rollups(store_dir)
+
+    _assert_rollups_match_resample(store_dir, seconds_df)
+
+
+def test_rerun_without_new_rows_changes_nothing(seconds_df, tmp_path):
+    store_dir = str(tmp_path / 'prices.store')
+    write_price_store([seconds_df], store_dir)
+    first = update_rollups(store_dir)
+    frames = {timeframe: load_rollup(store_dir, timeframe) for timeframe in ROLLUP_TIMEFRAMES}
+
+    assert update_rollups(store_dir) == first
+    for timeframe, bars_df in frames.items():
+        pd.testing.assert_frame_equal(load_rollup(store_dir, timeframe), bars_df)
@@ -0,0 +1,115 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from bar_funcs import BarType, multi_bar_func_from_file, read_price_chunks
+from price_store import PriceStore, truncate_price_store, write_price_store
+
+
+@pytest.fixture
+def price_csv(klines, tmp_path):
+    price_file = str(tmp_path / 'prices.csv')
+    klines.reset_index().to_csv(price_file, index=False)
+    return price_file
+
+
+def _store_files(store_dir):
+    contents = {}
+    for name in sorted(os.listdir(store_dir)):
+        with open(os.path.join(store_dir, name), 'rb') as f:
+            contents[name] = f.read()
+    return contents
+
+
+def _utc(df):
+    # The CSV times are taken as UTC, the store keeps them as UTC
+    return df.set_axis(df.index.tz_localize('UTC').as_unit('ns'))
+
+
+def _utc_timestamp(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_localize('UTC') if ts.tz is None else ts.tz_convert('UTC')
+
+
+def test_store_round_trips_the_csv(price_csv, tmp_path):
+    store_dir = str(tmp_path / 'prices.store')
+
+    rows = write_price_store(read_price_chunks(price_csv, 3_000), store_dir)
+
+    csv_df = pd.concat(read_price_chunks(price_csv))
+    assert rows == len(csv_df) == len(PriceStore(store_dir))
+    pd.testing.assert_frame_equal(PriceStore(store_dir).to_frame(), _utc(csv_df), check_freq=False)
+
+
+def test_append_equals_a_single_write(price_csv, tmp_path):
+    single_dir = str(tmp_path / 'single.store')
+    appended_dir = str(tmp_path / 'appended.store')
+    write_price_store(read_price_chunks(price_csv, 3_000), single_dir)
+
+    csv_df = pd.concat(read_price_chunks(price_csv))
+    write_price_store([csv_df.iloc[:7_000]], appended_dir)
+    # The rows already stored are skipped
+    write_price_store([csv_df.iloc[5_000:12_000], csv_df.iloc[12_000:]], appended_dir, append=True)
+
+    assert _store_files(appended_dir) == _store_files(single_dir)
+
+
+def test_truncate_then_append(price_csv, tmp_path):
+    single_dir = str(tmp_path / 'single.store')
+    store_dir = str(tmp_path / 'prices.store')
+    write_price_store(read_price_chunks(price_csv, 3_000), single_dir)
+    write_price_store(read_price_chunks(price_csv, 3_000), store_dir)
+
+    truncate_price_store(store_dir, 9_000)
+    store = PriceStore(store_dir)
+    assert len(store) == 9_000
+    pd.testing.assert_frame_equal(store.to_frame(), PriceStore(single_dir).to_frame().iloc[:9_000], check_freq=False)
+
+    # The column files still hold every row, the append cuts them at the stored row count first
+    write_price_store(read_price_chunks(price_csv, 3_000), store_dir, append=True)
+    assert _store_files(store_dir) == _store_files(single_dir)
+
+
+def test_slices_match_loc(price_csv, tmp_path):
+    store_dir = str(tmp_path / 'prices.store')
+    write_price_store(read_price_chunks(price_csv, 3_000), store_dir)
+    store = PriceStore(store_dir)
+    full_df = store.to_frame()
+    times = full_df.index
+
+    bounds = [(None, None), (times[0], times[-1]), (times[100], times[101]), (times[100], times[100]),
+              (times[5_000], None), (None, times[5_000]), (times[10] + pd.Timedelta(seconds=30), times[20] - pd.Timedelta(seconds=30)),
+              (times[0] - pd.Timedelta(days=1), times[-1] + pd.Timedelta(days=1)), (times[-1] + pd.Timedelta(days=1), None),
+              ('2024-01-02', '2024-01-03'), (times[10].tz_localize(None), times[20].tz_localize(None))]
+    for start, end in bounds:
+        # end is exclusive, naive times are UTC
+        loc_start = None if start is None else _utc_timestamp(start)
+        loc_end = None if end is None else _utc_timestamp(end) - pd.Timedelta(1, 'ns')
+        expected = full_df.loc[loc_start:loc_end]
+        pd.testing.assert_frame_equal(store.to_frame(start, end), expected, check_freq=False)
+        chunks = list(store.iter_chunks(997, start, end))
+        assert all(len(chunk_df) == 997 for chunk_df in chunks[:-1])
+        if len(expected):
+            pd.testing.assert_frame_equal(pd.concat(chunks), expected, check_freq=False)
+        else:
+            assert chunks == []
+
+
+def test_chunks_and_bars_match_the_csv(price_csv, tmp_path):
+    store_dir = str(tmp_path / 'prices.store')
+    write_price_store(read_price_chunks(price_csv, 3_000), store_dir)
+
+    for store_chunk, csv_chunk in zip(PriceStore(store_dir).iter_chunks(4_000), pd.read_csv(price_csv, chunksize=4_000), strict=True):
+        assert np.array_equal(store_chunk.index.tz_localize(None), pd.to_datetime(csv_chunk['Open time']))
+        pd.testing.assert_frame_equal(store_chunk.reset_index(drop=True), csv_chunk.drop(columns='Open time').reset_index(drop=True))
+
+    bar_sizes = [20_000, 75_000]
+    store_bars = multi_bar_func_from_file(store_dir, BarType.DOLLAR, bar_sizes, chunk_size=4_000)
+    csv_bars = multi_bar_func_from_file(price_csv, BarType.DOLLAR, bar_sizes, chunk_size=4_000)
+    for bar_size in bar_sizes:
+        expected = csv_bars[bar_size].copy()
+        for column in ['Open Time', 'Close Time']:
+            expected[column] = expected[column].dt.tz_localize('UTC').dt.as_unit('ns')
+        assert len(expected) > 0
+        pd.testing.assert_frame_equal(store_bars[bar_size], expected)
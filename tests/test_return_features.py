@@ -0,0 +1,75 @@
+import types
+import numpy as np
+import pandas as pd
+import pytest
+
+from return_features import HistoricalReturnsStream, historical_return_features, return_features_history
+
+
+def _reference_historical_returns(X, data, lookback_window):
+    # feature_engineering._add_historical_returns before the return block
+    X['pct_change_1'] = data.close.pct_change(1)
+    X['pct_change_5'] = data.close.pct_change(5)
+    X['pct_change_10'] = data.close.pct_change(10)
+    X['pct_change_20'] = data.close.pct_change(20)
+    X['pct_change_40'] = data.close.pct_change(40)
+    X['pct_change_60'] = data.close.pct_change(60)
+    X['pct_change_100'] = data.close.pct_change(100)
+    X['pct_change_160'] = data.close.pct_change(160)
+    X['pct_change_260'] = data.close.pct_change(260)
+    X['pct_change_420'] = data.close.pct_change(420)
+
+    X['yesterday_up'] = np.where(X['pct_change_160'] > 0, 1, 0)
+    X['yesterday_down'] = np.where(X['pct_change_160'] < 0, 1, 0)
+    X['up_down_run_160'] = np.sign(data.close.diff(160)).rolling(lookback_window).sum()
+    X['up_down_run_1'] = np.sign(data.close.diff(1)).rolling(lookback_window).sum()
+
+    X['mid_range_momentum'] = pd.Series(np.where(X['pct_change_100'] > X['pct_change_420'], True, False), index=X.index)
+    X['short_range_momentum'] = pd.Series(np.where(X['pct_change_20'] > X['pct_change_40'], True, False), index=X.index)
+    X['short_over_long_momentum'] = pd.Series(np.where(X['pct_change_20'] > X['pct_change_420'], True, False), index=X.index)
+    X['momentum_trending'] = pd.Series(np.where(X['pct_change_20'] > X['pct_change_20'].shift(lookback_window), True, False), index=X.index)
+    X['large_move_up'] = np.where(data.close > data.close.shift(lookback_window) * 1.05, 1, 0)
+    X['large_move_down'] = np.where(data.close < data.close.shift(lookback_window) * 0.95, 1, 0)
+    return X
+
+
+def _close(rows, seed=0):
+    # A random walk with flat stretches, so zero returns and zero signs are covered
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, rows)))
+    close[300:500] = close[300]
+    close[1_000:1_010] = close[1_000]
+    return pd.Series(close, index=pd.date_range('2024-01-01', periods=rows, freq='min'))
+
+
+@pytest.mark.parametrize('lookback_window', [1, 14, 100, 500])
+def test_matches_the_pandas_implementation(lookback_window):
+    close = _close(3_000)
+    expected = _reference_historical_returns(pd.DataFrame(index=close.index), types.SimpleNamespace(close=close), lookback_window)
+
+    actual = pd.DataFrame(historical_return_features(close.to_numpy(), lookback_window), index=close.index)
+
+    pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+
+
+@pytest.mark.parametrize('lookback_window', [14, 500])
+def test_stream_matches_the_batch_rows(lookback_window):
+    close = _close(2_000, seed=1).to_numpy()
+    batch = historical_return_features(close, lookback_window)
+
+    history = return_features_history(lookback_window)
+    stream = HistoricalReturnsStream(lookback_window, closes=close[:history])
+    for t in range(history, len(close)):
+        row = stream.update(close[t])
+        for name, values in batch.items():
+            np.testing.assert_array_equal(row[name], values[t], err_msg=f'{name} at {t}')
+
+
+def test_last_rows_match_the_full_build():
+    close = _close(1_500, seed=2).to_numpy()
+    batch = historical_return_features(close, 100)
+
+    tail = historical_return_features(close, 100, last_rows=37)
+
+    for name, values in batch.items():
+        np.testing.assert_array_equal(tail[name], values[-37:], err_msg=name)
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+WQA_ALPHAS = ["wqa101_%d" % i for i in range(1, 102)]
+ALPHA_DTYPE = np.float32
+COLUMN_NAMES = ['run_func', 'output']       # Column levels of data.run([...]), kept so the feature names do not change
+
+ALPHA_INDEX_DIR = os.path.join("data", "alpha_index")
+DEFAULT_MAX_CORRELATION = 0.95              # Alphas at least this correlated with a kept alpha are left out
+MIN_COMMON_ROWS = 30                        # Rows two alphas need in common before their correlation is trusted
+INDEX_CHUNK_ROWS = 100_000                  # Rows of the alpha matrix added to the correlation sums at a time
+
+# Set in each worker by _init_worker: the bars rebuilt on the shared input arrays and the shared output matrix
+_worker_data = None
+_worker_index = None
+_worker_output = None
+_worker_blocks = []
+
+
+def _share_array(array, blocks):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return block.name, array.shape, array.dtype.str
+
+
+def _attach_array(spec, blocks, order='C'):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    blocks.append(block)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf, order=order)
+
+
+def _share_bars(bars_df, blocks):
+    # Every numeric and datetime column goes into a shared block of its own, datetimes as int64 nanoseconds
+    index = pd.DatetimeIndex(bars_df.index)
+    columns = []
+    for column in bars_df.columns:
+        values = bars_df[column]
+        if isinstance(values.dtype, pd.DatetimeTZDtype) or np.issubdtype(values.dtype, np.datetime64):
+            times = pd.DatetimeIndex(values)
+            columns.append((column, _share_array(times.as_unit('ns').asi8, blocks), 'datetime', str(times.tz) if times.tz else None))
+        elif np.issubdtype(values.dtype, np.number) or values.dtype == bool:
+            columns.append((column, _share_array(values.to_numpy(), blocks), 'value', None))
+
+    return {'index': _share_array(index.as_unit('ns').asi8, blocks), 'index_name': index.name,
+            'index_tz': str(index.tz) if index.tz else None, 'columns': columns}
+
+
+def _attach_bars(bars_spec, blocks):
+    # Only the block names were pickled, the bars are read from the shared blocks
+    index = pd.DatetimeIndex(_attach_array(bars_spec['index'], blocks).view('datetime64[ns]'), name=bars_spec['index_name'])
+    index = index.tz_localize('UTC').tz_convert(bars_spec['index_tz']) if bars_spec['index_tz'] else index
+    bars = {}
+    for column, spec, kind, tz in bars_spec['columns']:
+        values = _attach_array(spec, blocks)
+        if kind == 'datetime':
+            times = pd.DatetimeIndex(values.view('datetime64[ns]'))
+            values = times.tz_localize('UTC').tz_convert(tz) if tz else times
+        bars[column] = values
+
+    return pd.DataFrame(bars, index=index, copy=False)
+
+
+def _init_worker(data_cls, bars_spec, output_spec):
+    global _worker_data, _worker_index, _worker_output
+    _worker_data = data_cls.from_data(_attach_bars(bars_spec, _worker_blocks))
+    _worker_index = _worker_data.get().index
+    _worker_output = _attach_array(output_spec, _worker_blocks, order='F')
+
+
+def _run_alpha(column, alpha):
+    """
+    Runs one alpha in a worker and writes it into its column of the output matrix.
+
+    Returns:
+    column (int): Output column.
+    labels (tuple): Column labels of the alpha, as data.run([alpha]) names them.
+    error (str): None, or the exception the alpha raised.
+    seconds (float): Run time.
+    """
+    start_time = time.perf_counter()
+    try:
+        alpha_df = _worker_data.run([alpha], missing_index="drop")
+        alpha_df = alpha_df.to_frame() if isinstance(alpha_df, pd.Series) else alpha_df
+        _worker_output[:, column] = alpha_df.iloc[:, 0].reindex(_worker_index).to_numpy(dtype=ALPHA_DTYPE)
+        labels = alpha_df.columns[0] if isinstance(alpha_df.columns[0], tuple) else (alpha, alpha_df.columns[0])
+        error = None if alpha_df.shape[1] == 1 else f'{alpha_df.shape[1]} outputs, only the first one is kept'
+    except Exception as e:
+        labels, error = (alpha, 'out'), f'{type(e).__name__}: {e}'
+
+    return column, labels, error, time.perf_counter() - start_time
+
+
+def compute_wqa_alphas(data, alphas=WQA_ALPHAS, workers=None):
+    """
+    The WorldQuant 101 alphas of data, each one run as a task of a process pool.
+
+    The bars are put in shared memory once, every worker rebuilds the Data object on top of them instead of
+    receiving a pickled copy per task, and writes its alphas straight into a preallocated float32 matrix that
+    is shared as well. An alpha that raises leaves its column NaN, it is reported with the all-NaN ones.
+
+    Parameters:
+    data (vbt.Data): Bars, e.g. load_bar_data(...).
+    alphas (list): Alpha names, as for data.run.
+    workers (int): Processes (default: os.cpu_count()). 1 runs the alphas in this process.
+
+    Returns:
+    alphas_df (DataFrame): One float32 column per alpha, with the (run_func, output) columns of data.run(alphas).
+    report (dict): 'failed' (alpha -> error), 'all_nan' (alphas) and 'seconds' (alpha -> run time).
+    """
+    global _worker_data, _worker_index, _worker_output
+    workers = workers or os.cpu_count()
+    bars_df = data.get()
+    blocks, output = [], None
+    try:
+        output_spec = _share_array(np.full((len(bars_df), len(alphas)), np.nan, dtype=ALPHA_DTYPE, order='F'), blocks)
+        output = _attach_array(output_spec, blocks, order='F')
+        if workers <= 1 or len(alphas) <= 1:
+            _worker_data, _worker_index, _worker_output = data, bars_df.index, output
+            try:
+                results = [_run_alpha(column, alpha) for column, alpha in enumerate(alphas)]
+            finally:
+                _worker_data = _worker_index = _worker_output = None
+        else:
+            bars_spec = _share_bars(bars_df, blocks)
+            with ProcessPoolExecutor(max_workers=min(workers, len(alphas)), initializer=_init_worker,
+                                     initargs=(type(data), bars_spec, output_spec)) as executor:
+                results = list(executor.map(_run_alpha, range(len(alphas)), alphas))
+
+        columns = pd.MultiIndex.from_tuples([labels for _, labels, _, _ in results], names=COLUMN_NAMES)
+        alphas_df = pd.DataFrame(output.copy(order='F'), index=bars_df.index, columns=columns)
+    finally:
+        # No view may be left on a block when it is closed. The output block is attached twice here, it is unlinked once.
+        output = None
+        unlinked = set()
+        for block in blocks:
+            block.close()
+            if block.name not in unlinked:
+                unlinked.add(block.name)
+                block.unlink()
+
+    report = {'failed': {alphas[column]: error for column, _, error, _ in results if error},
+              'all_nan': [alphas[column] for column in np.flatnonzero(np.isnan(alphas_df.to_numpy()).all(axis=0))],
+              'seconds': {alphas[column]: seconds for column, _, _, seconds in results}}
+    return alphas_df, report
+
+
+class _CorrelationAccumulator:
+    """
+    Pairwise-complete correlations between the columns of a matrix that is given in row chunks, in a single pass.
+
+    For every pair the sums are taken over the rows where both columns are valid, so a NaN in one alpha does not
+    drop the row for the others. The columns are shifted by their mean in the first chunk to keep the sums small.
+    """
+
+    def __init__(self, columns):
+        self.counts = np.zeros((columns, columns))
+        self.sums = np.zeros((columns, columns))           # sums[i, j]: sum of column i over the rows where j is valid
+        self.squares = np.zeros((columns, columns))
+        self.products = np.zeros((columns, columns))
+        self.min = np.full(columns, np.inf)
+        self.max = np.full(columns, -np.inf)
+        self.shift = None
+
+    def update(self, chunk):
+        valid = ~np.isnan(chunk)
+        if self.shift is None:
+            counts = valid.sum(axis=0)
+            self.shift = np.where(counts > 0, np.where(valid, chunk, 0).sum(axis=0, dtype=np.float64) / np.maximum(counts, 1), 0.0)
+        x = np.where(valid, chunk - self.shift, 0.0)
+        mask = valid.astype(np.float64)
+
+        self.counts += mask.T @ mask
+        self.sums += x.T @ mask
+        self.squares += (x * x).T @ mask
+        self.products += x.T @ x
+        self.min = np.minimum(self.min, np.where(valid, chunk, np.inf).min(axis=0, initial=np.inf))
+        self.max = np.maximum(self.max, np.where(valid, chunk, -np.inf).max(axis=0, initial=-np.inf))
+
+    def correlation(self):
+        n = self.counts
+        covariance = n * self.products - self.sums * self.sums.T
+        variance = n * self.squares - self.sums ** 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            correlation = covariance / np.sqrt(variance * variance.T)
+        correlation[n < MIN_COMMON_ROWS] = np.nan
+        return correlation
+
+
+def _alpha_index_file(data, index_dir):
+    from indicator_cache import data_fingerprint
+
+    return os.path.join(index_dir, f'{data_fingerprint(data)}.json')
+
+
+def build_alpha_index(data, alphas=WQA_ALPHAS, max_correlation=DEFAULT_MAX_CORRELATION, workers=None, index_dir=ALPHA_INDEX_DIR):
+    """
+    Index of the alphas worth computing on a dataset, saved under index_dir as <data fingerprint>.json.
+
+    Every alpha is computed once, then a single pass over the alpha matrix finds the degenerate ones (failed, all
+    NaN or constant) and the correlations between the others. The alphas are then clustered greedily, the one
+    with the most valid rows first: an alpha whose |correlation| with a kept alpha is at least max_correlation
+    joins that alpha's cluster, otherwise it is kept and starts a cluster of its own.
+
+    Build the index on the training data and pass it to every prepare_data call of the model, in-sample and
+    out-of-sample, so X keeps the same columns.
+
+    Returns:
+    alpha_index (dict): 'keep' (alphas to compute, in alpha order), 'degenerate' (alpha -> reason),
+                        'clusters' (kept alpha -> the alphas it stands for), 'rows' and 'max_correlation'.
+    """
+    alphas_df, report = compute_wqa_alphas(data, alphas, workers)
+    values = alphas_df.to_numpy()
+    accumulator = _CorrelationAccumulator(len(alphas))
+    for start_row in range(0, len(values), INDEX_CHUNK_ROWS):
+        accumulator.update(values[start_row:start_row + INDEX_CHUNK_ROWS])
+    correlation = accumulator.correlation()
+    valid_rows = np.diag(accumulator.counts)
+
+    degenerate = {alpha: f'failed: {error}' for alpha, error in report['failed'].items()}
+    for column, alpha in enumerate(alphas):
+        if alpha in degenerate:
+            continue
+        if valid_rows[column] == 0:
+            degenerate[alpha] = 'all NaN'
+        elif accumulator.min[column] == accumulator.max[column]:
+            degenerate[alpha] = 'constant'
+
+    clusters = {}
+    for column in sorted(range(len(alphas)), key=lambda column: -valid_rows[column]):
+        alpha = alphas[column]
+        if alpha in degenerate:
+            continue
+        for kept_alpha in clusters:
+            if abs(correlation[column, alphas.index(kept_alpha)]) >= max_correlation:
+                clusters[kept_alpha].append(alpha)
+                break
+        else:
+            clusters[alpha] = [alpha]
+
+    alpha_index = {'keep': [alpha for alpha in alphas if alpha in clusters], 'degenerate': degenerate, 'clusters': clusters,
+                   'rows': len(values), 'max_correlation': max_correlation}
+    os.makedirs(index_dir, exist_ok=True)
+    index_file = _alpha_index_file(data, index_dir)
+    with open(index_file + '.tmp', 'w') as f:
+        json.dump(alpha_index, f, indent=2)
+    os.replace(index_file + '.tmp', index_file)
+
+    print(f'Alpha index: keeping {len(alpha_index["keep"])} of {len(alphas)} alphas, {len(degenerate)} degenerate, '
+          f'{len(alphas) - len(degenerate) - len(clusters)} redundant at |correlation| >= {max_correlation}')
+    return alpha_index
+
+
+def load_alpha_index(data, index_dir=ALPHA_INDEX_DIR):
+    """
+    The index build_alpha_index saved for this dataset, None if there is none.
+    """
+    index_file = _alpha_index_file(data, index_dir)
+    if not os.path.exists(index_file):
+        return None
+    with open(index_file) as f:
+        return json.load(f)
@@ -37,6 +37,9 @@ from sklearn.ensemble import RandomForestClassifier
 clf = RandomForestClassifier(random_state=42)  # random forest classifier
 from joblib import dump, load
 
+from bar_funcs import BarType, bar_func, dollar_bar_func, multi_dollar_bar_func, simplify_number, merge_and_fill_dollar_bars
+from bar_cache import load_bar_data
+
 
 # %% [markdown]
 # ### Modeling
@@ -54,129 +57,7 @@ from joblib import dump, load
 
 # %% [markdown]
 # # Helper functions
-# Create dollar bars and add them to the original df
-
-# %%
-
-
-def dollar_bar_func(ohlc_df, dollar_bar_size):
-    # Calculate dollar value traded for each row
-    ohlc_df["DollarValue"] = ohlc_df["Close"] * ohlc_df["Volume"]
-
-    # Calculate cumulative dollar value
-    ohlc_df["CumulativeDollarValue"] = ohlc_df["DollarValue"].cumsum()
-
-    # Determine the number of dollar bars
-    num_bars = int(ohlc_df["CumulativeDollarValue"].iloc[-1] / dollar_bar_size)
-
-    # Generate index positions for dollar bars
-    bar_indices = [0]
-    cumulative_value = 0
-    for i in range(1, len(ohlc_df)):
-        cumulative_value += ohlc_df["DollarValue"].iloc[i]
-        if cumulative_value >= dollar_bar_size:
-            bar_indices.append(i)
-            cumulative_value = 0
-
-    # Create a new dataframe with dollar bars
-    dollar_bars = []
-    for i in range(len(bar_indices) - 1):
-        start_idx = bar_indices[i]
-        end_idx = bar_indices[i + 1]
-
-        dollar_bar = {
-            "Open": ohlc_df["Open"].iloc[start_idx],
-            "High": ohlc_df["High"].iloc[start_idx:end_idx].max(),
-            "Low": ohlc_df["Low"].iloc[start_idx:end_idx].min(),
-            "Close": ohlc_df["Close"].iloc[end_idx],
-            "Volume": ohlc_df["Volume"].iloc[start_idx:end_idx].sum(),
-            "Quote volume": ohlc_df["Quote volume"].iloc[start_idx:end_idx].sum(),
-            "Trade count": ohlc_df["Trade count"].iloc[start_idx:end_idx].sum(),
-            "Taker base volume": ohlc_df["Taker base volume"]
-            .iloc[start_idx:end_idx]
-            .sum(),
-            "Taker quote volume": ohlc_df["Taker quote volume"]
-            .iloc[start_idx:end_idx]
-            .sum(),
-        }
-
-        if isinstance(ohlc_df.index, pd.DatetimeIndex):
-            dollar_bar["Open Time"] = ohlc_df.index[start_idx]
-            dollar_bar["Close Time"] = ohlc_df.index[end_idx] - pd.Timedelta(
-                milliseconds=1
-            )
-        elif "Open Time" in ohlc_df.columns:
-            dollar_bar["Open Time"] = ohlc_df["Open Time"].iloc[start_idx]
-            dollar_bar["Close Time"] = ohlc_df["Open Time"].iloc[
-                end_idx
-            ] - pd.Timedelta(milliseconds=1)
-
-        dollar_bars.append(dollar_bar)
-
-    dollar_bars_df = pd.concat(
-        [pd.DataFrame([bar]) for bar in dollar_bars], ignore_index=True
-    )
-
-    return dollar_bars_df
-
-
-# Create a simple function to simplify the number so we can use it in our column names
-def simplify_number(num):
-    """
-    Simplifies a large number by converting it to a shorter representation with a suffix (K, M, B).
-    simplify_number(1000) -> 1K
-    """
-    suffixes = ["", "K", "M", "B"]
-    suffix_index = 0
-
-    while abs(num) >= 1000 and suffix_index < len(suffixes) - 1:
-        num /= 1000.0
-        suffix_index += 1
-
-    suffix = suffixes[suffix_index] if suffix_index > 0 else ""
-    simplified_num = f"{int(num)}{suffix}"
-
-    return simplified_num
-
-
-def merge_and_fill_dollar_bars(original_df, dollar_bars_df, dollar_bar_size):
-    # Add prefix to column names in dollar bars dataframe
-    dollar_bar_prefix = f"db_{simplify_number(dollar_bar_size)}_"
-    dollar_bars_df_renamed = dollar_bars_df.add_prefix(dollar_bar_prefix)
-
-    # Convert 'Open Time' columns to pandas datetime format and set them as index
-    dollar_bars_df_renamed.index = pd.to_datetime(
-        dollar_bars_df_renamed[dollar_bar_prefix + "Open Time"]
-    )
-
-    # Merge the dataframes on the index
-    merged_df = original_df.merge(
-        dollar_bars_df_renamed, how="left", left_index=True, right_index=True
-    )
-
-    # Set the flag for a new dollar bar with prefix
-    merged_df[dollar_bar_prefix + "NewDBFlag"] = ~merged_df[
-        dollar_bar_prefix + "Close"
-    ].isna()
-
-    # Forward fill the NaN values for all columns except the new dollar bar flag
-    columns_to_ffill = [
-        col for col in merged_df.columns if col != dollar_bar_prefix + "NewDBFlag"
-    ]
-    merged_df[columns_to_ffill] = merged_df[columns_to_ffill].fillna(method="ffill")
-
-    # Fill the remaining NaN values in the new dollar bar flag column with False
-    merged_df[dollar_bar_prefix + "NewDBFlag"] = merged_df[
-        dollar_bar_prefix + "NewDBFlag"
-    ].fillna(False)
-
-    # Assign the renamed 'Open Time' column back to the dataframe
-    merged_df[dollar_bar_prefix + "Open Time"] = merged_df[
-        dollar_bar_prefix + "Open Time"
-    ]
-
-    return merged_df
-
+# The dollar bar helpers (dollar_bar_func, merge_and_fill_dollar_bars, ...) are imported from bar_funcs.py
 
 # %% [markdown]
 # # Calculate Dollar Bars
@@ -190,6 +71,18 @@ def merge_and_fill_dollar_bars(original_df, dollar_bars_df, dollar_bar_size):
 # btc_dollar_bars.index = pd.to_datetime(btc_dollar_bars['Open Time'])
 # btc_dollar_bars.shape
 
+# %%
+# To sweep several sizes, build all of them in one pass over the minute data
+# dollar_bar_sizes = [30_000_000, 60_000_000, 90_000_000, 120_000_000]
+# btc_dollar_bars_by_size = multi_dollar_bar_func(futures_1m.get(), dollar_bar_sizes)
+# btc_dollar_bars = btc_dollar_bars_by_size[90_000_000]
+
+# %%
+# Volume, tick and taker imbalance bars have the same columns as dollar bars, so any of them can go through prepare_data
+# btc_dollar_bars = bar_func(futures_1m.get(), BarType.VOLUME, 3_000)
+# btc_dollar_bars = bar_func(futures_1m.get(), BarType.TICK, 2_000_000)
+# btc_dollar_bars = bar_func(futures_1m.get(), BarType.IMBALANCE, 500)
+
 # %%
 # Convert the dataframe back into a vbt data object
 # btc_90M_db_vbt = vbt.BinanceData.from_data(btc_dollar_bars)
@@ -200,17 +93,18 @@ def merge_and_fill_dollar_bars(original_df, dollar_bars_df, dollar_bar_size):
 # btc_90M_db_vbt.save('btc_90M_db_vbt.pkl')
 
 # %% [markdown]
-# # Load the dollar bars from pickle file
-
-# %%
-btc_90M_db_vbt = vbt.BinanceData.load("data/btc_90M_db_vbt.pkl")
+# # Load the dollar bars from the bar cache
+# The bars are built from the minute data on the first run and read back from data/bar_cache after that.
+# Only the requested date range is read from disk.
 
 # %% [markdown]
 # Take a small slice of the data for train/testing and leave some to be out of sample
 
 # %%
-data = btc_90M_db_vbt["2021-01-01":"2023-01-01"]
-outofsample_data = btc_90M_db_vbt["2023-01-01":"2023-06-03"]
+# The production model was trained on the bars of this script's old dollar_bar_func, whose Close and Close Time came from the
+# row that opens the next bar. next_row_close keeps building those bars, set it to False only together with retraining the model.
+data = load_bar_data(bar_size=90_000_000, start="2021-01-01", end="2023-01-01", next_row_close=True)
+outofsample_data = load_bar_data(bar_size=90_000_000, start="2023-01-01", end="2023-06-03", next_row_close=True)
 print(data.shape)
 print(outofsample_data.shape)
 